@@ -0,0 +1,309 @@
+"""
+Benchmark of the browser bound flows against the fake WebDriver: wall time, driver round trips,
+and the time elements sat ready before a wait noticed them. Compare with a previous run to catch
+regressions in the number of round trips or in the wall time.
+
+    python -m benchmarks.bench_flows --json flows.json
+    python -m benchmarks.bench_flows --appear_ms 100 --baseline flows.json
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from selenium.webdriver.common.by import By
+
+from benchmarks.fake_webdriver import FakeElement, FakePage, FakeWebDriver
+
+DOMAIN = "bench"
+BASE_URL = f"https://{DOMAIN}.udemy.com"
+COURSE_ID = 100000
+COURSE_SLUG = "bench-course-0"
+QUIZ_ID = 5000
+ATTEMPT_ID = 50001
+ASSESSMENT_ID = 7000
+CODING_FILE = "solution.py"
+AUTH_COOKIES = [
+    {"name": "access_token", "value": "benchmark-token", "expiry": int(time.time()) + 365 * 24 * 60 * 60},
+    {"name": "csrftoken", "value": "benchmark-token"},
+    {"name": "client_id", "value": "benchmark-client"},
+]
+
+
+def xpath(value: str, **kwargs) -> FakeElement:
+    return FakeElement([(By.XPATH, value)], **kwargs)
+
+
+def login_pages(appear: float) -> List[FakePage]:
+    logged_in = [
+        xpath("//a[@data-purpose='user-dropdown']", tag_name="a", appear_after=appear),
+        FakeElement(attributes={"id": DOMAIN}, appear_after=appear),
+    ]
+
+    def login(driver: FakeWebDriver, element: FakeElement) -> None:
+        driver.set_cookies(AUTH_COOKIES)
+        driver.reveal(*logged_in)
+
+    return [
+        FakePage(rf"^{BASE_URL}/?$", title="Login", elements=[
+            FakeElement([(By.XPATH, '//*[@id="credsDiv"]')], attributes={"id": "credsDiv"}, appear_after=appear),
+            FakeElement(tag_name="input", attributes={"id": "user-name-input"}, appear_after=appear),
+            FakeElement(tag_name="input", attributes={"name": "password"}, appear_after=appear),
+            FakeElement(tag_name="label", attributes={"name": "checkbox1_lbl"}, appear_after=appear),
+            FakeElement(tag_name="button", attributes={"id": "login-button"}, appear_after=appear, on_click=login),
+        ]),
+    ]
+
+
+def course_pages(appear: float) -> List[FakePage]:
+    return [
+        FakePage(
+            rf"^{BASE_URL}/course/{COURSE_ID}/$",
+            title="Benchmark course",
+            redirect_to=f"{BASE_URL}/course/{COURSE_SLUG}/learn/lecture/1#overview",
+            elements=[
+                xpath(
+                    "//div[starts-with(@class, 'ud-app-loader')][@data-module-args]",
+                    attributes={"class": "ud-app-loader", "data-module-args": json.dumps({"courseId": COURSE_ID})},
+                    appear_after=appear,
+                ),
+                xpath("//button[@data-purpose='buy-this-course-button']", tag_name="button", appear_after=appear),
+            ],
+        ),
+    ]
+
+
+def quiz_pages(appear: float) -> List[FakePage]:
+    answers = xpath(
+        "//ul[@aria-labelledby='question-prompt']",
+        tag_name="ul",
+        children=[FakeElement(tag_name="li", text=f"Answer {index}") for index in range(4)],
+        appear_after=appear,
+    )
+
+    def submit(driver: FakeWebDriver, element: FakeElement) -> None:
+        driver.log_request(
+            f"{BASE_URL}/api-2.0/users/me/subscribed-courses/{COURSE_ID}/user-attempted-quizzes/"
+            f"{ATTEMPT_ID}/assessment-answers/",
+            "POST",
+        )
+
+    next_button = xpath("//button[@data-purpose='next-question-button']", tag_name="button",
+                        appear_after=appear, on_click=submit)
+
+    def start(driver: FakeWebDriver, element: FakeElement) -> None:
+        driver.reveal(answers, next_button)
+
+    return course_pages(appear) + [
+        FakePage(rf"/course/{COURSE_SLUG}/learn/quiz/{QUIZ_ID}#overview$", title="Quiz", elements=[
+            xpath("//button[@data-purpose='start-quiz']", tag_name="button", appear_after=appear, on_click=start),
+        ]),
+    ]
+
+
+def coding_pages(appear: float) -> List[FakePage]:
+    next_button = xpath("//div[@data-purpose='go-to-next']", appear_after=appear)
+    feedback = xpath("//div[@data-purpose='feedback-title']", text="Good job!", appear_after=appear)
+
+    def check(driver: FakeWebDriver, element: FakeElement) -> None:
+        driver.reveal(feedback, next_button)
+
+    return course_pages(appear) + [
+        FakePage(rf"/course/{COURSE_SLUG}/learn/quiz/{QUIZ_ID}#overview$", title="Coding exercise", elements=[
+            FakeElement(
+                [(By.XPATH, f"//button//div[contains(text(), '{CODING_FILE}')]")], text=CODING_FILE,
+                appear_after=appear,
+            ),
+            FakeElement(attributes={"id": "editor"}, appear_after=appear),
+            xpath("//button[@data-purpose='check-button']", tag_name="button", appear_after=appear, on_click=check),
+        ]),
+    ]
+
+
+def scraper_pages(appear: float, num_links: int = 50) -> List[FakePage]:
+    links = [
+        FakeElement(
+            [(By.XPATH, "//a[contains(@href, '/course/')]")], tag_name="a",
+            attributes={"href": f"/course/bench-course-{index}/"}, text=f"Course {index}", appear_after=appear,
+        )
+        for index in range(num_links)
+    ]
+    return [
+        FakePage(rf"^{BASE_URL}/organization/home/$", title="Home", elements=[
+            FakeElement([(By.XPATH, "/html/body")], tag_name="body", children=links),
+        ]),
+    ]
+
+
+def make_settings():
+    from watcher_udemy import Settings
+
+    return Settings(account={"domain": DOMAIN, "email": "bench@example.com", "password": "bench"})
+
+
+def make_actions(driver: FakeWebDriver):
+    from watcher_udemy import UdemyActionsUI
+
+    return UdemyActionsUI(driver, make_settings())
+
+
+def flow_login(driver: FakeWebDriver):
+    udemy_actions = make_actions(driver)
+    if os.path.isfile(udemy_actions._cookie_file):
+        os.remove(udemy_actions._cookie_file)
+    return lambda: udemy_actions.login() or udemy_actions.logged_in
+
+
+def flow_enroll(driver: FakeWebDriver):
+    udemy_actions = make_actions(driver)
+    return lambda: udemy_actions.enroll(f"{BASE_URL}/course/{COURSE_ID}/")[2] == COURSE_ID
+
+
+def flow_quiz(driver: FakeWebDriver):
+    from watcher_udemy.assessments import AssessmentRecord
+
+    udemy_actions = make_actions(driver)
+    record = AssessmentRecord(ASSESSMENT_ID, "multiple-choice", ["b"], QUIZ_ID, "simple-quiz", 1)
+    # the flow hands back the assessment answers url the quiz posted to
+    return lambda: str(ATTEMPT_ID) in (udemy_actions._solve_first_quiz_with_driver_test(COURSE_ID, record) or "")
+
+
+def flow_coding(driver: FakeWebDriver):
+    from watcher_udemy.assessments import AssessmentRecord
+
+    udemy_actions = make_actions(driver)
+    prompt = {"solution_files": [{"file_name": CODING_FILE, "content": "print('hello')"}]}
+    record = AssessmentRecord(
+        ASSESSMENT_ID, "coding-problem", None, QUIZ_ID, "coding-exercise", 1, prompt=prompt
+    )
+
+    def solve():
+        udemy_actions._solve_coding_problem(COURSE_ID, record)
+        return any(script.startswith("ace.edit") for script in driver.executed_scripts)
+
+    return solve
+
+
+def flow_scraper(driver: FakeWebDriver):
+    from watcher_udemy.scrapers.scraper_base import UdemyScraper
+
+    scraper = UdemyScraper(True, driver, make_settings())
+    return lambda: len(asyncio.run(scraper.get_links(DOMAIN))[1]) == 50
+
+
+# name -> (pages of the flow, flow factory returning the call to time)
+FLOWS: Dict[str, tuple] = {
+    "login": (login_pages, flow_login),
+    "enroll": (course_pages, flow_enroll),
+    "quiz": (quiz_pages, flow_quiz),
+    "coding": (coding_pages, flow_coding),
+    "scraper": (scraper_pages, flow_scraper),
+}
+
+
+def run_flow(name: str, repeat: int, command_latency: float, page_load_latency: float, appear: float) -> Dict:
+    """
+    Run a flow repeat times, each on a new fake driver
+
+    :return: mean wall time, round trips, injected latency, ready lag and missed finds of a run
+    """
+    pages, flow_factory = FLOWS[name]
+    totals = {"wall": 0.0, "round_trips": 0, "injected_latency": 0.0, "ready_lag": 0.0, "missed_finds": 0}
+    commands = {}
+    succeeded = True
+    for _ in range(repeat):
+        driver = FakeWebDriver(pages(appear), command_latency, page_load_latency)
+        flow: Callable = flow_factory(driver)
+        driver.reset_counters()
+        start = time.perf_counter()
+        succeeded = bool(flow()) and succeeded
+        totals["wall"] += time.perf_counter() - start
+        totals["round_trips"] += driver.round_trips
+        totals["injected_latency"] += driver.injected_latency
+        totals["ready_lag"] += driver.ready_lag
+        totals["missed_finds"] += driver.missed_finds
+        for command, count in driver.commands.items():
+            commands[command] = commands.get(command, 0) + count
+    return {
+        "flow": name,
+        "succeeded": succeeded,
+        **{key: value / repeat for key, value in totals.items()},
+        "commands": {command: count / repeat for command, count in sorted(commands.items())},
+    }
+
+
+def find_regressions(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    baseline = {result["flow"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["flow"])
+        if previous is None:
+            continue
+        if result["round_trips"] > previous["round_trips"]:
+            regressions.append(
+                f"{result['flow']}: {result['round_trips']:.0f} round trips, {previous['round_trips']:.0f} before"
+            )
+        if result["wall"] > previous["wall"] * (1 + tolerance):
+            regressions.append(f"{result['flow']}: {result['wall']:.2f}s, {previous['wall']:.2f}s before")
+    return regressions
+
+
+def print_table(results: List[Dict]) -> None:
+    columns = (
+        ("flow", "{}"), ("succeeded", "{}"), ("wall", "{:.2f}s"), ("round_trips", "{:.0f}"),
+        ("injected_latency", "{:.2f}s"), ("ready_lag", "{:.2f}s"), ("missed_finds", "{:.0f}"),
+    )
+    rows = [[column for column, _ in columns]]
+    rows += [[fmt.format(result[column]) for column, fmt in columns] for result in results]
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the browser flows against a fake WebDriver")
+    parser.add_argument("--flows", type=str, default=",".join(FLOWS), help=f"Comma separated flows among {', '.join(FLOWS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every flow")
+    parser.add_argument("--command_latency_ms", type=float, default=2.0, help="Latency of every driver command")
+    parser.add_argument("--page_load_ms", type=float, default=200.0, help="Latency of a page load")
+    parser.add_argument("--appear_ms", type=float, default=0.0, help="Delay before the elements show up in the page")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Wall time increase tolerated over the baseline")
+    args = parser.parse_args(args)
+
+    names = [name.strip() for name in args.flows.split(",") if name.strip()]
+    unknown = [name for name in names if name not in FLOWS]
+    if unknown:
+        parser.error(f"Unknown flows: {', '.join(unknown)}")
+
+    # the app dir, its logs and its caches, live in a temporary home. Registered before the app is
+    # imported, so it's removed after the app saved its caches at exit
+    home = tempfile.mkdtemp(prefix="bench-flows-")
+    atexit.register(shutil.rmtree, home, ignore_errors=True)
+    os.environ["HOME"] = os.environ["USERPROFILE"] = home
+    results = [
+        run_flow(name, args.repeat, args.command_latency_ms / 1000, args.page_load_ms / 1000, args.appear_ms / 1000)
+        for name in names
+    ]
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Offline performance regression test: replay the same recorded api session against several builds
+of the project and compare their request counts and wall time. Recordings are made with --record,
+on a real account, or with bench_runner --record against the mock api. The builds are checkouts of
+the repository that include the replay transport. A run of several accounts records one file per
+worker process, they are replayed together.
+
+    python -m benchmarks.bench_replay recordings/small.jsonl.gz
+    python -m benchmarks.bench_replay session.jsonl.*.gz --urls urls.txt
+    python -m benchmarks.bench_replay session.jsonl.gz --urls urls.txt --builds ../baseline,. --scale 0
+"""
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.bench_runner import REPO_DIR, write_cookie_cache
+
+
+def read_header(recording: str) -> Dict:
+    with gzip.open(recording, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+    if header.get("type") != "header":
+        raise ValueError(f"{recording} isn't a recording")
+    return header
+
+
+def default_urls_file(recording: str) -> Optional[str]:
+    """
+    Urls file bench_runner --record saves next to the recording
+    """
+    base = recording[:-len(".jsonl.gz")] if recording.endswith(".jsonl.gz") else recording
+    urls_file = f"{base}.urls.txt"
+    return urls_file if os.path.isfile(urls_file) else None
+
+
+def run_child(build: str, urls_file: str, domain: str) -> Dict:
+    """
+    Body of the replay process: run the runner of the build on the urls, answered from the recording
+    """
+    sys.path.insert(0, build)
+    import logging
+
+    from watcher_udemy import Settings
+    from watcher_udemy.recording import REPLAY_ENV, get_replay
+    from watcher_udemy.runner import _watch_courses_ui
+
+    try:
+        from watcher_udemy.logging import get_log_handlers
+        handlers = get_log_handlers()
+    except ImportError:
+        # builds from before the background log writer
+        handlers = logging.getLogger("watcher_udemy").handlers
+    for handler in handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setLevel(logging.WARNING)
+
+    settings = Settings(account={"domain": domain, "email": "replay@example.com", "password": "replay"})
+    start = time.perf_counter()
+    stats = _watch_courses_ui(None, settings, None, False, True, urls_file)
+    elapsed = time.perf_counter() - start
+    replay = get_replay(os.environ[REPLAY_ENV]).stats()
+    return {
+        "elapsed": elapsed,
+        "courses_completed": stats.courses_completed,
+        "courses_failed": stats.courses_failed,
+        "requests": replay["served"] + replay["missed"],
+        "missed": replay["missed"],
+        "waited": replay["waited"],
+    }
+
+
+def run_build(build: str, recordings: List[str], urls_file: str, domain: str, scale: float) -> Dict:
+    """
+    Replay the recordings against a build, in a fresh home directory
+
+    :param str build: checkout of the repository
+    :param list recordings: recordings made with --record
+    :param str urls_file: course urls of the recorded session
+    :param str domain: udemy domain of the recorded session
+    :param float scale: factor applied to the recorded response times
+    :return: results of the build
+    """
+    with tempfile.TemporaryDirectory(prefix="bench-replay-") as home:
+        write_cookie_cache(os.path.join(home, ".watcher_udemy"))
+        env = dict(
+            os.environ, HOME=home, USERPROFILE=home,
+            WATCHER_UDEMY_REPLAY=",".join(os.path.abspath(recording) for recording in recordings),
+            WATCHER_UDEMY_REPLAY_SCALE=str(scale),
+        )
+        env.pop("WATCHER_UDEMY_RECORD", None)
+        env.pop("WATCHER_UDEMY_API_BASE_URL", None)
+        command = [
+            sys.executable, "-m", "benchmarks.bench_replay", *recordings,
+            "--child", os.path.abspath(build), "--urls", os.path.abspath(urls_file), "--domain", domain,
+        ]
+        child = subprocess.run(command, cwd=REPO_DIR, env=env, stdout=subprocess.PIPE, text=True)
+        if child.returncode != 0:
+            raise RuntimeError(f"The replay of {build} failed with exit code {child.returncode}")
+    return {"build": build, **json.loads(child.stdout.strip().splitlines()[-1])}
+
+
+def print_table(results: List[Dict]) -> None:
+    baseline = results[0]
+    columns = ("build", "elapsed", "delta", "requests", "delta_requests", "missed", "courses_completed")
+    rows = [list(columns)]
+    for result in results:
+        delta = (result["elapsed"] / baseline["elapsed"] - 1) * 100 if baseline["elapsed"] else 0.0
+        rows.append([
+            result["build"], f"{result['elapsed']:.2f}s", f"{delta:+.1f}%", str(result["requests"]),
+            f"{result['requests'] - baseline['requests']:+d}", str(result["missed"]),
+            str(result["courses_completed"]),
+        ])
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Compare builds on the same recorded api session")
+    parser.add_argument(
+        "recordings", type=str, nargs="+",
+        help="Recordings made with --record, the files of the worker processes of a run together",
+    )
+    parser.add_argument(
+        "--builds", type=str, default=REPO_DIR,
+        help="Comma separated checkouts to compare, the first one is the baseline",
+    )
+    parser.add_argument(
+        "--urls", type=str, default=None,
+        help="Course urls of the recorded session, defaults to the urls file bench_runner saved with it",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0,
+        help="Factor applied to the recorded response times, 0 to compare the work done without the network",
+    )
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--domain", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.urls, args.domain)))
+        return
+
+    urls_file = args.urls or default_urls_file(args.recordings[0])
+    if urls_file is None:
+        parser.error("No urls file found next to the recording, pass --urls")
+    domain = read_header(args.recordings[0]).get("domain") or "www"
+    results = []
+    for build in (build.strip() for build in args.builds.split(",") if build.strip()):
+        print(f"Replaying against {build}", file=sys.stderr)
+        results.append(run_build(build, args.recordings, urls_file, domain, args.scale))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+End-to-end benchmark of the runner against the local mock api. Every scenario runs in its own
+process, with its own home directory and mock server, and reports requests/sec, courses/hour
+and the peak RSS of the runner.
+
+    python -m benchmarks.bench_runner
+    python -m benchmarks.bench_runner --scenarios small,deep --json results.json
+    python -m benchmarks.bench_runner --scenarios small --record recordings
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the peak RSS is left out
+    resource = None
+
+from benchmarks.mock_udemy import SLUG_PREFIX
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (mock server arguments, runner options)
+SCENARIOS: Dict[str, Dict] = {
+    "small": {
+        "mock": {"num_courses": 20, "lectures_per_course": 20, "quizzes_per_course": 1},
+        "runner": {},
+    },
+    "wide": {
+        "mock": {"num_courses": 1000, "lectures_per_course": 5, "quizzes_per_course": 0, "latency_ms": 5},
+        "runner": {},
+    },
+    "deep": {
+        "mock": {"num_courses": 3, "lectures_per_course": 1400, "quizzes_per_course": 10,
+                 "assessments_per_quiz": 20, "latency_ms": 5},
+        "runner": {},
+    },
+    "enroll": {
+        "mock": {"num_courses": 200, "lectures_per_course": 10, "quizzes_per_course": 0, "subscribed_ratio": 0.0,
+                 "latency_ms": 5},
+        "runner": {"api_enroll": True},
+    },
+    "flaky": {
+        "mock": {"num_courses": 50, "lectures_per_course": 20, "latency_ms": 20, "jitter_ms": 80,
+                 "error_rate": 0.01},
+        "runner": {},
+    },
+    "throttled": {
+        "mock": {"num_courses": 20, "lectures_per_course": 50, "max_rps": 100},
+        "runner": {},
+    },
+    "xl": {
+        "mock": {"num_courses": 10000, "lectures_per_course": 3, "quizzes_per_course": 0},
+        "runner": {},
+    },
+}
+DEFAULT_SCENARIOS = ("small", "wide", "deep", "enroll", "flaky", "throttled")
+
+
+def start_mock(mock_args: Dict) -> Tuple[subprocess.Popen, str]:
+    """
+    Start the mock server in its own process, so it doesn't compete with the runner for the GIL
+
+    :param dict mock_args: MockConfig fields
+    :return: the process and the base url of the server
+    """
+    command = [sys.executable, "-m", "benchmarks.mock_udemy"]
+    for field, value in mock_args.items():
+        command += [f"--{field}", str(value)]
+    process = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        process.kill()
+        raise RuntimeError(f"The mock server didn't start: {' '.join(command)}")
+    return process, base_url
+
+
+def write_cookie_cache(app_dir: str) -> None:
+    """
+    Cookie cache holding a long lived token, so the runner logs in without the browser
+    """
+    os.makedirs(app_dir, exist_ok=True)
+    expiry = int(time.time()) + 365 * 24 * 60 * 60
+    cookies = [
+        {"name": "access_token", "value": "benchmark-token", "expiry": expiry},
+        {"name": "csrftoken", "value": "benchmark-token"},
+        {"name": "client_id", "value": "benchmark-client"},
+    ]
+    with open(os.path.join(app_dir, ".cookie"), "w") as f:
+        json.dump({"cookies": cookies, "access_token_expiry": expiry, "validated_at": time.time()}, f)
+
+
+def write_fixtures(app_dir: str, urls_file: str, num_courses: int) -> None:
+    """
+    Cookie cache and the file of course urls, by slug so they go through the resolver
+    """
+    write_cookie_cache(app_dir)
+    with open(urls_file, "w") as f:
+        for index in range(num_courses):
+            f.write(f"https://bench.udemy.com/course/{SLUG_PREFIX}{index}/\n")
+
+
+def run_child(urls_file: str, api_enroll: bool) -> Dict:
+    """
+    Body of the scenario process: run the runner end-to-end on the urls file, without a browser
+    """
+    import logging
+
+    from watcher_udemy import Settings
+    from watcher_udemy.logging import get_log_handlers
+    from watcher_udemy.runner import _watch_courses_ui
+
+    # the file handler still logs everything, the console only gets the problems
+    for handler in get_log_handlers():
+        if type(handler) is logging.StreamHandler:
+            handler.setLevel(logging.WARNING)
+
+    settings = Settings(account={"domain": "bench", "email": "bench@example.com", "password": "bench"})
+    start = time.perf_counter()
+    stats = _watch_courses_ui(None, settings, None, False, True, urls_file, api_enroll=api_enroll)
+    elapsed = time.perf_counter() - start
+    return {
+        "elapsed": elapsed,
+        "courses_completed": stats.courses_completed,
+        "courses_failed": stats.courses_failed,
+        "enrolled": stats.enrolled,
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None,
+    }
+
+
+def run_scenario(name: str, record_dir: Optional[str] = None) -> Dict:
+    """
+    Run a scenario against a fresh mock server, in a fresh home directory
+
+    :param str name: name of the scenario
+    :param str record_dir: Record the api exchanges of the scenario, and its urls, in this directory
+        for benchmarks.bench_replay
+    :return: results of the scenario
+    """
+    scenario = SCENARIOS[name]
+    mock_process, base_url = start_mock(scenario["mock"])
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as home:
+            urls_file = os.path.join(home, "urls.txt")
+            write_fixtures(os.path.join(home, ".watcher_udemy"), urls_file, scenario["mock"]["num_courses"])
+            env = dict(os.environ, HOME=home, USERPROFILE=home, WATCHER_UDEMY_API_BASE_URL=base_url)
+            if record_dir:
+                os.makedirs(record_dir, exist_ok=True)
+                shutil.copyfile(urls_file, os.path.join(record_dir, f"{name}.urls.txt"))
+                env["WATCHER_UDEMY_RECORD"] = os.path.abspath(os.path.join(record_dir, f"{name}.jsonl.gz"))
+            command = [sys.executable, "-m", "benchmarks.bench_runner", "--child", urls_file]
+            if scenario["runner"].get("api_enroll"):
+                command.append("--api_enroll")
+            child = subprocess.run(command, cwd=REPO_DIR, env=env, stdout=subprocess.PIPE, text=True)
+            if child.returncode != 0:
+                raise RuntimeError(f"Scenario {name} failed with exit code {child.returncode}")
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+        server_stats = requests.get(f"{base_url}/__stats__", timeout=10).json()
+    finally:
+        mock_process.terminate()
+        mock_process.wait()
+
+    elapsed = result["elapsed"]
+    return {
+        "scenario": name,
+        **result,
+        "requests": server_stats["requests"],
+        "throttled": server_stats["by_status"].get("429", 0),
+        "errors": server_stats["by_status"].get("500", 0),
+        "requests_per_sec": server_stats["requests"] / elapsed if elapsed else None,
+        "courses_per_hour": result["courses_completed"] / elapsed * 3600 if elapsed else None,
+        "by_endpoint": server_stats["by_endpoint"],
+    }
+
+
+def print_table(results: List[Dict]) -> None:
+    columns = (
+        ("scenario", "{}"), ("elapsed", "{:.1f}s"), ("courses_completed", "{}"), ("courses_failed", "{}"),
+        ("requests", "{}"), ("throttled", "{}"), ("errors", "{}"), ("requests_per_sec", "{:.0f}"),
+        ("courses_per_hour", "{:.0f}"), ("peak_rss_mb", "{:.0f}"),
+    )
+    rows = [[column for column, _ in columns]]
+    for result in results:
+        rows.append([
+            fmt.format(result[column]) if result.get(column) is not None else "-" for column, fmt in columns
+        ])
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the runner against the mock api")
+    parser.add_argument(
+        "--scenarios", type=str, default=",".join(DEFAULT_SCENARIOS),
+        help=f"Comma separated scenarios among {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    parser.add_argument(
+        "--record", type=str, default=None,
+        help="Record the api exchanges of every scenario in this directory, to replay them with bench_replay",
+    )
+    parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--api_enroll", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.api_enroll)))
+        return
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    results = []
+    for name in names:
+        print(f"Running scenario {name}", file=sys.stderr)
+        results.append(run_scenario(name, args.record))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Startup benchmark: time taken by a fresh process to import the package, run a command that doesn't
+open a browser, and send its first api request to the local mock api. Every run is a new interpreter
+started with -X importtime, in a fresh home directory, so the results are reproducible.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 10 --top 15 --json startup.json
+    python -m benchmarks.bench_startup --budget_ms 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.bench_runner import REPO_DIR, start_mock, write_cookie_cache
+
+FIRST_REQUEST_CODE = """
+import time
+from watcher_udemy import Settings, UdemyActionsUI
+
+settings = Settings(account={"domain": "bench", "email": "bench@example.com", "password": "bench"})
+udemy_actions = UdemyActionsUI(None, settings)
+udemy_actions.session.get(udemy_actions.VALIDATE_TOKEN_URL, timeout=10)
+print(time.time())
+"""
+
+# name -> code run by the interpreter
+SCENARIOS: Dict[str, str] = {
+    "package": "import watcher_udemy",
+    "status": "import sys; sys.argv = ['udemy_watcher.py', '--status']; from watcher_udemy.cli import main; main()",
+    "api": "import watcher_udemy.udemy_ui",
+    "first_request": FIRST_REQUEST_CODE,
+}
+
+
+def parse_importtime(stderr: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Parse the -X importtime report of a process
+
+    :param str stderr: standard error of the process
+    :return: total import time in ms, and the cumulative time in ms of every module
+    """
+    total_us = 0
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1000
+        # the modules imported by the process, not by another module, are the ones without indentation
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def run_once(name: str, env: Dict[str, str]) -> Dict:
+    start = time.time()
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCENARIOS[name]],
+        cwd=REPO_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    wall = time.time() - start
+    if child.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed with exit code {child.returncode}:\n{child.stderr[-2000:]}")
+    import_ms, modules = parse_importtime(child.stderr)
+    result = {"wall_ms": wall * 1000, "import_ms": import_ms, "modules": modules}
+    if name == "first_request":
+        result["first_request_ms"] = (float(child.stdout.strip().splitlines()[-1]) - start) * 1000
+    return result
+
+
+def run_scenario(name: str, repeat: int, base_url: Optional[str]) -> Dict:
+    """
+    Run a scenario repeat times, after a run warming the bytecode and disk caches
+
+    :param str name: name of the scenario
+    :param int repeat: measured runs
+    :param str base_url: url of the mock api, for the first request scenario
+    :return: median timings of the runs, and the modules of the last one
+    """
+    with tempfile.TemporaryDirectory(prefix=f"bench-startup-{name}-") as home:
+        write_cookie_cache(os.path.join(home, ".watcher_udemy"))
+        env = dict(os.environ, HOME=home, USERPROFILE=home)
+        if base_url:
+            env["WATCHER_UDEMY_API_BASE_URL"] = base_url
+        run_once(name, env)
+        runs = [run_once(name, env) for _ in range(repeat)]
+    result = {"scenario": name, "modules_imported": len(runs[-1]["modules"])}
+    for key in ("wall_ms", "import_ms", "first_request_ms"):
+        if key in runs[0]:
+            result[key] = statistics.median(run[key] for run in runs)
+    result["modules"] = runs[-1]["modules"]
+    return result
+
+
+def print_table(results: List[Dict], top: int) -> None:
+    columns = (
+        ("scenario", "{}"), ("wall_ms", "{:.0f}"), ("import_ms", "{:.0f}"), ("first_request_ms", "{:.0f}"),
+        ("modules_imported", "{}"),
+    )
+    rows = [[column for column, _ in columns]]
+    for result in results:
+        rows.append([
+            fmt.format(result[column]) if result.get(column) is not None else "-" for column, fmt in columns
+        ])
+    widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+    for result in results:
+        if top:
+            print(f"\nSlowest imports of {result['scenario']} (cumulative ms):")
+            for module, cumulative in sorted(result["modules"].items(), key=lambda item: -item[1])[:top]:
+                print(f"  {cumulative:8.1f}  {module}")
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Startup benchmark of the package and the cli")
+    parser.add_argument(
+        "--scenarios", type=str, default=",".join(SCENARIOS),
+        help=f"Comma separated scenarios among {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Measured runs of every scenario")
+    parser.add_argument("--top", type=int, default=0, help="Show the slowest imports of every scenario")
+    parser.add_argument("--json", type=str, default=None, help="Write the results to this file")
+    parser.add_argument(
+        "--budget_ms", type=float, default=None,
+        help="Exit with an error when the time to first request, or the wall time, of a scenario exceeds it",
+    )
+    args = parser.parse_args(args)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    mock_process, base_url = start_mock({"num_courses": 1}) if "first_request" in names else (None, None)
+    results = []
+    try:
+        for name in names:
+            print(f"Running scenario {name}", file=sys.stderr)
+            results.append(run_scenario(name, args.repeat, base_url))
+    finally:
+        if mock_process is not None:
+            mock_process.terminate()
+            mock_process.wait()
+    print_table(results, args.top)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.budget_ms is not None:
+        over = [
+            result["scenario"] for result in results
+            if result.get("first_request_ms", result["wall_ms"]) > args.budget_ms
+        ]
+        if over:
+            print(f"Over the {args.budget_ms:.0f}ms budget: {', '.join(over)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Scriptable stand-in for the subset of the Selenium WebDriver api the project calls, so the browser
+bound flows can be benchmarked offline. Pages are fixtures matched on the url, their elements are
+found by the exact locators the code uses, can show up or become clickable after a delay, and run
+a callback when clicked. Every driver command is counted and can be given a latency, like the
+round trip to chromedriver.
+"""
+import html
+import itertools
+import json
+import re
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+
+Locator = Tuple[str, str]
+
+
+class FakeElement:
+    """
+    Element of a fake page. Besides the locators given, it is found by its tag name, id, name and classes
+    """
+
+    def __init__(
+            self,
+            locators: Iterable[Locator] = (),
+            tag_name: str = "div",
+            text: str = "",
+            attributes: Optional[Dict[str, str]] = None,
+            children: Iterable["FakeElement"] = (),
+            appear_after: float = 0.0,
+            clickable_after: float = 0.0,
+            displayed: bool = True,
+            on_click: Optional[Callable[["FakeWebDriver", "FakeElement"], None]] = None,
+    ):
+        """
+        :param locators: (By, value) pairs the element answers to, e.g. (By.XPATH, "//button[@data-purpose='x']")
+        :param str tag_name: tag of the element
+        :param str text: visible text
+        :param dict attributes: html attributes
+        :param children: elements found through this one
+        :param float appear_after: seconds after the page load, or the reveal, before the element is in the page
+        :param float clickable_after: seconds after it appeared before the element is enabled
+        :param bool displayed: visibility of the element
+        :param on_click: called with the driver and the element when clicked
+        """
+        self.attributes = dict(attributes or {})
+        self.locators = set(locators)
+        self.locators.add((By.TAG_NAME, tag_name))
+        if "id" in self.attributes:
+            self.locators.add((By.ID, self.attributes["id"]))
+        if "name" in self.attributes:
+            self.locators.add((By.NAME, self.attributes["name"]))
+        for class_name in self.attributes.get("class", "").split():
+            self.locators.add((By.CLASS_NAME, class_name))
+        self.tag_name = tag_name
+        self._text = text
+        self.children = list(children)
+        self.appear_after = appear_after
+        self.clickable_after = clickable_after
+        self.displayed = displayed
+        self.on_click = on_click
+        self.keys_sent: List[str] = []
+        self.clicks = 0
+        self._driver: Optional["FakeWebDriver"] = None
+        self.available_at = 0.0
+        self.found = False
+
+    def _attach(self, driver: "FakeWebDriver", available_at: float) -> None:
+        self._driver = driver
+        self.available_at = available_at + self.appear_after
+        self.found = False
+        for child in self.children:
+            child._attach(driver, self.available_at)
+
+    def matches(self, by: str, value: str) -> bool:
+        return (by, value) in self.locators
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.available_at
+
+    # webdriver api
+
+    @property
+    def text(self) -> str:
+        self._driver._command("element_text")
+        return self._text
+
+    def get_attribute(self, name: str) -> Optional[str]:
+        self._driver._command("element_attribute")
+        if name == "innerHTML":
+            return self.inner_html()
+        if name == "outerHTML":
+            return self.outer_html()
+        return self.attributes.get(name)
+
+    def is_displayed(self) -> bool:
+        self._driver._command("element_displayed")
+        return self.displayed
+
+    def is_enabled(self) -> bool:
+        self._driver._command("element_enabled")
+        return time.monotonic() >= self.available_at + self.clickable_after
+
+    def click(self) -> None:
+        self._driver._command("element_click")
+        self.clicks += 1
+        if self.on_click is not None:
+            self.on_click(self._driver, self)
+
+    def send_keys(self, *keys) -> None:
+        self._driver._command("element_send_keys")
+        self.keys_sent.append("".join(str(key) for key in keys))
+
+    def find_element(self, by: str = By.ID, value: Optional[str] = None) -> "FakeElement":
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"No child element {by}={value}")
+        return elements[0]
+
+    def find_elements(self, by: str = By.ID, value: Optional[str] = None) -> List["FakeElement"]:
+        self._driver._command("find_child_elements")
+        return self._driver._match(self.children, by, value)
+
+    def iter_tree(self):
+        yield self
+        for child in self.children:
+            yield from child.iter_tree()
+
+    # html
+
+    def inner_html(self) -> str:
+        return html.escape(self._text) + "".join(child.outer_html() for child in self.children)
+
+    def outer_html(self) -> str:
+        attributes = "".join(f' {name}="{html.escape(value)}"' for name, value in self.attributes.items())
+        return f"<{self.tag_name}{attributes}>{self.inner_html()}</{self.tag_name}>"
+
+    def __repr__(self) -> str:
+        return f"FakeElement({self.tag_name}, {sorted(self.locators)[:2]})"
+
+
+class FakePage:
+    """
+    Page served for the urls matching a pattern
+    """
+
+    def __init__(
+            self,
+            url_pattern: str,
+            title: str = "",
+            elements: Iterable[FakeElement] = (),
+            page_source: Optional[str] = None,
+            redirect_to: Optional[str] = None,
+            ready_after: float = 0.0,
+            scripts: Optional[Dict[str, object]] = None,
+            on_load: Optional[Callable[["FakeWebDriver", "FakePage"], None]] = None,
+    ):
+        """
+        :param str url_pattern: regex searched in the requested url
+        :param str title: title of the page
+        :param elements: elements of the page
+        :param str page_source: html of the page, built from the elements if None
+        :param str redirect_to: url the browser ends up on, current_url returns it
+        :param float ready_after: seconds after the load before document.readyState is complete
+        :param dict scripts: script -> value returned, or callable taking the driver and the arguments
+        :param on_load: called with the driver and the page once loaded
+        """
+        self.url_pattern = re.compile(url_pattern)
+        self.title = title
+        self.elements = list(elements)
+        self._page_source = page_source
+        self.redirect_to = redirect_to
+        self.ready_after = ready_after
+        self.scripts = dict(scripts or {})
+        self.on_load = on_load
+
+    @property
+    def page_source(self) -> str:
+        if self._page_source is not None:
+            return self._page_source
+        body = "".join(element.outer_html() for element in self.elements)
+        if not any(element.tag_name == "body" for element in self.elements):
+            body = f"<body>{body}</body>"
+        return f"<html><head><title>{html.escape(self.title)}</title></head>{body}</html>"
+
+
+BLANK_PAGE = FakePage(r"", title="404")
+
+
+class FakeWebDriver:
+    """
+    Fake WebDriver serving FakePage fixtures. Works with WebDriverWait, AdaptiveWait and the expected conditions
+    """
+
+    def __init__(
+            self,
+            pages: Iterable[FakePage] = (),
+            command_latency: float = 0.0,
+            page_load_latency: float = 0.0,
+    ):
+        """
+        :param pages: fixtures, the first page matching a url is served, a blank page if none does
+        :param float command_latency: seconds every command takes, the round trip to the driver
+        :param float page_load_latency: seconds a page load takes on top of the command latency
+        """
+        self.pages = list(pages)
+        self.command_latency = command_latency
+        self.page_load_latency = page_load_latency
+        self.current_url = "about:blank"
+        self.page = BLANK_PAGE
+        self.loaded_at = time.monotonic()
+        self._elements: List[FakeElement] = []
+        self._cookies: Dict[str, Dict] = {}
+        self._logs: Dict[str, List[Dict]] = {}
+        self._log_clock = itertools.count(int(time.time() * 1000))
+        self.executed_scripts: List[str] = []
+        self.session_id = "fake-session"
+        self.service = None
+        self.quit_called = False
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.commands: Counter = Counter()
+        self.injected_latency = 0.0
+        # time elements sat in the page, ready, before the code found them: the cost of polling
+        self.ready_lag = 0.0
+        self.missed_finds = 0
+
+    @property
+    def round_trips(self) -> int:
+        return sum(self.commands.values())
+
+    def _command(self, name: str, latency: float = 0.0) -> None:
+        self.commands[name] += 1
+        latency += self.command_latency
+        if latency:
+            time.sleep(latency)
+            self.injected_latency += latency
+
+    def _match(self, elements: Iterable[FakeElement], by: str, value: str) -> List[FakeElement]:
+        """
+        Elements of the trees under elements answering to the locator, in document order
+        """
+        now = time.monotonic()
+        found = [
+            element for element in itertools.chain.from_iterable(element.iter_tree() for element in elements)
+            if element.matches(by, value) and element.is_available(now)
+        ]
+        if not found:
+            self.missed_finds += 1
+        if new := [element for element in found if not element.found]:
+            for element in new:
+                element.found = True
+            self.ready_lag += now - min(element.available_at for element in new)
+        return found
+
+    def add_page(self, page: FakePage) -> None:
+        self.pages.append(page)
+
+    def reveal(self, *elements: FakeElement) -> None:
+        """
+        Add elements to the current page, their appear_after counts from now. Meant for on_click callbacks
+        """
+        now = time.monotonic()
+        for element in elements:
+            element._attach(self, now)
+            self._elements.append(element)
+
+    def add_log(self, log_type: str, message: Dict) -> None:
+        self._logs.setdefault(log_type, []).append(
+            {"level": "INFO", "message": json.dumps({"message": message, "webview": self.session_id}),
+             "timestamp": next(self._log_clock)}
+        )
+
+    def log_request(self, url: str, method: str = "GET") -> None:
+        """
+        Add the performance log entry chrome writes when the page sends a request
+        """
+        self.add_log("performance", {
+            "method": "Network.requestWillBeSent",
+            "params": {"request": {"url": url, "method": method}},
+        })
+
+    # webdriver api
+
+    def get(self, url: str) -> None:
+        self._command("get", self.page_load_latency)
+        self.page = next((page for page in self.pages if page.url_pattern.search(url)), BLANK_PAGE)
+        self.current_url = self.page.redirect_to or url
+        self.loaded_at = time.monotonic()
+        self._elements = []
+        self.reveal(*self.page.elements)
+        self.log_request(url)
+        if self.page.on_load is not None:
+            self.page.on_load(self, self.page)
+
+    @property
+    def title(self) -> str:
+        self._command("title")
+        return self.page.title
+
+    @property
+    def page_source(self) -> str:
+        self._command("page_source")
+        return self.page.page_source
+
+    def find_element(self, by: str = By.ID, value: Optional[str] = None) -> FakeElement:
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"No element {by}={value}")
+        return elements[0]
+
+    def find_elements(self, by: str = By.ID, value: Optional[str] = None) -> List[FakeElement]:
+        self._command("find_elements")
+        return self._match(self._elements, by, value)
+
+    def execute_script(self, script: str, *args):
+        self._command("execute_script")
+        self.executed_scripts.append(script)
+        if script == "return document.readyState":
+            return "complete" if time.monotonic() >= self.loaded_at + self.page.ready_after else "loading"
+        if script in self.page.scripts:
+            value = self.page.scripts[script]
+            return value(self, *args) if callable(value) else value
+        if script == "return 1":
+            return 1
+        return None
+
+    def execute_cdp_cmd(self, cmd: str, cmd_args: Dict) -> Dict:
+        self._command("execute_cdp_cmd")
+        return {}
+
+    def get_log(self, log_type: str) -> List[Dict]:
+        self._command("get_log")
+        return list(self._logs.get(log_type, ()))
+
+    def get_cookies(self) -> List[Dict]:
+        self._command("get_cookies")
+        return [dict(cookie) for cookie in self._cookies.values()]
+
+    def get_cookie(self, name: str) -> Optional[Dict]:
+        self._command("get_cookie")
+        return dict(self._cookies[name]) if name in self._cookies else None
+
+    def add_cookie(self, cookie: Dict) -> None:
+        self._command("add_cookie")
+        self._cookies[cookie["name"]] = dict(cookie)
+
+    def delete_all_cookies(self) -> None:
+        self._command("delete_all_cookies")
+        self._cookies.clear()
+
+    def set_cookies(self, cookies: Iterable[Dict]) -> None:
+        """
+        Set cookies without a command, like the site does on login
+        """
+        for cookie in cookies:
+            self._cookies[cookie["name"]] = dict(cookie)
+
+    def maximize_window(self) -> None:
+        self._command("maximize_window")
+
+    def quit(self) -> None:
+        self._command("quit")
+        self.quit_called = True
+
+    def close(self) -> None:
+        self._command("close")
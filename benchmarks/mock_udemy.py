@@ -0,0 +1,583 @@
+"""
+Local stand-in for the Udemy api-2.0 endpoints used by UdemyActionsUI, serving a synthetic corpus
+with configurable latency, error rate and throttling. Point the app to it with the
+WATCHER_UDEMY_API_BASE_URL environment variable.
+
+    python -m benchmarks.mock_udemy --num_courses 100 --lectures_per_course 200 --latency_ms 40
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+COURSE_ID_BASE = 100000
+MAX_LECTURES_PER_COURSE = 9999
+MAX_QUIZZES_PER_COURSE = 99
+SLUG_PREFIX = "bench-course-"
+SLUG_PATTERN = re.compile(rf"^{SLUG_PREFIX}(?P<index>\d+)$")
+
+LOCALES = (
+    {"_class": "locale", "locale": "en_US", "title": "English", "english_title": "English",
+     "simple_english_title": "English"},
+    {"_class": "locale", "locale": "it_IT", "title": "Italiano", "english_title": "Italian",
+     "simple_english_title": "Italian"},
+    {"_class": "locale", "locale": "es_ES", "title": "Español", "english_title": "Spanish",
+     "simple_english_title": "Spanish"},
+)
+CATEGORIES = (
+    ("Development", "Web Development"),
+    ("IT & Software", "Network & Security"),
+    ("Business", "Management"),
+)
+# Answer of every synthetic assessment
+CORRECT_RESPONSE = ["a"]
+
+
+@dataclass
+class MockConfig:
+    num_courses: int = 10
+    lectures_per_course: int = 20
+    quizzes_per_course: int = 1
+    assessments_per_quiz: int = 5
+    # share of the corpus the user is subscribed to from the start, the others can be enrolled through the api
+    subscribed_ratio: float = 1.0
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # share of the requests answered with a 500 before being processed
+    error_rate: float = 0.0
+    # requests per second above which the server answers 429, 0 for no throttling
+    max_rps: float = 0.0
+    # page size of the paginated endpoints called without one
+    default_page_size: int = 100
+    seed: int = 0
+
+    def __post_init__(self):
+        if not 1 <= self.lectures_per_course <= MAX_LECTURES_PER_COURSE:
+            raise ValueError(f"lectures_per_course must be between 1 and {MAX_LECTURES_PER_COURSE}")
+        if not 0 <= self.quizzes_per_course <= MAX_QUIZZES_PER_COURSE:
+            raise ValueError(f"quizzes_per_course must be between 0 and {MAX_QUIZZES_PER_COURSE}")
+
+
+class SyntheticCorpus:
+    """
+    Courses, curricula and assessments generated on demand from their ids, so a corpus of 10k
+    courses with 1,400 lectures each costs nothing until it's requested. Only the progress of
+    the user is stored.
+    """
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        rng = random.Random(config.seed)
+        # ordered by enrolment time
+        self.subscribed: Dict[int, None] = {
+            course_id: None for course_id in self.course_ids() if rng.random() < config.subscribed_ratio
+        }
+        self.completed_lectures: Dict[int, set] = {}
+        self.answered_assessments: Dict[int, set] = {}
+        # course id -> time the user last made progress in it
+        self.last_accessed: Dict[int, float] = {}
+
+    def course_ids(self) -> range:
+        return range(COURSE_ID_BASE, COURSE_ID_BASE + self.config.num_courses)
+
+    def exists(self, course_id: int) -> bool:
+        return course_id in self.course_ids()
+
+    def resolve(self, identifier: str) -> Optional[int]:
+        """
+        :param str identifier: course id or slug
+        :return: the course id, None if there is no such course
+        """
+        if identifier.isdigit():
+            course_id = int(identifier)
+        elif matches := SLUG_PATTERN.match(identifier):
+            course_id = COURSE_ID_BASE + int(matches.group("index"))
+        else:
+            return None
+        return course_id if self.exists(course_id) else None
+
+    @staticmethod
+    def slug(course_id: int) -> str:
+        return f"{SLUG_PREFIX}{course_id - COURSE_ID_BASE}"
+
+    def lecture_ids(self, course_id: int) -> List[int]:
+        return [course_id * 10000 + index for index in range(self.config.lectures_per_course)]
+
+    def quiz_ids(self, course_id: int) -> List[int]:
+        return [course_id * 100 + index for index in range(self.config.quizzes_per_course)]
+
+    @staticmethod
+    def quiz_course(quiz_id: int) -> int:
+        return quiz_id // 100
+
+    def assessment_ids(self, quiz_id: int) -> List[int]:
+        return [quiz_id * 1000 + index for index in range(self.config.assessments_per_quiz)]
+
+    @staticmethod
+    def attempt_id(quiz_id: int) -> int:
+        return quiz_id * 10 + 1
+
+    @staticmethod
+    def attempt_quiz(attempt_id: int) -> int:
+        return attempt_id // 10
+
+    def subscribe(self, course_id: int) -> None:
+        with self._lock:
+            self.subscribed.setdefault(course_id, None)
+
+    def is_subscribed(self, course_id: int) -> bool:
+        return course_id in self.subscribed
+
+    def complete_lecture(self, course_id: int, lecture_id: int) -> bool:
+        if lecture_id // 10000 != course_id or lecture_id % 10000 >= self.config.lectures_per_course:
+            return False
+        with self._lock:
+            self.completed_lectures.setdefault(course_id, set()).add(lecture_id)
+            self.last_accessed[course_id] = time.time()
+        return True
+
+    def answer(self, quiz_id: int, assessment_id: int, response) -> bool:
+        if assessment_id // 1000 != quiz_id or assessment_id % 1000 >= self.config.assessments_per_quiz:
+            return False
+        if response != CORRECT_RESPONSE:
+            return False
+        with self._lock:
+            self.answered_assessments.setdefault(quiz_id, set()).add(assessment_id)
+        return True
+
+    def completed_quiz_ids(self, course_id: int) -> List[int]:
+        return [
+            quiz_id for quiz_id in self.quiz_ids(course_id)
+            if len(self.answered_assessments.get(quiz_id, ())) >= self.config.assessments_per_quiz
+        ]
+
+    def completion_ratio(self, course_id: int) -> int:
+        total = self.config.lectures_per_course + self.config.quizzes_per_course
+        done = len(self.completed_lectures.get(course_id, ())) + len(self.completed_quiz_ids(course_id))
+        return 100 * done // total
+
+    def course(self, course_id: int) -> Dict:
+        index = course_id - COURSE_ID_BASE
+        category, subcategory = CATEGORIES[index % len(CATEGORIES)]
+        return {
+            "_class": "course",
+            "id": course_id,
+            "title": f"Benchmark course {index}",
+            "url": f"/course/{self.slug(course_id)}/",
+            "num_lectures": self.config.lectures_per_course,
+            "num_quizzes": self.config.quizzes_per_course,
+            "completion_ratio": self.completion_ratio(course_id) if self.is_subscribed(course_id) else 0,
+            "last_accessed_time": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.last_accessed.get(course_id, 1577836800))
+            ),
+            "locale": LOCALES[index % len(LOCALES)],
+            "primary_category": {"_class": "course_category", "id": index % len(CATEGORIES), "title": category},
+            "primary_subcategory": {"_class": "course_subcategory", "id": 100 + index % len(CATEGORIES),
+                                    "title": subcategory},
+            "estimated_content_length": 5 * self.config.lectures_per_course,
+            "num_subscribers": 1000 + index,
+            "avg_rating_recent": 4.5,
+            "visible_instructors": [{"_class": "user", "id": 1, "title": "Benchmark Instructor"}],
+            "context_info": {"category": {"title": category}, "label": {"title": subcategory}},
+        }
+
+    @lru_cache(maxsize=64)
+    def curriculum(self, course_id: int) -> List[Dict]:
+        """
+        Curriculum items of a course, one chapter followed by the lectures with the quizzes spread among them
+        """
+        lecture_ids = self.lecture_ids(course_id)
+        quiz_ids = self.quiz_ids(course_id)
+        quiz_every = max(1, len(lecture_ids) // max(1, len(quiz_ids)))
+        items = [{"_class": "chapter", "id": course_id, "title": "Chapter 1", "object_index": 1,
+                  "is_published": True, "sort_order": 0}]
+        quizzes = iter(quiz_ids)
+        for index, lecture_id in enumerate(lecture_ids):
+            items.append({
+                "_class": "lecture", "id": lecture_id, "title": f"Lecture {index + 1}", "object_index": index + 1,
+                "is_published": True, "sort_order": len(items), "created": "2020-01-01T00:00:00Z",
+                "asset": {"_class": "asset", "id": lecture_id, "title": f"lecture_{index + 1}.mp4",
+                          "filename": f"lecture_{index + 1}.mp4", "asset_type": "Video", "status": 1,
+                          "time_estimation": 300, "is_external": False},
+                "supplementary_assets": [], "is_free": False,
+            })
+            if (index + 1) % quiz_every == 0 and (quiz_id := next(quizzes, None)) is not None:
+                items.append({
+                    "_class": "quiz", "id": quiz_id, "title": f"Quiz {quiz_id % 100 + 1}",
+                    "object_index": quiz_id % 100 + 1, "is_published": True, "sort_order": len(items),
+                    "type": "simple-quiz", "version": 1,
+                })
+        return items
+
+    def assessments(self, quiz_id: int) -> List[Dict]:
+        return [
+            {
+                "_class": "assessment", "id": assessment_id, "assessment_type": "multiple-choice",
+                "prompt": {"question": f"<p>Question {assessment_id}</p>",
+                           "answers": ["<p>Right</p>", "<p>Wrong</p>", "<p>Wrong</p>"],
+                           "feedbacks": ["", "", ""]},
+                "correct_response": CORRECT_RESPONSE, "section": "", "question_plain": f"Question {assessment_id}",
+                "related_lectures": [],
+            }
+            for assessment_id in self.assessment_ids(quiz_id)
+        ]
+
+    def progress(self, course_id: int) -> Dict:
+        return {
+            "_class": "course",
+            "id": course_id,
+            "completed_lecture_ids": sorted(self.completed_lectures.get(course_id, ())),
+            "completed_quiz_ids": self.completed_quiz_ids(course_id),
+            "completed_assignment_ids": [],
+            "last_seen_page": None,
+            "first_completion_time": None,
+        }
+
+
+class RequestStatistics:
+    """
+    Counters of the requests served, read by the benchmark runner through /__stats__
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.by_status: Dict[str, int] = {}
+            self.by_endpoint: Dict[str, int] = {}
+            self.started = time.time()
+
+    def record(self, endpoint: str, status: int, size: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.by_status[str(status)] = self.by_status.get(str(status), 0) + 1
+            self.by_endpoint[endpoint] = self.by_endpoint.get(endpoint, 0) + 1
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes_sent": self.bytes_sent,
+                "by_status": dict(self.by_status),
+                "by_endpoint": dict(self.by_endpoint),
+                "uptime": time.time() - self.started,
+            }
+
+
+class Throttle:
+    """
+    Token bucket answering False once the request rate goes above max_rps
+    """
+
+    def __init__(self, max_rps: float):
+        self.max_rps = max_rps
+        self._tokens = max_rps
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if not self.max_rps:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_rps, self._tokens + (now - self._updated) * self.max_rps)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+API = r"^/api-2\.0"
+ME = API + r"/users/me"
+SUBSCRIBED = ME + r"/subscribed-courses/(?P<course_id>\d+)"
+
+# (method, path pattern, endpoint name), the name is the handler method and the stats key
+ROUTES: List[Tuple[str, re.Pattern, str]] = [
+    (method, re.compile(pattern + r"/?$"), name) for method, pattern, name in (
+        ("GET", ME, "user"),
+        ("GET", ME + r"/subscribed-courses", "subscribed_courses"),
+        ("GET", SUBSCRIBED, "subscribed_course"),
+        ("GET", SUBSCRIBED + r"/lectures", "lectures"),
+        ("POST", SUBSCRIBED + r"/completed-lectures", "completed_lectures"),
+        ("GET", SUBSCRIBED + r"/progress", "progress"),
+        ("GET", SUBSCRIBED + r"/user-attempted-quizzes", "user_attempted_quizzes"),
+        ("GET", SUBSCRIBED + r"/quizzes/(?P<quiz_id>\d+)/user-attempted-quizzes/latest", "latest_attempt"),
+        ("POST", SUBSCRIBED + r"/user-attempted-quizzes/(?P<attempt_id>\d+)/assessment-answers",
+         "assessment_answers"),
+        ("GET", API + r"/courses/(?P<identifier>[\w-]+)", "course"),
+        ("GET", API + r"/courses/(?P<course_id>\d+)/subscriber-curriculum-items", "curriculum_items"),
+        ("GET", API + r"/quizzes/(?P<quiz_id>\d+)/assessments", "assessments"),
+        ("GET", r"^/course/subscribe", "subscribe"),
+    )
+]
+
+
+class MockUdemyHandler(BaseHTTPRequestHandler):
+    # keep-alive, like the real api, so the connection pool of the session is exercised
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in two writes, with nagle every response would wait for the delayed ack
+    disable_nagle_algorithm = True
+    server: "MockUdemyServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+
+        if url.path == "/__stats__":
+            self._send(200, self.server.stats.to_dict(), record=None)
+            return
+        if url.path == "/__reset__":
+            self.server.stats.reset()
+            self._send(200, {}, record=None)
+            return
+
+        for route_method, pattern, name in ROUTES:
+            if route_method == method and (matches := pattern.match(url.path)):
+                break
+        else:
+            self._send(404, {"detail": "Not found."}, "unknown")
+            return
+
+        config = self.server.config
+        if config.latency_ms or config.jitter_ms:
+            time.sleep((config.latency_ms + random.uniform(0, config.jitter_ms)) / 1000)
+        if not self.server.throttle.allow():
+            self._send(429, {"detail": "Request was throttled."}, name, {"Retry-After": "1"})
+            return
+        if config.error_rate and random.random() < config.error_rate:
+            self._send(500, {"detail": "Injected error."}, name)
+            return
+        if not self.headers.get("authorization", "").startswith("Bearer ") and name != "subscribe":
+            self._send(401, {"detail": "Authentication credentials were not provided."}, name)
+            return
+
+        arguments = {key: int(value) if value.isdigit() and key != "identifier" else value
+                     for key, value in matches.groupdict().items()}
+        status, payload = getattr(self, f"_{name}")(**arguments)
+        self._send(status, payload, name)
+
+    def _send(self, status: int, payload, record: Optional[str], headers: Optional[Dict] = None) -> None:
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if not isinstance(payload, bytes) else "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if record is not None:
+            self.server.stats.record(record, status, len(body))
+
+    @property
+    def corpus(self) -> SyntheticCorpus:
+        return self.server.corpus
+
+    def _page(self, items: List, page_size: Optional[int] = None) -> Dict:
+        """
+        Paginate a list like the api does, with an absolute url to the next page
+        """
+        page = int(self.query.get("page", 1))
+        page_size = int(self.query.get("page_size") or page_size or self.server.config.default_page_size)
+        start = (page - 1) * page_size
+        next_url = None
+        if start + page_size < len(items):
+            query = dict(self.query, page=page + 1)
+            next_url = f"http://{self.headers['Host']}{urlparse(self.path).path}?{urlencode(query)}"
+        return {
+            "count": len(items),
+            "next": next_url,
+            "previous": None,
+            "results": items[start:start + page_size],
+        }
+
+    def _project(self, course: Dict) -> Dict:
+        fields = self.query.get("fields[course]")
+        if not fields:
+            return course
+        wanted = set(fields.split(",")) | {"_class", "id"}
+        return {key: value for key, value in course.items() if key in wanted}
+
+    def _subscribed_or_error(self, course_id: int) -> Optional[Tuple[int, Dict]]:
+        if not self.corpus.exists(course_id):
+            return 404, {"detail": "Not found."}
+        if not self.corpus.is_subscribed(course_id):
+            return 403, {"detail": "You do not have permission to perform this action."}
+        return None
+
+    def _user(self):
+        return 200, {"_class": "user", "id": 1, "title": "Benchmark User"}
+
+    def _subscribed_courses(self):
+        course_ids = list(self.corpus.subscribed)
+        if self.query.get("ordering") == "-enroll_time":
+            course_ids.reverse()
+        elif self.query.get("ordering") == "-last_accessed":
+            course_ids.sort(key=lambda course_id: -self.corpus.last_accessed.get(course_id, 0))
+        courses = [self._project(self.corpus.course(course_id)) for course_id in course_ids]
+        if self.query.get("progress_filter") == "in-progress":
+            courses = [course for course in courses if self.corpus.completion_ratio(course["id"]) < 100]
+        return 200, self._page(courses)
+
+    def _subscribed_course(self, course_id: int):
+        return self._subscribed_or_error(course_id) or (200, self._project(self.corpus.course(course_id)))
+
+    def _lectures(self, course_id: int):
+        if error := self._subscribed_or_error(course_id):
+            return error
+        lectures = [
+            {"_class": "lecture", "id": lecture_id, "title": f"Lecture {lecture_id % 10000 + 1}"}
+            for lecture_id in self.corpus.lecture_ids(course_id)
+        ]
+        return 200, self._page(lectures)
+
+    def _completed_lectures(self, course_id: int):
+        if error := self._subscribed_or_error(course_id):
+            return error
+        try:
+            lecture_id = int(json.loads(self.body)["lecture_id"])
+        except (ValueError, KeyError, TypeError):
+            return 400, {"detail": "lecture_id is required."}
+        if not self.corpus.complete_lecture(course_id, lecture_id):
+            return 404, {"detail": "Not found."}
+        return 201, {"_class": "completed_lecture", "lecture_id": lecture_id, "downloaded": False}
+
+    def _progress(self, course_id: int):
+        return self._subscribed_or_error(course_id) or (200, self.corpus.progress(course_id))
+
+    def _user_attempted_quizzes(self, course_id: int):
+        if error := self._subscribed_or_error(course_id):
+            return error
+        attempts = [
+            {"_class": "user_attempted_quiz", "id": self.corpus.attempt_id(quiz_id), "quiz_id": quiz_id}
+            for quiz_id in self.corpus.completed_quiz_ids(course_id)
+        ]
+        return 200, self._page(attempts)
+
+    def _latest_attempt(self, course_id: int, quiz_id: int):
+        if error := self._subscribed_or_error(course_id):
+            return error
+        if quiz_id not in self.corpus.quiz_ids(course_id):
+            return 404, {"detail": "Not found."}
+        # every quiz comes with a started attempt, so no quiz ever needs the browser
+        return 200, {"_class": "user_attempted_quiz", "id": self.corpus.attempt_id(quiz_id), "version": 1}
+
+    def _assessment_answers(self, course_id: int, attempt_id: int):
+        if error := self._subscribed_or_error(course_id):
+            return error
+        try:
+            answer = json.loads(self.body)
+            assessment_id = int(answer["assessment_id"])
+        except (ValueError, KeyError, TypeError):
+            return 400, {"detail": "assessment_id is required."}
+        quiz_id = self.corpus.attempt_quiz(attempt_id)
+        if self.corpus.quiz_course(quiz_id) != course_id or not self.corpus.answer(
+                quiz_id, assessment_id, answer.get("response")
+        ):
+            return 400, {"detail": "Invalid answer."}
+        return 201, {"_class": "assessment_answer", "assessment_id": assessment_id, "response": answer["response"]}
+
+    def _course(self, identifier: str):
+        course_id = self.corpus.resolve(identifier)
+        if course_id is None:
+            return 404, {"detail": "Not found."}
+        return 200, self._project(self.corpus.course(course_id))
+
+    def _curriculum_items(self, course_id: int):
+        return self._subscribed_or_error(course_id) or (200, self._page(self.corpus.curriculum(course_id)))
+
+    def _assessments(self, quiz_id: int):
+        if not self.corpus.exists(self.corpus.quiz_course(quiz_id)):
+            return 404, {"detail": "Not found."}
+        return 200, self._page(self.corpus.assessments(quiz_id))
+
+    def _subscribe(self):
+        course_id = self.corpus.resolve(self.query.get("courseId", ""))
+        if course_id is None:
+            return 404, b"<html><body>Not found</body></html>"
+        self.corpus.subscribe(course_id)
+        return 200, b"<html><body>Enrolled</body></html>"
+
+
+class MockUdemyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the app runs up to 10 requests at once per pool, leave room for the bursts
+    request_queue_size = 128
+
+    def __init__(self, config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.corpus = SyntheticCorpus(config)
+        self.stats = RequestStatistics()
+        self.throttle = Throttle(config.max_rps)
+        super().__init__((host, port), MockUdemyHandler)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> MockUdemyServer:
+    """
+    Start a mock server in a background thread
+
+    :param MockConfig config: corpus and fault injection settings
+    :param str host: interface to listen on
+    :param int port: port to listen on, a free one if 0
+    :return: the running server, stop it with shutdown()
+    """
+    server = MockUdemyServer(config, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-udemy", daemon=True).start()
+    return server
+
+
+def parse_args(args=None) -> argparse.Namespace:
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description="Local mock of the Udemy api-2.0")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on, a free one by default")
+    for field, value in asdict(defaults).items():
+        parser.add_argument(f"--{field}", type=type(value), default=value, help=f"Default: {value}")
+    return parser.parse_args(args)
+
+
+def main(args=None) -> None:
+    args = vars(parse_args(args))
+    host, port = args.pop("host"), args.pop("port")
+    server = MockUdemyServer(MockConfig(**args), host, port)
+    # the benchmark runner reads the url from the first line
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import unittest
+
+import requests
+from requests.adapters import BaseAdapter
+
+from watcher_udemy.timeouts import MAX_TIMEOUT, MIN_API_TIMEOUT, WINDOW, AdaptiveTimeoutAdapter, LatencyTracker
+
+URL = "https://www.udemy.com/api-2.0/courses/123/"
+SITE = "api:/api-2.0/courses/{id}/"
+
+
+class TimingOutAdapter(BaseAdapter):
+    """
+    Adapter of a slow day, every request runs out of its timeout
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.timeouts.append(timeout)
+        raise requests.ReadTimeout(f"Read timed out. (read timeout={timeout})")
+
+    def close(self):
+        pass
+
+
+class LearnedTimeoutTest(unittest.TestCase):
+
+    def test_learned_timeout_grows_back_after_timeouts(self):
+        tracker = LatencyTracker(file_name=None)
+        # a fast week teaches the shortest timeout
+        for _ in range(WINDOW):
+            tracker.record(SITE, 0.1)
+        self.assertEqual(tracker.timeout(SITE, 30.0, MIN_API_TIMEOUT), MIN_API_TIMEOUT)
+
+        inner = TimingOutAdapter()
+        session = requests.Session()
+        session.mount("https://", AdaptiveTimeoutAdapter(inner, tracker))
+        for _ in range(20):
+            with self.assertRaises(requests.Timeout):
+                session.get(URL)
+
+        self.assertGreater(inner.timeouts[-1], inner.timeouts[0])
+        self.assertEqual(tracker.timeout(SITE, 30.0, MIN_API_TIMEOUT), MAX_TIMEOUT)
+
+    def test_timed_out_wait_is_a_sample(self):
+        tracker = LatencyTracker(file_name=None)
+        tracker.record_timeout("wait:login", 2.0)
+        self.assertEqual(list(tracker._samples["wait:login"]), [2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
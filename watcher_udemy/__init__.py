@@ -1,8 +1,31 @@
-from .driver_manager import ALL_VALID_BROWSER_STRINGS, DriverManager
+import importlib
+
 from .logging import load_logging_config
-from .scrapers.manager import ScraperManager
-from .settings import Settings
 
-from .udemy_ui import UdemyActionsUI, UdemyStatus
+# name -> module defining it, imported on first access so that the commands not opening a browser
+# (status, answer transfers, queue server...) don't pay for selenium, bs4 and aiohttp at startup
+_LAZY_ATTRIBUTES = {
+    "ALL_VALID_BROWSER_STRINGS": ".driver_manager",
+    "DriverManager": ".driver_manager",
+    "ScraperManager": ".scrapers.manager",
+    "Settings": ".settings",
+    "UdemyActionsUI": ".udemy_ui",
+    "UdemyStatus": ".udemy_ui",
+}
+
+__all__ = ["load_logging_config", *_LAZY_ATTRIBUTES]
+
+
+def __getattr__(name: str):
+    if (module_name := _LAZY_ATTRIBUTES.get(name)) is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
 
 load_logging_config()
@@ -0,0 +1,208 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+from watcher_udemy.codec import dumps, loads
+from watcher_udemy.logging import get_logger
+from watcher_udemy.utils import connect_read_only, get_app_dir
+
+logger = get_logger()
+
+# Only the fields the quiz solver reads are kept, the rest of the payload is dropped
+ANSWER_FIELDS = ("id", "_class", "assessment_type", "correct_response", "prompt")
+
+
+class AnswerKeyStore:
+    """
+    Local SQLite store of quiz answer keys, keyed by assessment id and quiz version.
+
+    Payloads are stored as zlib compressed json blobs. A quiz is only considered cached once
+    all of its assessments have been stored through put_quiz.
+    """
+
+    def __init__(self, db_file_name: str = "answers.db", read_only: bool = False):
+        """
+        :param str db_file_name: Name of the database in the app directory
+        :param bool read_only: Open an existing store without creating or changing anything
+        """
+        # An absolute path replaces the app dir, so a shared store can live anywhere
+        self._db_path = os.path.join(get_app_dir(), db_file_name)
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = connect_read_only(self._db_path)
+            return
+        self._conn = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        """
+        Create the tables of the store if they don't exist yet
+
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS assessments (
+                    assessment_id INTEGER NOT NULL,
+                    quiz_version INTEGER NOT NULL,
+                    quiz_id INTEGER NOT NULL,
+                    payload BLOB NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (assessment_id, quiz_version)
+                );
+                CREATE INDEX IF NOT EXISTS idx_assessments_quiz
+                    ON assessments (quiz_id, quiz_version);
+                CREATE TABLE IF NOT EXISTS quizzes (
+                    quiz_id INTEGER NOT NULL,
+                    quiz_version INTEGER NOT NULL,
+                    assessment_ids TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (quiz_id, quiz_version)
+                );
+                """
+            )
+
+    @staticmethod
+    def _compress(assessment: Dict) -> bytes:
+        slim = {k: assessment[k] for k in ANSWER_FIELDS if k in assessment}
+        return zlib.compress(dumps(slim).encode("utf-8"))
+
+    @staticmethod
+    def _decompress(payload: bytes) -> Dict:
+        return loads(zlib.decompress(payload))
+
+    def get_quiz(self, quiz_id: int, quiz_version: int) -> Optional[List[Dict]]:
+        """
+        Get the answer key of a quiz
+
+        :param int quiz_id: Id of the quiz
+        :param int quiz_version: Version of the quiz
+        :return: list of assessments in their original order or None if the quiz isn't stored
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT assessment_ids FROM quizzes WHERE quiz_id = ? AND quiz_version = ?",
+                (quiz_id, quiz_version),
+            ).fetchone()
+            if row is None:
+                return None
+            payloads = dict(
+                self._conn.execute(
+                    "SELECT assessment_id, payload FROM assessments "
+                    "WHERE quiz_id = ? AND quiz_version = ?",
+                    (quiz_id, quiz_version),
+                ).fetchall()
+            )
+        assessment_ids = json.loads(row[0])
+        if any(assessment_id not in payloads for assessment_id in assessment_ids):
+            logger.warning(f"Answer key of quiz {quiz_id} v{quiz_version} is incomplete, ignoring it")
+            return None
+        return [self._decompress(payloads[assessment_id]) for assessment_id in assessment_ids]
+
+    def get_prompt(self, assessment_id: int, quiz_version: int) -> Optional[Dict]:
+        """
+        Get only the prompt of a stored assessment
+
+        :param int assessment_id: Id of the assessment
+        :param int quiz_version: Version of the quiz the assessment belongs to
+        :return: the prompt of the assessment or None if it isn't stored
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM assessments WHERE assessment_id = ? AND quiz_version = ?",
+                (assessment_id, quiz_version),
+            ).fetchone()
+        if row is None:
+            return None
+        return self._decompress(row[0]).get("prompt")
+
+    def put_quiz(self, quiz_id: int, quiz_version: int, assessments: List[Dict]) -> None:
+        """
+        Store the answer key of a quiz, replacing any previous copy of the same version
+
+        :param int quiz_id: Id of the quiz
+        :param int quiz_version: Version of the quiz
+        :param list assessments: Assessments as returned by the assessments api
+        :return: None
+        """
+        now = time.time()
+        rows = [
+            (assessment["id"], quiz_version, quiz_id, self._compress(assessment), now)
+            for assessment in assessments
+        ]
+        assessment_ids = json.dumps([assessment["id"] for assessment in assessments])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO assessments "
+                "(assessment_id, quiz_version, quiz_id, payload, updated_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO quizzes (quiz_id, quiz_version, assessment_ids, fetched_at) "
+                "VALUES (?, ?, ?, ?)",
+                (quiz_id, quiz_version, assessment_ids, now),
+            )
+
+    def average_quiz_size(self) -> Optional[float]:
+        """
+        Average number of assessments of the stored quizzes
+
+        :return: the average, None if no quiz is stored
+        """
+        with self._lock:
+            quizzes, assessments = self._conn.execute(
+                "SELECT COUNT(*), SUM(json_array_length(assessment_ids)) FROM quizzes"
+            ).fetchone()
+        return assessments / quizzes if quizzes else None
+
+    def export_to(self, file_path: str) -> int:
+        """
+        Export every stored quiz to a gzipped json lines file
+
+        :param str file_path: Path of the file to write
+        :return: Number of quizzes exported
+        """
+        with self._lock:
+            quizzes = self._conn.execute(
+                "SELECT quiz_id, quiz_version FROM quizzes ORDER BY quiz_id, quiz_version"
+            ).fetchall()
+        exported = 0
+        with gzip.open(file_path, "wt", encoding="utf-8") as f:
+            for quiz_id, quiz_version in quizzes:
+                assessments = self.get_quiz(quiz_id, quiz_version)
+                if assessments is None:
+                    continue
+                record = {"quiz_id": quiz_id, "quiz_version": quiz_version, "assessments": assessments}
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+                exported += 1
+        logger.info(f"Exported {exported} quizzes to {file_path}")
+        return exported
+
+    def import_from(self, file_path: str) -> int:
+        """
+        Import quizzes from a file created by export_to
+
+        :param str file_path: Path of the file to read
+        :return: Number of quizzes imported
+        """
+        imported = 0
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self.put_quiz(record["quiz_id"], record["quiz_version"], record["assessments"])
+                imported += 1
+        logger.info(f"Imported {imported} quizzes from {file_path}")
+        return imported
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
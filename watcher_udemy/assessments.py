@@ -0,0 +1,96 @@
+from typing import Dict, List, Optional
+
+from watcher_udemy.answer_store import AnswerKeyStore
+from watcher_udemy.exceptions import AnswerKeyException
+
+
+class AssessmentRecord:
+    """
+    Compact view of an assessment holding only the fields the quiz solver uses.
+
+    The prompt, which can be large for coding exercises, is not kept in memory and is read
+    back from the answer key store the first time it is needed.
+    """
+
+    __slots__ = (
+        "id",
+        "assessment_type",
+        "correct_response",
+        "quiz_id",
+        "quiz_type",
+        "quiz_version",
+        "_answer_store",
+        "_prompt",
+    )
+
+    def __init__(
+            self,
+            assessment_id: int,
+            assessment_type: Optional[str],
+            correct_response: Optional[List[str]],
+            quiz_id: int,
+            quiz_type: str,
+            quiz_version: int,
+            answer_store: Optional[AnswerKeyStore] = None,
+            prompt: Optional[Dict] = None,
+    ):
+        self.id = assessment_id
+        self.assessment_type = assessment_type
+        self.correct_response = correct_response
+        self.quiz_id = quiz_id
+        self.quiz_type = quiz_type
+        self.quiz_version = quiz_version
+        self._answer_store = answer_store
+        self._prompt = prompt
+
+    @classmethod
+    def from_json(
+            cls,
+            assessment: Dict,
+            quiz_id: int,
+            quiz_type: str,
+            quiz_version: int,
+            answer_store: Optional[AnswerKeyStore] = None,
+    ) -> "AssessmentRecord":
+        """
+        Build a record from an assessment payload
+
+        :param dict assessment: Assessment as returned by the api or the answer key store
+        :param int quiz_id: Id of the quiz the assessment belongs to
+        :param str quiz_type: Type of the quiz (simple-quiz, practice-test, coding-exercise...)
+        :param int quiz_version: Version of the quiz
+        :param AnswerKeyStore answer_store: Store holding the answer key, to lazily load the prompt from.
+            If None the prompt is kept
+        :return: AssessmentRecord
+        """
+        return cls(
+            assessment.get("id"),
+            assessment.get("assessment_type"),
+            assessment.get("correct_response"),
+            quiz_id,
+            quiz_type,
+            quiz_version,
+            answer_store,
+            None if answer_store is not None else assessment.get("prompt"),
+        )
+
+    @property
+    def prompt(self) -> Dict:
+        """
+        Prompt of the assessment, loaded from the answer key store on every access
+
+        :return: the prompt
+        :raises AnswerKeyException: if the prompt isn't in the payload nor in the store
+        """
+        if self._prompt is not None:
+            return self._prompt
+        if self._answer_store is not None:
+            if (prompt := self._answer_store.get_prompt(self.id, self.quiz_version)) is not None:
+                return prompt
+        raise AnswerKeyException(f"No prompt for assessment {self.id} of quiz {self.quiz_id} v{self.quiz_version}")
+
+    def __repr__(self) -> str:
+        return (
+            f"AssessmentRecord(id={self.id}, assessment_type={self.assessment_type}, "
+            f"quiz_id={self.quiz_id}, quiz_type={self.quiz_type}, quiz_version={self.quiz_version})"
+        )
@@ -0,0 +1,336 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from watcher_udemy.logging import get_logger
+from watcher_udemy.utils import connect_read_only, get_app_dir
+
+logger = get_logger()
+
+COURSE_SLUG_PATTERN = re.compile(r"/course/(?P<slug>[^/?#]+)/?")
+
+# Columns filled from the course payloads of the api, in the order of the upsert statement
+COURSE_COLUMNS = ("slug", "title", "num_lectures", "num_quizzes", "completion_ratio")
+# Fields of a subscribed course the catalogue records, the others are dropped while decoding the course pages
+COURSE_FIELDS = ("id", "url", "title", "num_lectures", "num_quizzes", "completion_ratio")
+
+
+def catalogue_file_name(cookie_file_name: str, domain: Optional[str]) -> str:
+    """
+    Name of the catalogue of an account, the courses and their progress belong to one user of one domain
+
+    :param str cookie_file_name: Name of the cookie file of the account, .cookie-<account name> or .cookie
+    :param str domain: business sub-domain of the account
+    :return: catalogue-<account name>.db for the accounts of a manifest, catalogue-<domain>.db otherwise
+    """
+    if cookie_file_name.startswith(".cookie-"):
+        # the names of the accounts of a manifest are unique across its domains
+        return f"catalogue{cookie_file_name[len('.cookie'):]}.db"
+    return f"catalogue-{domain}.db"
+
+
+class CourseCatalogue:
+    """
+    Local SQLite catalogue of the courses of the account, so the runner, the daemon and the
+    status command can answer their questions without going to the network
+    """
+
+    def __init__(self, db_file_name: str, read_only: bool = False):
+        """
+        :param str db_file_name: Name of the database in the app directory, see catalogue_file_name
+        :param bool read_only: Open an existing catalogue without creating or changing anything
+        """
+        self._db_path = os.path.join(get_app_dir(), db_file_name)
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = connect_read_only(self._db_path)
+            return
+        self._conn = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS courses (
+                    id INTEGER PRIMARY KEY,
+                    slug TEXT,
+                    title TEXT,
+                    num_lectures INTEGER,
+                    num_quizzes INTEGER,
+                    completion_ratio REAL,
+                    curriculum_hash TEXT,
+                    completed_curriculum_hash TEXT,
+                    last_synced REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_courses_slug ON courses (slug);
+                CREATE INDEX IF NOT EXISTS idx_courses_progress ON courses (completion_ratio, num_quizzes);
+                CREATE INDEX IF NOT EXISTS idx_courses_changed ON courses (id)
+                    WHERE curriculum_hash IS NOT completed_curriculum_hash;
+                CREATE TABLE IF NOT EXISTS curriculum_items (
+                    course_id INTEGER NOT NULL,
+                    item_key TEXT NOT NULL,
+                    item_hash TEXT NOT NULL,
+                    PRIMARY KEY (course_id, item_key)
+                );
+                CREATE TABLE IF NOT EXISTS course_slugs (
+                    slug TEXT PRIMARY KEY,
+                    course_id INTEGER NOT NULL,
+                    resolved_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS course_metadata (
+                    id INTEGER PRIMARY KEY,
+                    metadata TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                """
+            )
+
+    @staticmethod
+    def slug_from_url(url: Optional[str]) -> Optional[str]:
+        """
+        Extract the course slug from the url of a course, either relative or absolute
+
+        :param str url: url of the course
+        :return: the slug or None if the url isn't a course url
+        """
+        if not url:
+            return None
+        matches = COURSE_SLUG_PATTERN.search(url)
+        return matches.group("slug") if matches else None
+
+    def upsert_courses(self, courses: Iterable[Dict]) -> None:
+        """
+        Add or update courses from their api payloads. Fields missing from a payload keep their stored value
+
+        :param courses: course dictionaries holding at least the id
+        :return: None
+        """
+        now = time.time()
+        rows = []
+        for course in courses:
+            values = {
+                "slug": self.slug_from_url(course.get("url")),
+                "title": course.get("title"),
+                "num_lectures": course.get("num_lectures"),
+                "num_quizzes": course.get("num_quizzes"),
+                "completion_ratio": course.get("completion_ratio"),
+            }
+            rows.append((course["id"], *(values[column] for column in COURSE_COLUMNS), now))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO courses (id, slug, title, num_lectures, num_quizzes, completion_ratio, last_synced) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "slug = COALESCE(excluded.slug, slug), "
+                "title = COALESCE(excluded.title, title), "
+                "num_lectures = COALESCE(excluded.num_lectures, num_lectures), "
+                "num_quizzes = COALESCE(excluded.num_quizzes, num_quizzes), "
+                "completion_ratio = COALESCE(excluded.completion_ratio, completion_ratio), "
+                "last_synced = excluded.last_synced",
+                rows,
+            )
+
+    def upsert_course(self, course: Dict) -> None:
+        self.upsert_courses([course])
+
+    def get(self, course_id: int) -> Optional[Dict]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM courses WHERE id = ?", (course_id,))
+            row = cursor.fetchone()
+            columns = [description[0] for description in cursor.description]
+        return dict(zip(columns, row)) if row is not None else None
+
+    def known_ids(self) -> Set[int]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT id FROM courses")}
+
+    def incomplete_courses(self, with_quizzes: Optional[bool] = None) -> List[int]:
+        """
+        Courses not completed yet, courses whose progress is unknown are included
+
+        :param bool with_quizzes: only courses with (True) or without (False) quizzes, all of them if None
+        :return: list of course ids
+        """
+        query = "SELECT id FROM courses WHERE (completion_ratio IS NULL OR completion_ratio < 100)"
+        if with_quizzes is True:
+            query += " AND num_quizzes > 0"
+        elif with_quizzes is False:
+            query += " AND num_quizzes = 0"
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query + " ORDER BY id")]
+
+    def curriculum_changed(self) -> List[int]:
+        """
+        Courses completed in the past whose curriculum changed since
+
+        :return: list of course ids
+        """
+        with self._lock:
+            return [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT id FROM courses WHERE curriculum_hash IS NOT completed_curriculum_hash "
+                    "AND completed_curriculum_hash IS NOT NULL ORDER BY id"
+                )
+            ]
+
+    def set_curriculum_hash(self, course_id: int, curriculum_hash: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE courses SET curriculum_hash = ? WHERE id = ?", (curriculum_hash, course_id)
+            )
+
+    def get_curriculum_fingerprint(self, course_id: int) -> Optional[Dict[str, str]]:
+        """
+        Item hashes of the curriculum stored the last time the course was completed
+
+        :param int course_id: id of the course
+        :return: item key -> item hash, None if nothing was ever stored for the course
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT completed_curriculum_hash FROM courses WHERE id = ?", (course_id,)
+            ).fetchone()
+            if row is None or row[0] is None:
+                return None
+            item_hashes = dict(
+                self._conn.execute(
+                    "SELECT item_key, item_hash FROM curriculum_items WHERE course_id = ?", (course_id,)
+                ).fetchall()
+            )
+        return item_hashes or None
+
+    def save_curriculum_fingerprint(self, course_id: int, item_hashes: Dict[str, str], curriculum_hash: str) -> None:
+        """
+        Store the fingerprint of a curriculum that has been fully completed
+
+        :param int course_id: id of the course
+        :param dict item_hashes: item key -> item hash
+        :param str curriculum_hash: hash of the whole curriculum
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO courses (id, last_synced) VALUES (?, ?)", (course_id, time.time())
+            )
+            self._conn.execute("DELETE FROM curriculum_items WHERE course_id = ?", (course_id,))
+            self._conn.executemany(
+                "INSERT INTO curriculum_items (course_id, item_key, item_hash) VALUES (?, ?, ?)",
+                ((course_id, key, item_hash) for key, item_hash in item_hashes.items()),
+            )
+            self._conn.execute(
+                "UPDATE courses SET curriculum_hash = ?, completed_curriculum_hash = ? WHERE id = ?",
+                (curriculum_hash, curriculum_hash, course_id),
+            )
+
+    def mark_completed(self, course_id: int) -> None:
+        """
+        Record a course as complete for its current curriculum
+
+        :param int course_id: id of the course
+        :return: None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE courses SET completion_ratio = 100, completed_curriculum_hash = curriculum_hash, "
+                "last_synced = ? WHERE id = ?",
+                (time.time(), course_id),
+            )
+
+    def get_slug_ids(self, slugs: Iterable[str]) -> Dict[str, int]:
+        """
+        Cached course ids of slugs, from the resolved slugs and the known courses
+
+        :param slugs: course slugs
+        :return: slug -> course id for the slugs found
+        """
+        slugs = list(slugs)
+        found = {}
+        with self._lock:
+            # stay well below the max number of sqlite variables
+            for start in range(0, len(slugs), 500):
+                chunk = slugs[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    self._conn.execute(
+                        f"SELECT slug, course_id FROM course_slugs WHERE slug IN ({placeholders}) "
+                        f"UNION SELECT slug, id FROM courses WHERE slug IN ({placeholders})",
+                        chunk + chunk,
+                    ).fetchall()
+                )
+        return found
+
+    def save_slug_ids(self, slug_ids: Dict[str, int]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO course_slugs (slug, course_id, resolved_at) VALUES (?, ?, ?)",
+                ((slug, course_id, time.time()) for slug, course_id in slug_ids.items()),
+            )
+
+    def get_course_metadata(self, course_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Cached metadata used to filter courses before enrolling, see CoursePrefilter
+
+        :param course_ids: ids of the courses
+        :return: course id -> metadata for the courses found
+        """
+        course_ids = list(course_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(course_ids), 500):
+                chunk = course_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(
+                    (course_id, json.loads(metadata))
+                    for course_id, metadata in self._conn.execute(
+                        f"SELECT id, metadata FROM course_metadata WHERE id IN ({placeholders})", chunk
+                    )
+                )
+        return found
+
+    def save_course_metadata(self, metadata: Dict[int, Dict]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO course_metadata (id, metadata, fetched_at) VALUES (?, ?, ?)",
+                ((course_id, json.dumps(course_metadata), time.time()) for course_id, course_metadata in metadata.items()),
+            )
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def summary(self) -> Dict:
+        """
+        Counters describing the catalogue, used by the status command
+
+        :return: dictionary of counters
+        """
+        with self._lock:
+            total, complete, with_quizzes, last_synced = self._conn.execute(
+                "SELECT COUNT(*), SUM(completion_ratio >= 100), SUM(num_quizzes > 0), MAX(last_synced) FROM courses"
+            ).fetchone()
+        return {
+            "courses": total,
+            "complete": complete or 0,
+            "incomplete": len(self.incomplete_courses()),
+            "incomplete_with_quizzes": len(self.incomplete_courses(with_quizzes=True)),
+            "with_quizzes": with_quizzes or 0,
+            "curriculum_changed": len(self.curriculum_changed()),
+            "last_synced": last_synced,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
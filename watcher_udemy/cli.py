@@ -1,13 +1,20 @@
 import argparse
 import logging
 import os.path
+import sqlite3
 from argparse import Namespace
+from datetime import datetime
 from pathlib import Path
 from typing import Tuple, Union
 
-from watcher_udemy import ALL_VALID_BROWSER_STRINGS, DriverManager, Settings
-from watcher_udemy.logging import get_logger
-from watcher_udemy.runner import watch_courses_ui
+from watcher_udemy.driver_manager import ALL_VALID_BROWSER_STRINGS
+from watcher_udemy.answer_store import AnswerKeyStore
+from watcher_udemy.catalogue import CourseCatalogue, catalogue_file_name
+from watcher_udemy.logging import LOG_FORMAT_ENV, get_log_handlers, get_logger, set_log_format
+from watcher_udemy.profiling import PROFILE_ENV, PROFILE_MODES, install_dump_signal
+from watcher_udemy.recording import RECORD_ENV, REPLAY_ENV, REPLAY_SCALE_ENV
+from watcher_udemy.tracing import TRACE_ENV, TRACE_SAMPLE_ENV
+from watcher_udemy.work_queue import open_work_queue, serve_work_queue
 
 logger = get_logger()
 
@@ -19,11 +26,50 @@ def enable_debug_logging() -> None:
     :return: None
     """
     logger.setLevel(logging.DEBUG)
-    for handler in logger.handlers:
+    for handler in get_log_handlers():
         handler.setLevel(logging.DEBUG)
     logger.info(f"Enabled debug logging")
 
 
+def enable_tracing(trace_path: str, sample_rate: float) -> None:
+    """
+    Trace the courses to a Chrome trace file. Set through the environment so the worker processes
+    of the accounts inherit it
+
+    :param str trace_path: Trace file, ignored if None
+    :param float sample_rate: Share of the courses traced
+    :return: None
+    """
+    if trace_path:
+        os.environ[TRACE_ENV] = os.path.abspath(trace_path)
+        os.environ[TRACE_SAMPLE_ENV] = str(sample_rate)
+
+
+def enable_recording(record_path: str, replay_path: str, replay_scale: float) -> bool:
+    """
+    Record the api exchanges to a file, or answer them from one. Set through the environment so the
+    worker processes of the accounts inherit it
+
+    :param str record_path: File to record the exchanges to, ignored if None
+    :param str replay_path: Recording to replay instead of reaching udemy, several are separated by commas, ignored if None
+    :param float replay_scale: Factor applied to the recorded response times when replaying
+    :return: False if the recording to replay doesn't exist
+    """
+    if replay_path:
+        recordings = [recording.strip() for recording in replay_path.split(",") if recording.strip()]
+        for recording in recordings:
+            if not os.path.isfile(recording):
+                logger.error(f"The recording {recording} doesn't exist.")
+                return False
+        os.environ[REPLAY_ENV] = ",".join(os.path.abspath(recording) for recording in recordings)
+        os.environ[REPLAY_SCALE_ENV] = str(replay_scale)
+        logger.info(f"Replaying the api exchanges of {replay_path}")
+    elif record_path:
+        os.environ[RECORD_ENV] = os.path.abspath(record_path)
+        logger.info(f"Recording the api exchanges to {record_path}")
+    return True
+
+
 def run(
         browser: str,
         udemy_scraper_enabled: bool,
@@ -31,7 +77,12 @@ def run(
         delete_settings: bool,
         delete_cookie: bool,
         scrape_urls_from_file: bool,
-        filename: str
+        filename: str,
+        queue_url: str = None,
+        queue_seed: bool = False,
+        daemon: bool = False,
+        interval: float = None,
+        api_enroll: bool = False,
 ):
     """
     Run the udemy enroller script
@@ -41,25 +92,43 @@ def run(
 
     :param bool delete_settings: Determines if we should delete old settings file
     :param bool delete_cookie: Determines if we should delete the cookie file
+    :param str queue_url: Work queue shared with other workers, see open_work_queue
+    :param bool queue_seed: Add the courses found by this worker to the work queue
+    :param bool daemon: Keep running and complete the new courses as they get enrolled
+    :param float interval: Seconds between two syncs of the daemon, DEFAULT_INTERVAL if None
+    :param bool api_enroll: Enroll in the courses through the api, the browser is only a fallback
     :return:
     """
+    # the browser stack is only imported by the commands driving it, to keep the others fast to start
+    from watcher_udemy import DriverManager, Settings
+    from watcher_udemy.daemon import DEFAULT_INTERVAL, run_daemon
+    from watcher_udemy.runner import watch_courses_ui
+
     settings = Settings(delete_settings, delete_cookie)
+    work_queue = open_work_queue(queue_url) if queue_url else None
     if browser:
         dm = DriverManager(browser=browser)
         logger.debug("ci arrivo browser")
+        if daemon:
+            run_daemon(dm.driver, settings, DEFAULT_INTERVAL if interval is None else interval, driver_manager=dm)
+            return
         if udemy_scraper_enabled:
             if scrape_urls_from_file:
-                if os.path.exists(filename) and filename.endswith('.txt'):
+                if filename == "-" or (os.path.exists(filename) and filename.endswith(('.txt', '.gz'))):
                     watch_courses_ui(
                         dm.driver,
                         settings,
                         udemy_scraper_enabled,
                         get_random_links,
                         scrape_urls_from_file,
-                        filename
+                        filename,
+                        work_queue=work_queue,
+                        queue_seed=queue_seed,
+                        api_enroll=api_enroll,
+                        driver_manager=dm,
                     )
                 else:
-                    logger.error("The file you provided either doesn't have a .txt extension or"
+                    logger.error("The file you provided either doesn't have a .txt or .gz extension or"
                                  " doesn't actually exist.")
                     exit(-4)
             else:
@@ -69,7 +138,11 @@ def run(
                     udemy_scraper_enabled,
                     get_random_links,
                     scrape_urls_from_file,
-                    filename
+                    filename,
+                    work_queue=work_queue,
+                    queue_seed=queue_seed,
+                    api_enroll=api_enroll,
+                    driver_manager=dm,
                 )
         else:
             logger.error("EXITING DUE TO NO SCRAPER ENABLED, "
@@ -77,6 +150,112 @@ def run(
             exit(-3)
 
 
+def transfer_answer_keys(import_path: str, export_path: str) -> None:
+    """
+    Bulk import/export the local answer key store so several accounts and machines can share it
+
+    :param str import_path: File to import answer keys from, ignored if None
+    :param str export_path: File to export answer keys to, ignored if None
+    :return: None
+    """
+    answer_store = AnswerKeyStore()
+    try:
+        if import_path:
+            if not os.path.isfile(import_path):
+                logger.error(f"The answer key file {import_path} doesn't exist.")
+                exit(-5)
+            answer_store.import_from(import_path)
+        if export_path:
+            answer_store.export_to(export_path)
+    finally:
+        answer_store.close()
+
+
+def serve_queue(queue_url: str, address: str) -> None:
+    """
+    Serve a SQLite work queue over http so workers on other machines can lease from it
+
+    :param str queue_url: SQLite work queue to serve
+    :param str address: host:port to listen on, the host defaults to 127.0.0.1
+    :return: None
+    """
+    host, _, port = address.rpartition(":")
+    try:
+        server = serve_work_queue(open_work_queue(queue_url), host or "127.0.0.1", int(port))
+    except ValueError as e:
+        logger.error(e)
+        exit(-6)
+    logger.info(f"Serving work queue {queue_url} on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping the work queue server")
+    finally:
+        server.server_close()
+
+
+def print_status() -> None:
+    """
+    Print what the local catalogue knows about the account's courses, without going to the network
+
+    :return: None
+    """
+    from watcher_udemy import Settings
+
+    settings = Settings(read_only=True)
+    if settings.domain is None:
+        logger.error("No settings file with the domain of the account, run the script once first")
+        return
+    db_file_name = catalogue_file_name(settings.cookie_file_name, settings.domain)
+    try:
+        catalogue = CourseCatalogue(db_file_name, read_only=True)
+    except sqlite3.Error as e:
+        logger.error(f"No catalogue {db_file_name} in the app directory yet, run the script once first: {e}")
+        return
+    try:
+        summary = catalogue.summary()
+        last_sync = catalogue.get_meta("last_sync")
+    finally:
+        catalogue.close()
+    last_synced = summary["last_synced"] or (float(last_sync) if last_sync else None)
+    logger.info("==================Catalogue Status==================")
+    logger.info(f"Catalogue:                  {db_file_name}")
+    logger.info(f"Courses:                    {summary['courses']}")
+    logger.info(f"Complete:                   {summary['complete']}")
+    logger.info(f"Incomplete:                 {summary['incomplete']}")
+    logger.info(f"Incomplete with quizzes:    {summary['incomplete_with_quizzes']}")
+    logger.info(f"Curriculum changed:         {summary['curriculum_changed']}")
+    logger.info(
+        f"Last synced:                {datetime.fromtimestamp(last_synced) if last_synced else 'never'}"
+    )
+    logger.info("==================Catalogue Status==================")
+
+
+def print_plan(scrape_urls_from_file: bool, filename: str, api_enroll: bool) -> None:
+    """
+    Print the requests, browser visits and time a run would take, without going to the network or writing anything
+
+    :param bool scrape_urls_from_file: Plan the courses of the file instead of the incomplete ones
+    :param str filename: Name of the file of course urls
+    :param bool api_enroll: The run would enroll through the api
+    :return: None
+    """
+    from watcher_udemy import Settings
+    from watcher_udemy.planner import plan_run
+
+    settings = Settings(read_only=True)
+    if settings.domain is None:
+        logger.error("No settings file with the domain of the account to plan for, run the script once first")
+        return
+    plan_run(
+        settings.domain,
+        filename if scrape_urls_from_file else None,
+        settings.cookie_file_name,
+        api_enroll,
+        bool(settings.languages or settings.categories),
+    )
+
+
 def parse_args() -> Namespace:
     """
     Parse args from the CLI or use the args passed in
@@ -121,14 +300,20 @@ def parse_args() -> Namespace:
     parser.add_argument(
         "--debug",
         action="store_true",
-        default=True,
+        default=False,
         help="Enable debug logging",
     )
     parser.add_argument(
-        "--file",
+        "--log_json",
         action="store_true",
+        default=False,
+        help="Write the logs as json lines, for log shippers",
+    )
+    parser.add_argument(
+        "--file",
+        type=str,
         default="file.txt",
-        help="Name of the file you want to scrape urls from",
+        help="Name of the file you want to scrape urls from, gzipped if it ends with .gz, - to read from stdin",
     )
     parser.add_argument(
         "--scrape_from_file",
@@ -136,6 +321,141 @@ def parse_args() -> Namespace:
         default=False,
         help="Enable scraping from file ",
     )
+    parser.add_argument(
+        "--import_answers",
+        required=False,
+        type=str,
+        default=None,
+        help="Import quiz answer keys from a file created with --export_answers",
+    )
+    parser.add_argument(
+        "--export_answers",
+        required=False,
+        type=str,
+        default=None,
+        help="Export the local quiz answer keys to a gzipped json lines file",
+    )
+    parser.add_argument(
+        "--accounts",
+        required=False,
+        type=str,
+        default=None,
+        help="Run every account of a yaml accounts manifest, each one in its own worker process",
+    )
+    parser.add_argument(
+        "--max_workers",
+        required=False,
+        type=int,
+        default=None,
+        help="Max number of accounts running at the same time, overrides the manifest",
+    )
+
+    parser.add_argument(
+        "--queue",
+        required=False,
+        type=str,
+        default=None,
+        help="Lease courses from a shared work queue: a SQLite file (sqlite:///name.db in the app dir, "
+             "sqlite:////absolute/path.db) or http://host:port",
+    )
+    parser.add_argument(
+        "--queue_seed",
+        action="store_true",
+        default=False,
+        help="Add the courses found by this worker to the work queue before consuming it",
+    )
+    parser.add_argument(
+        "--api_enroll",
+        action="store_true",
+        default=False,
+        help="Enroll in the courses through the api in concurrent batches, the browser is only a fallback",
+    )
+    parser.add_argument(
+        "--serve_queue",
+        required=False,
+        type=str,
+        default=None,
+        help="Serve the --queue SQLite work queue over http on host:port instead of running, "
+             "binding another host than 127.0.0.1 needs WATCHER_UDEMY_QUEUE_TOKEN",
+    )
+
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help="Keep running, syncing the enrolled courses and completing the new ones",
+    )
+    parser.add_argument(
+        "--interval",
+        required=False,
+        type=float,
+        default=None,
+        help="Seconds between two syncs in daemon mode, 900 by default",
+    )
+
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        default=False,
+        help="Print the status of the local course catalogue, catalogue-<domain>.db in the app directory, and exit",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        default=False,
+        help="Print the requests, browser sessions and time the run would take, without running it",
+    )
+
+    parser.add_argument(
+        "--record",
+        required=False,
+        type=str,
+        default=None,
+        help="Record the api exchanges, redacted, to this gzipped file to replay them later. "
+             "The worker processes of the accounts record to the file suffixed with their pid",
+    )
+    parser.add_argument(
+        "--replay",
+        required=False,
+        type=str,
+        default=None,
+        help="Answer the api requests from a recording made with --record instead of udemy, "
+             "several recordings are separated by commas",
+    )
+    parser.add_argument(
+        "--replay_scale",
+        required=False,
+        type=float,
+        default=1.0,
+        help="Factor applied to the recorded response times when replaying, 0 to answer right away",
+    )
+
+    parser.add_argument(
+        "--trace",
+        required=False,
+        type=str,
+        default=None,
+        help="Write a trace of every course, its api calls and browser waits, to this Chrome trace json file",
+    )
+    parser.add_argument(
+        "--trace_sample",
+        required=False,
+        type=float,
+        default=1.0,
+        help="Share of the courses traced, between 0 and 1",
+    )
+
+    parser.add_argument(
+        "--profile",
+        required=False,
+        type=str,
+        nargs="?",
+        const="all",
+        default=None,
+        choices=PROFILE_MODES,
+        help="Profile every phase of the run with cProfile (cpu), tracemalloc (memory) or both (all), "
+             "the profiles are written to the app dir",
+    )
 
     args = parser.parse_args()
     logger.debug(args)
@@ -145,9 +465,43 @@ def parse_args() -> Namespace:
 def main():
     args = parse_args()
     if args:
+        if args.log_json:
+            # set through the environment so the worker processes of the accounts inherit it
+            os.environ[LOG_FORMAT_ENV] = "json"
+            set_log_format("json")
         if args.debug:
             enable_debug_logging()
 
+        if args.status:
+            print_status()
+            return
+
+        if args.plan:
+            print_plan(args.scrape_from_file, args.file, args.api_enroll)
+            return
+
+        if not enable_recording(args.record, args.replay, args.replay_scale):
+            return
+        enable_tracing(args.trace, args.trace_sample)
+        if args.profile:
+            # set through the environment so the worker processes of the accounts inherit it
+            os.environ[PROFILE_ENV] = args.profile
+        install_dump_signal()
+
+        if args.import_answers or args.export_answers:
+            transfer_answer_keys(args.import_answers, args.export_answers)
+            return
+
+        if args.serve_queue:
+            serve_queue(args.queue or "work_queue.db", args.serve_queue)
+            return
+
+        if args.accounts:
+            from watcher_udemy.orchestrator import run_accounts
+
+            run_accounts(args.accounts, args.browser, args.max_workers)
+            return
+
         run(
             args.browser,
             args.udemybase,
@@ -155,5 +509,10 @@ def main():
             args.delete_settings,
             args.delete_cookie,
             args.scrape_from_file,
-            args.file
+            args.file,
+            args.queue,
+            args.queue_seed,
+            args.daemon,
+            args.interval,
+            args.api_enroll,
         )
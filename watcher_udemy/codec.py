@@ -0,0 +1,149 @@
+import json
+import re
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    # the standard library decodes everything without orjson, list pages are then walked one result at a time
+    orjson = None
+
+RESULTS_KEY = "results"
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def loads(data: Union[bytes, bytearray, str]):
+    """
+    Decode a json document, with orjson when it is installed
+
+    :param data: the document
+    :return: the decoded value
+    :raises ValueError: if the document isn't valid json
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value) -> str:
+    """
+    Encode a value to compact json, with orjson when it is installed
+
+    :param value: value to encode
+    :return: the json document
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"))
+
+
+def response_json(response):
+    """
+    Decode the body of a response, in place of response.json()
+
+    :param response: requests response
+    :return: the decoded body
+    """
+    return loads(response.content)
+
+
+def project(item, fields: Optional[Sequence[str]]):
+    if fields is None or not isinstance(item, dict):
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+def _skip(text: str, index: int) -> int:
+    return _whitespace.match(text, index).end()
+
+
+def _expect(text: str, index: int, characters: str) -> str:
+    character = text[index:index + 1]
+    if not character or character not in characters:
+        raise json.JSONDecodeError(f"Expecting one of {characters!r}", text, index)
+    return character
+
+
+def _walk_page(text: str, fields: Optional[Sequence[str]]) -> Iterator[Tuple[str, object]]:
+    index = _skip(text, 0)
+    _expect(text, index, "{")
+    index = _skip(text, index + 1)
+    if text[index:index + 1] == "}":
+        return
+    while True:
+        key, index = _decoder.raw_decode(text, index)
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", text, index)
+        index = _skip(text, index)
+        _expect(text, index, ":")
+        index = _skip(text, index + 1)
+        if key == RESULTS_KEY and text[index:index + 1] == "[":
+            # every result is decoded, projected and handed over before the next one is read
+            index = _skip(text, index + 1)
+            if text[index:index + 1] == "]":
+                index += 1
+            else:
+                while True:
+                    item, index = _decoder.raw_decode(text, index)
+                    yield key, project(item, fields)
+                    index = _skip(text, index)
+                    if _expect(text, index, ",]") == "]":
+                        index += 1
+                        break
+                    index = _skip(text, index + 1)
+        else:
+            value, index = _decoder.raw_decode(text, index)
+            if key != RESULTS_KEY:
+                yield key, value
+        index = _skip(text, index)
+        if _expect(text, index, ",}") == "}":
+            return
+        index = _skip(text, index + 1)
+
+
+def iter_page(
+        data: Union[bytes, bytearray, str], fields: Optional[Sequence[str]] = None
+) -> Iterator[Tuple[str, object]]:
+    """
+    Walk a page of a list endpoint ({"count", "next", "previous", "results": [...]}) keeping only
+    the fields wanted of every result. Without orjson the page is never decoded whole, only the
+    projected results are kept in memory
+
+    :param data: body of the page
+    :param fields: fields kept of every result, all of them if None
+    :return: generator of (key, value) for the top level keys, and of (RESULTS_KEY, projected result) per result,
+        results that aren't a list are left out
+    :raises ValueError: if the page isn't valid json
+    """
+    if orjson is not None:
+        # decoding the whole page in C beats walking it from python, the full results are dropped right away
+        page = orjson.loads(data)
+        if not isinstance(page, dict):
+            raise ValueError(f"Expecting a page object, got {type(page).__name__}")
+        results = page.pop(RESULTS_KEY, None)
+        yield from page.items()
+        for item in results if isinstance(results, list) else ():
+            yield RESULTS_KEY, project(item, fields)
+        return
+    text = data.decode("utf-8") if isinstance(data, (bytes, bytearray)) else data
+    yield from _walk_page(text, fields)
+
+
+def decode_page(data: Union[bytes, bytearray, str], fields: Optional[Sequence[str]] = None) -> Dict:
+    """
+    Decode a page of a list endpoint keeping only the fields wanted of every result
+
+    :param data: body of the page
+    :param fields: fields kept of every result, all of them if None
+    :return: the page, with its results projected
+    :raises ValueError: if the page isn't valid json
+    """
+    page = {RESULTS_KEY: []}
+    for key, value in iter_page(data, fields):
+        if key == RESULTS_KEY:
+            page[RESULTS_KEY].append(value)
+        else:
+            page[key] = value
+    return page
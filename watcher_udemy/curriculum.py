@@ -0,0 +1,84 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Fields of a curriculum item that change when an instructor edits or replaces it
+FINGERPRINT_FIELDS = ("title", "is_published", "type", "version")
+TRACKED_CLASSES = ("lecture", "quiz")
+# Fields of a curriculum item read by the run, the others are dropped while decoding the curriculum pages
+CURRICULUM_FIELDS = ("_class", "id", "asset", *FINGERPRINT_FIELDS)
+
+
+def item_key(item: Dict) -> str:
+    return f"{item['_class']}:{item['id']}"
+
+
+def fingerprint_item(item: Dict) -> str:
+    """
+    Hash of the fields of a curriculum item that matter to us
+
+    :param dict item: lecture or quiz as returned by the curriculum api
+    :return: hex digest
+    """
+    parts = {field: item.get(field) for field in FINGERPRINT_FIELDS}
+    parts["asset"] = (item.get("asset") or {}).get("id")
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def fingerprint_curriculum(item_hashes: Dict[str, str]) -> str:
+    """
+    Hash of a whole curriculum, changes whenever an item is added, removed or edited
+
+    :param dict item_hashes: item key -> item hash
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for key in sorted(item_hashes):
+        digest.update(f"{key}={item_hashes[key]};".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class CurriculumDelta:
+    items: List[Dict]
+    item_hashes: Dict[str, str]
+    curriculum_hash: str
+    new_lecture_ids: List[int]
+    new_quiz_ids: List[int]
+    # True when nothing was stored for the course, the whole course has to be processed
+    is_first_sync: bool
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.new_lecture_ids and not self.new_quiz_ids
+
+
+def compute_delta(items: List[Dict], stored_hashes: Optional[Dict[str, str]]) -> CurriculumDelta:
+    """
+    Compare the current curriculum of a course with the fingerprint stored when it was last completed
+
+    :param list items: current curriculum items of the course
+    :param dict stored_hashes: item key -> item hash stored for the course, None if never stored
+    :return: CurriculumDelta listing the new or edited lectures and quizzes
+    """
+    tracked_items = [item for item in items if item.get("_class") in TRACKED_CLASSES]
+    item_hashes = {item_key(item): fingerprint_item(item) for item in tracked_items}
+    new_lecture_ids = []
+    new_quiz_ids = []
+    for item in tracked_items:
+        key = item_key(item)
+        if stored_hashes is not None and stored_hashes.get(key) == item_hashes[key]:
+            continue
+        if item["_class"] == "lecture":
+            new_lecture_ids.append(item["id"])
+        else:
+            new_quiz_ids.append(item["id"])
+    return CurriculumDelta(
+        items=items,
+        item_hashes=item_hashes,
+        curriculum_hash=fingerprint_curriculum(item_hashes),
+        new_lecture_ids=new_lecture_ids,
+        new_quiz_ids=new_quiz_ids,
+        is_first_sync=stored_hashes is None,
+    )
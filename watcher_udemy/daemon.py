@@ -0,0 +1,161 @@
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from selenium.common.exceptions import WebDriverException
+
+from watcher_udemy import DriverManager, Settings, UdemyActionsUI, exceptions
+from watcher_udemy.logging import get_logger
+from watcher_udemy.metrics import get_metrics, metrics_file_name, phase
+from watcher_udemy.ratelimit import RateLimiter
+from watcher_udemy.runner import _process_course_link
+from watcher_udemy.watchdog import BrowserWatchdog
+
+logger = get_logger()
+
+DEFAULT_INTERVAL = 15 * 60
+# Every incomplete course of the catalogue is tried again at startup and then this often, the other
+# ticks only process the courses the sync brought and the ones whose backoff ran out
+FULL_SWEEP_INTERVAL = 6 * 3600
+
+
+@phase("discovery")
+def _sync_courses(udemy_actions: UdemyActionsUI, known_ids: Set[int]) -> Tuple[List[int], List[int]]:
+    """
+    Fetch only the courses enrolled or accessed since the last sync and add them to the catalogue
+
+    :param UdemyActionsUI udemy_actions: Logged in udemy actions
+    :param set known_ids: Ids of the courses in the catalogue, updated in place
+    :return: ids of the newly found courses, and of the courses accessed since the last sync
+    """
+    sync_start = time.time()
+    new_courses = list(udemy_actions._iter_new_subscribed_courses(known_ids))
+    udemy_actions.catalogue.upsert_courses(new_courses)
+    known_ids.update(course['id'] for course in new_courses)
+    accessed_courses = []
+    if last_sync := udemy_actions.catalogue.get_meta("last_sync"):
+        # progress made in the browser or by another run since the last sync
+        accessed_courses = list(udemy_actions._iter_recently_accessed_courses(float(last_sync)))
+        udemy_actions.catalogue.upsert_courses(accessed_courses)
+        known_ids.update(course['id'] for course in accessed_courses)
+    udemy_actions.catalogue.set_meta("last_sync", str(sync_start))
+    return [course['id'] for course in new_courses], [course['id'] for course in accessed_courses]
+
+
+def _tick(
+        udemy_actions: UdemyActionsUI,
+        settings: Settings,
+        known_ids: Set[int],
+        skipped_ticks: Dict[int, Tuple[int, int]],
+        watchdog: Optional[BrowserWatchdog] = None,
+        sweep: bool = False,
+) -> Dict[str, int]:
+    """
+    Run a single sync and process the courses it brought, and the ones whose backoff ran out
+
+    :param dict skipped_ticks: course id -> (ticks left to skip, failures) of the courses that failed,
+        so a course that can't be completed doesn't cost requests on every idle tick
+    :param BrowserWatchdog watchdog: Restarts the browser when it grows too big or hangs
+    :param bool sweep: Process every incomplete course of the catalogue that isn't backing off
+    :return: counters of the tick
+    """
+    udemy_actions.refresh_login_if_needed()
+    new_course_ids, accessed_course_ids = _sync_courses(udemy_actions, known_ids)
+    if new_course_ids:
+        logger.info(f"Found {len(new_course_ids)} new courses: {new_course_ids}")
+
+    pending_ids = udemy_actions.catalogue.incomplete_courses()
+    due_ids = set(new_course_ids) | set(accessed_course_ids)
+    for course_id in set(skipped_ticks) - set(pending_ids):
+        # completed elsewhere
+        del skipped_ticks[course_id]
+    for course_id, (ticks_left, failures) in list(skipped_ticks.items()):
+        if ticks_left > 0:
+            skipped_ticks[course_id] = (ticks_left - 1, failures)
+        else:
+            due_ids.add(course_id)
+    if sweep:
+        due_ids.update(course_id for course_id in pending_ids if course_id not in skipped_ticks)
+
+    completed = 0
+    for course_id in pending_ids:
+        if course_id not in due_ids:
+            continue
+        failures = skipped_ticks.get(course_id, (0, 0))[1]
+        finished = False
+        browser_failed = False
+        try:
+            finished = _process_course_link(udemy_actions, settings, udemy_actions.URL_TO_COURSE_ID.format(course_id))
+        except (KeyboardInterrupt, exceptions.RobotException):
+            raise
+        except WebDriverException as e:
+            logger.error(f"Webdriver exception on course {course_id}: {e}")
+            browser_failed = True
+        except Exception as e:
+            logger.error(f"Unexpected exception on course {course_id}: {e}", exc_info=True)
+        if watchdog is not None:
+            watchdog.check(udemy_actions, failed=browser_failed)
+        if finished:
+            completed += 1
+            skipped_ticks.pop(course_id, None)
+        else:
+            # skip 1, 2, 4... ticks, up to a day worth of default ticks
+            skipped_ticks[course_id] = (min(2 ** failures, 96), failures + 1)
+    return {"new": len(new_course_ids), "completed": completed, "pending": len(pending_ids) - completed}
+
+
+@phase("run")
+def run_daemon(
+        driver,
+        settings: Settings,
+        interval: float = DEFAULT_INTERVAL,
+        rate_limiter: Optional[RateLimiter] = None,
+        driver_manager: Optional[DriverManager] = None,
+) -> None:
+    """
+    Keep the session and the course catalogue warm, completing new courses as they get enrolled.
+    The first tick walks every subscribed course, the following ones only what changed since.
+
+    :param WebDriver driver: WebDriver kept open for the flows that need the browser
+    :param Settings settings: Core settings used for Udemy
+    :param float interval: Seconds between two syncs
+    :param RateLimiter rate_limiter: Optional request budget shared with other accounts of the domain
+    :param DriverManager driver_manager: Manager of the driver, lets a watchdog restart the browser between courses
+    :return: None
+    """
+    udemy_actions = UdemyActionsUI(driver, settings, settings.cookie_file_name, rate_limiter)
+    udemy_actions.login()
+    known_ids = udemy_actions.catalogue.known_ids()
+    skipped_ticks = {}
+    watchdog = BrowserWatchdog(driver_manager) if driver_manager is not None else None
+    logger.info(f"Watch daemon started, {len(known_ids)} known courses, syncing every {interval}s")
+    last_sweep = None
+    try:
+        while True:
+            tick_start = time.time()
+            sweep = last_sweep is None or tick_start - last_sweep >= FULL_SWEEP_INTERVAL
+            if sweep:
+                last_sweep = tick_start
+            try:
+                counters = _tick(udemy_actions, settings, known_ids, skipped_ticks, watchdog, sweep)
+            except exceptions.RobotException as e:
+                logger.error(e)
+                return
+            except Exception as e:
+                logger.error(f"Daemon tick failed: {e}", exc_info=True)
+            else:
+                logger.info(
+                    f"Daemon tick done in {time.time() - tick_start:.1f}s: {counters['new']} new, "
+                    f"{counters['completed']} completed, {counters['pending']} pending"
+                )
+            get_metrics().export(udemy_actions.stats, metrics_file_name(settings.cookie_file_name))
+            time.sleep(max(0.0, interval - (time.time() - tick_start)))
+    except KeyboardInterrupt:
+        logger.warning("Stopping the watch daemon")
+    finally:
+        udemy_actions.stats.table()
+        get_metrics().export(udemy_actions.stats, metrics_file_name(settings.cookie_file_name))
+        logger.info("Closing browser")
+        if driver_manager is not None:
+            driver_manager.quit()
+        elif driver is not None:
+            driver.quit()
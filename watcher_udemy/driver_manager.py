@@ -1,13 +1,10 @@
-from selenium import webdriver
-from selenium.webdriver import DesiredCapabilities
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.utils import ChromeType
-from webdriver_manager.firefox import GeckoDriverManager
-from webdriver_manager.microsoft import EdgeChromiumDriverManager, IEDriverManager
-from webdriver_manager.opera import OperaDriverManager
+import json
+import os
+import time
+from typing import Callable, Dict
 
 from watcher_udemy.logging import get_logger
+from watcher_udemy.utils import get_app_dir
 
 logger = get_logger()
 
@@ -20,13 +17,126 @@ VALID_EDGE_STRINGS = {"edge"}
 
 ALL_VALID_BROWSER_STRINGS = VALID_CHROME_STRINGS.union(VALID_CHROMIUM_STRINGS)
 
+# Driver binaries resolved by webdriver_manager, which checks the latest version online on every install()
+DRIVER_CACHE_FILE = "driver_cache.json"
+DRIVER_CACHE_TTL = 7 * 24 * 3600
+
+
+def _load_driver_cache() -> Dict[str, Dict]:
+    try:
+        with open(os.path.join(get_app_dir(), DRIVER_CACHE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_driver_cache(cache: Dict[str, Dict]) -> None:
+    file_name = os.path.join(get_app_dir(), DRIVER_CACHE_FILE)
+    # the worker processes of the accounts may resolve their drivers at the same time
+    tmp_file = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_file, file_name)
+    except OSError as e:
+        logger.warning(f"Couldn't save the driver cache: {e}")
+
+
+def cached_driver_path(browser: str, install: Callable[[], str], refresh: bool = False) -> str:
+    """
+    Path of the driver binary of a browser, resolved by webdriver_manager at most once a week
+
+    :param str browser: key of the browser in the cache
+    :param install: webdriver_manager install() of the browser, returning the path of the binary
+    :param bool refresh: ignore the cached path, e.g. after the browser got updated
+    :return: path of the driver binary
+    """
+    cache = _load_driver_cache()
+    entry = cache.get(browser)
+    if (
+            not refresh
+            and entry
+            and time.time() - entry.get("resolved", 0) < DRIVER_CACHE_TTL
+            and os.access(entry.get("path", ""), os.X_OK)
+    ):
+        return entry["path"]
+    path = install()
+    cache[browser] = {
+        "path": path,
+        # webdriver_manager keeps every version in a directory of its own
+        "version": os.path.basename(os.path.dirname(path)),
+        "resolved": time.time(),
+    }
+    _save_driver_cache(cache)
+    logger.info(f"Resolved the {browser} driver to {path}")
+    return path
+
 
 class DriverManager:
-    def __init__(self, browser: str):
-        self.driver = None
+    def __init__(self, browser: str, lazy: bool = False, rate_limiter=None):
+        """
+        :param str browser: Browser to drive
+        :param bool lazy: Start the browser the first time the driver is needed, not right away
+        :param RateLimiter rate_limiter: Request budget of the domain, the page loads take from it too
+        """
+        self._driver = None
         self.options = None
         self.browser = browser
-        self._init_driver()
+        self.rate_limiter = rate_limiter
+        if not lazy:
+            self._init_driver()
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            logger.info(f"Starting the {self.browser} browser")
+            self._init_driver()
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver) -> None:
+        self._driver = driver
+
+    @property
+    def started(self) -> bool:
+        return self._driver is not None
+
+    def quit(self) -> None:
+        """
+        Close the browser if it was ever started
+
+        :return: None
+        """
+        if self._driver is not None:
+            self._driver.quit()
+
+    def _rate_limit_page_loads(self) -> None:
+        get = self._driver.get
+
+        def rate_limited_get(url: str):
+            self.rate_limiter.acquire()
+            return get(url)
+
+        self._driver.get = rate_limited_get
+
+    @staticmethod
+    def _start_driver(browser: str, install: Callable[[], str], start: Callable):
+        """
+        Start the driver from the cached binary, resolving it again if it doesn't fit the browser anymore
+
+        :param str browser: key of the browser in the driver cache
+        :param install: webdriver_manager install() of the browser
+        :param start: creates the WebDriver from the path of the binary
+        :return: the WebDriver
+        """
+        from selenium.common.exceptions import SessionNotCreatedException
+
+        try:
+            return start(cached_driver_path(browser, install))
+        except SessionNotCreatedException as e:
+            # the browser got updated past the version of the cached driver
+            logger.warning(f"The cached {browser} driver couldn't start a session, resolving it again: {e}")
+            return start(cached_driver_path(browser, install, refresh=True))
 
     def _init_driver(self):
         """
@@ -35,7 +145,12 @@ class DriverManager:
         :return: None
         """
 
+        from selenium import webdriver
+        from selenium.webdriver import DesiredCapabilities
+
         if self.browser.lower() in VALID_CHROME_STRINGS:
+            from webdriver_manager.chrome import ChromeDriverManager
+
             #enabling performance and request profiling
             caps = DesiredCapabilities.CHROME
             # as per latest docs
@@ -45,26 +160,46 @@ class DriverManager:
             self.options.add_argument("--mute-audio")
             self.options.add_experimental_option("useAutomationExtension", False)
             self.options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            self.driver = webdriver.Chrome( ChromeDriverManager().install(), options=self.options, desired_capabilities=caps)
-
-
-
+            self.driver = self._start_driver(
+                "chrome",
+                lambda: ChromeDriverManager().install(),
+                lambda path: webdriver.Chrome(path, options=self.options, desired_capabilities=caps),
+            )
         elif self.browser.lower() in VALID_CHROMIUM_STRINGS:
-            self.driver = webdriver.Chrome(
-                ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()
+            from webdriver_manager.chrome import ChromeDriverManager
+            from webdriver_manager.core.utils import ChromeType
+
+            self.driver = self._start_driver(
+                "chromium",
+                lambda: ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install(),
+                webdriver.Chrome,
             )
         elif self.browser.lower() in VALID_EDGE_STRINGS:
-            self.driver = webdriver.Edge(EdgeChromiumDriverManager().install())
+            from webdriver_manager.microsoft import EdgeChromiumDriverManager
+
+            self.driver = self._start_driver(
+                "edge", lambda: EdgeChromiumDriverManager().install(), webdriver.Edge
+            )
         elif self.browser.lower() in VALID_FIREFOX_STRINGS:
-            self.driver = webdriver.Firefox(
-                executable_path=GeckoDriverManager().install()
+            from webdriver_manager.firefox import GeckoDriverManager
+
+            self.driver = self._start_driver(
+                "firefox",
+                lambda: GeckoDriverManager().install(),
+                lambda path: webdriver.Firefox(executable_path=path),
             )
         elif self.browser.lower() in VALID_OPERA_STRINGS:
-            self.driver = webdriver.Opera(
-                executable_path=OperaDriverManager().install()
+            from webdriver_manager.opera import OperaDriverManager
+
+            self.driver = self._start_driver(
+                "opera",
+                lambda: OperaDriverManager().install(),
+                lambda path: webdriver.Opera(executable_path=path),
             )
         elif self.browser.lower() in VALID_INTERNET_EXPLORER_STRINGS:
-            self.driver = webdriver.Ie(IEDriverManager().install())
+            from webdriver_manager.microsoft import IEDriverManager
+
+            self.driver = self._start_driver("ie", lambda: IEDriverManager().install(), webdriver.Ie)
         else:
             raise ValueError("No matching browser found")
 
@@ -79,6 +214,9 @@ class DriverManager:
         )
         # Maximize the browser
         self.driver.maximize_window()
+        if self.rate_limiter is not None:
+            # one slot per navigation, the requests of the page itself can't be spaced out
+            self._rate_limit_page_loads()
 
 
 
@@ -14,6 +14,14 @@ class LoginException(Exception):
     pass
 
 
+class AnswerKeyException(Exception):
+    """
+    The answer key of an assessment is missing from the local store
+    """
+
+    pass
+
+
 class CourseNotFoundException(Exception):
     """
        You have failed to find the course id
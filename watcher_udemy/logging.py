@@ -1,23 +1,213 @@
+import atexit
+import json
 import logging
 import logging.config
+import logging.handlers
+import multiprocessing.util
 import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 
 from watcher_udemy.utils import get_app_dir
 
+# Environment variables choosing the log output, the cli sets them so the worker processes inherit them
+LOG_FORMAT_ENV = "WATCHER_UDEMY_LOG_FORMAT"
+LOG_SYNC_ENV = "WATCHER_UDEMY_LOG_SYNC"
 
-class CustomFileHandler(logging.FileHandler):
+LOG_FORMAT = "%(asctime)s::%(name)s::%(levelname)s::%(module)s: %(message)s"
+LOG_FORMATS = ("text", "json")
+
+# app.log is rotated once it reaches this size, keeping that many old files
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+
+# Hot path messages let through per call site: a burst, then one every interval
+HOT_BURST = 5
+HOT_INTERVAL = 10.0
+
+# Attributes every record has, the others were given through extra= and go to the json output
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "hot"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handlers: List[logging.Handler] = []
+
+
+class CustomFileHandler(logging.handlers.RotatingFileHandler):
     """
-    Allows us to log to the app directory
+    Allows us to log to the app directory, rotating the file once it grows too big
     """
 
-    def __init__(self, file_name="app.log", mode="a"):
+    def __init__(self, file_name="app.log", mode="a", max_bytes=MAX_LOG_BYTES, backup_count=LOG_BACKUPS):
         log_file_path = os.path.join(get_app_dir(), file_name)
-        super(CustomFileHandler, self).__init__(log_file_path, mode)
+        super(CustomFileHandler, self).__init__(
+            log_file_path, mode, maxBytes=max_bytes, backupCount=backup_count
+        )
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per record, with the fields given through extra=
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class HotPathFilter(logging.Filter):
+    """
+    Rate limits the records logged with extra={"hot": True}, per call site: a burst goes through,
+    then one record every interval, which says how many were dropped since the last one
+    """
+
+    def __init__(self, burst: int = HOT_BURST, interval: float = HOT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        # call site -> [records let through, time of the last one, records dropped since]
+        self._sites: Dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "hot", False):
+            return True
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.setdefault((record.pathname, record.lineno), [0, now, 0])
+            if site[0] < self.burst or now - site[1] >= self.interval:
+                site[0] += 1
+                site[1] = now
+                dropped, site[2] = site[2], 0
+            else:
+                site[2] += 1
+                return False
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar messages dropped)"
+            record.args = None
+        return True
+
+
+def _start_listener() -> None:
+    """
+    Hand the records to a background thread writing them, so the threads of the run never wait on the disk
+    """
+    global _listener
+    my_logger = logging.getLogger("watcher_udemy")
+    for handler in list(my_logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            my_logger.removeHandler(handler)
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(HotPathFilter())
+    my_logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(records, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _after_fork() -> None:
+    # the writer thread doesn't survive a fork, the worker processes of the accounts start their own
+    if _listener is not None:
+        _start_listener()
+
+
+def _flush_at_process_exit(_) -> None:
+    # multiprocessing workers leave through os._exit, which skips atexit
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=0)
+
+
+def stop_logging() -> None:
+    """
+    Write the records still queued and stop the background writer
+
+    :return: None
+    """
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+def set_log_format(log_format: str) -> None:
+    """
+    Switch the output of the handlers between text and json lines
+
+    :param str log_format: text or json
+    :return: None
+    """
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(fmt=LOG_FORMAT)
+    for handler in _handlers:
+        if not isinstance(handler, logging.handlers.QueueHandler):
+            # forwarded records are formatted by the process writing them
+            handler.setFormatter(formatter)
+
+
+def forward_file_logs(records) -> None:
+    """
+    Send the records of a worker process to the parent instead of writing app.log, the parent alone
+    writes and rotates the file. Meant as the initializer of the process pool
+
+    :param records: queue the parent reads through write_forwarded_logs
+    :return: None
+    """
+    my_logger = logging.getLogger("watcher_udemy")
+    for index, handler in enumerate(_handlers):
+        if isinstance(handler, CustomFileHandler):
+            queue_handler = logging.handlers.QueueHandler(records)
+            queue_handler.setLevel(handler.level)
+            if handler in my_logger.handlers:
+                my_logger.removeHandler(handler)
+                my_logger.addHandler(queue_handler)
+            # the file stays open in the parent
+            _handlers[index] = queue_handler
+    if _listener is not None:
+        stop_logging()
+        _start_listener()
+
+
+def write_forwarded_logs(records) -> logging.handlers.QueueListener:
+    """
+    Write to app.log the records the worker processes forward through forward_file_logs
+
+    :param records: queue shared with the worker processes
+    :return: the started listener, to stop once the workers are done
+    """
+    file_handlers = [handler for handler in _handlers if isinstance(handler, CustomFileHandler)]
+    listener = logging.handlers.QueueListener(records, *file_handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def get_log_handlers() -> List[logging.Handler]:
+    """
+    Handlers writing the records, behind the queue when logging in the background
+
+    :return: the file and stream handlers
+    """
+    return list(_handlers) or logging.getLogger("watcher_udemy").handlers
 
 
 def load_logging_config() -> None:
     """
-    Load logging configuration
+    Load logging configuration. Records are written by a background thread unless WATCHER_UDEMY_LOG_SYNC
+    is set, as json lines when WATCHER_UDEMY_LOG_FORMAT is json
 
     :return: None
     """
@@ -26,16 +216,22 @@ def load_logging_config() -> None:
     my_logger.setLevel(logging.INFO)
 
     # File handler
-    file_handler = CustomFileHandler()
-    log_format = "%(asctime)s::%(name)s::%(levelname)s::%(module)s: %(message)s"
-    formatter = logging.Formatter(fmt=log_format)
-    file_handler.setFormatter(formatter)
-    my_logger.addHandler(file_handler)
+    _handlers.append(CustomFileHandler())
 
     # Basic format for streamhandler
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    my_logger.addHandler(stream_handler)
+    _handlers.append(logging.StreamHandler())
+    set_log_format(os.environ.get(LOG_FORMAT_ENV, "text"))
+
+    if os.environ.get(LOG_SYNC_ENV):
+        for handler in _handlers:
+            my_logger.addHandler(handler)
+        my_logger.addFilter(HotPathFilter())
+        return
+    _start_listener()
+    atexit.register(stop_logging)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork)
+    multiprocessing.util.register_after_fork(my_logger, _flush_at_process_exit)
 
 
 def get_logger() -> logging.Logger:
@@ -0,0 +1,359 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+from typing import Dict, Iterable, Optional, Tuple
+
+from requests.adapters import BaseAdapter
+
+from watcher_udemy.logging import get_logger
+from watcher_udemy.profiling import get_profiler
+from watcher_udemy.tracing import span
+from watcher_udemy.utils import get_app_dir
+
+logger = get_logger()
+
+# Upper bounds of the latency buckets, in seconds, from a cached api call to a slow quiz
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    labels = (*labels, *extra)
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Histogram:
+    """
+    Cumulative latency histogram, in the Prometheus way
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> Iterable[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip((*map(str, self.buckets), "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Upper bound of the bucket holding the quantile, None without observations or above the last bucket
+
+        :param float q: quantile, between 0 and 1
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and latency histograms of the process, labelled per endpoint, phase, wait site...
+    Exported as a Prometheus text file and as json in the app dir
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self.start_time = time.time()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms.get(name, {}).get(_labels(labels))
+
+    def cache_access(self, cache: str, hit: bool, count: int = 1) -> None:
+        """
+        Count the hits or the misses of a cache
+
+        :param str cache: name of the cache
+        :param bool hit: True if the value was found in the cache
+        :param int count: number of accesses
+        """
+        if count:
+            self.inc("cache_requests_total", count, cache=cache, result="hit" if hit else "miss")
+
+    def cache_hit_rates(self) -> Dict[str, float]:
+        with self._lock:
+            accesses: Dict[str, Dict[str, float]] = {}
+            for labels, value in self._counters.get("cache_requests_total", {}).items():
+                labels = dict(labels)
+                accesses.setdefault(labels["cache"], {})[labels["result"]] = value
+        return {
+            cache: counts.get("hit", 0) / (counts.get("hit", 0) + counts.get("miss", 0))
+            for cache, counts in accesses.items()
+        }
+
+    def phase_summary(self) -> Dict[str, Tuple[int, float]]:
+        """
+        :return: phase -> (times entered, seconds spent)
+        """
+        with self._lock:
+            return {
+                dict(labels)["phase"]: (histogram.count, histogram.sum)
+                for labels, histogram in self._histograms.get("phase_seconds", {}).items()
+            }
+
+    def update_run(self, stats) -> None:
+        """
+        Mirror the counters of a RunStatistics as gauges, along with the derived rates
+
+        :param RunStatistics stats: statistics of the run
+        """
+        for name, value in stats.to_dict().items():
+            self.set(name if name.startswith("run_") else f"run_{name}", value)
+        self.set("run_courses_per_hour", stats.courses_per_hour())
+        for cache, rate in self.cache_hit_rates().items():
+            self.set("cache_hit_ratio", rate, cache=cache)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_seconds": time.time() - self.start_time,
+                "counters": {
+                    name: [{"labels": dict(labels), "value": value} for labels, value in values.items()]
+                    for name, values in self._counters.items()
+                },
+                "gauges": {
+                    name: [{"labels": dict(labels), "value": value} for labels, value in values.items()]
+                    for name, values in self._gauges.items()
+                },
+                "histograms": {
+                    name: [{"labels": dict(labels), **histogram.to_dict()} for labels, histogram in values.items()]
+                    for name, values in self._histograms.items()
+                },
+            }
+
+    def to_prometheus(self, prefix: str = "watcher_udemy_") -> str:
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, values in sorted(metrics.items()):
+                    if name in self._help:
+                        lines.append(f"# HELP {prefix}{name} {self._help[name]}")
+                    lines.append(f"# TYPE {prefix}{name} {kind}")
+                    lines.extend(f"{prefix}{name}{_format_labels(labels)} {value}" for labels, value in values.items())
+            for name, values in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {prefix}{name} {self._help[name]}")
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for labels, histogram in values.items():
+                    lines.extend(
+                        f"{prefix}{name}_bucket{_format_labels(labels, (('le', bound),))} {count}"
+                        for bound, count in histogram.cumulative()
+                    )
+                    lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{prefix}{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, stats=None, file_name: str = "metrics") -> None:
+        """
+        Write the metrics to <file_name>.prom and <file_name>.json in the app dir
+
+        :param RunStatistics stats: statistics of the run, mirrored in the export
+        :param str file_name: base name of the files
+        """
+        if stats is not None:
+            self.update_run(stats)
+        base = os.path.join(get_app_dir(), file_name)
+        try:
+            for extension, content in (
+                    ("prom", self.to_prometheus()), ("json", json.dumps(self.to_dict(), indent=2)),
+            ):
+                tmp_file = f"{base}.{extension}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    f.write(content)
+                os.replace(tmp_file, f"{base}.{extension}")
+        except OSError as e:
+            logger.warning(f"Couldn't export the metrics: {e}")
+            return
+        logger.debug(f"Exported the metrics to {base}.prom and {base}.json")
+
+
+def metrics_file_name(cookie_file_name: str) -> str:
+    """
+    Base name of the metrics files of an account, the accounts of a manifest run side by side
+
+    :param str cookie_file_name: Name of the cookie file of the account, .cookie-<account name> or .cookie
+    :return: metrics or metrics-<account name>
+    """
+    return "metrics" + cookie_file_name[len(".cookie"):] if cookie_file_name.startswith(".cookie") else "metrics"
+
+
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics() -> MetricsRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+            _registry.describe("http_requests_total", "Api requests per endpoint and status")
+            _registry.describe("http_request_seconds", "Latency of the api requests per endpoint")
+            _registry.describe("http_retries_total", "Api requests sent again after a 429 or a 503")
+            _registry.describe("http_response_bytes_total", "Bytes of the api response bodies")
+            _registry.describe("http_request_bytes_total", "Bytes of the api request bodies")
+            _registry.describe("phase_seconds", "Time spent in each phase of the run")
+            _registry.describe("browser_wait_seconds", "Time the browser waits took per site")
+            _registry.describe("browser_wait_timeouts_total", "Browser waits that timed out per site")
+            _registry.describe("cache_requests_total", "Cache accesses per cache and result")
+        return _registry
+
+
+def reset_metrics() -> None:
+    """
+    Drop the metrics of the process, so the next run starts from an empty registry. The worker
+    processes of the accounts are reused, an account must not export the metrics of the previous one
+    """
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+class PhaseTimer(ContextDecorator):
+    """
+    Times a phase of the run, traces and profiles it, usable as a context manager or as a decorator
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._starts = threading.local()
+
+    def __enter__(self):
+        phase_span = span(self.name, "phase")
+        phase_span.__enter__()
+        if (profiler := get_profiler()) is not None:
+            profiler.enter(self.name)
+        self._starts.__dict__.setdefault("stack", []).append((time.monotonic(), phase_span))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        start, phase_span = self._starts.stack.pop()
+        if (profiler := get_profiler()) is not None:
+            profiler.exit()
+        phase_span.__exit__(exc_type, exc_value, traceback)
+        elapsed = time.monotonic() - start
+        metrics = get_metrics()
+        metrics.observe("phase_seconds", elapsed, phase=self.name)
+        if exc_type is not None:
+            metrics.inc("phase_errors_total", phase=self.name)
+        return False
+
+
+def phase(name: str) -> PhaseTimer:
+    """
+    Time a phase of the run: login, discovery, triage, enroll, lectures, quiz, coding...
+
+    :param str name: name of the phase
+    :return: context manager, or decorator, observing the time spent in phase_seconds
+    """
+    return PhaseTimer(name)
+
+
+def endpoint_of(url: str) -> str:
+    from watcher_udemy.timeouts import endpoint_site
+
+    return endpoint_site(url)[len("api:"):]
+
+
+class MetricsAdapter(BaseAdapter):
+    """
+    Transport adapter counting the requests, latency, bytes and retries of every endpoint.
+    Wraps another adapter, closest to the network so the retries show
+    """
+
+    def __init__(self, adapter: BaseAdapter, registry: Optional[MetricsRegistry] = None):
+        super().__init__()
+        self.adapter = adapter
+        self.metrics = registry or get_metrics()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        endpoint = endpoint_of(request.url)
+        start = time.monotonic()
+        try:
+            response = self.adapter.send(
+                request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+            )
+        except Exception as e:
+            self.metrics.inc("http_requests_total", endpoint=endpoint, status=type(e).__name__)
+            raise
+        self.metrics.observe("http_request_seconds", time.monotonic() - start, endpoint=endpoint)
+        self.metrics.inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+        if request.body:
+            self.metrics.inc("http_request_bytes_total", len(request.body), endpoint=endpoint)
+        if not stream:
+            self.metrics.inc("http_response_bytes_total", len(response.content), endpoint=endpoint)
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history:
+            self.metrics.inc("http_retries_total", len(retries.history), endpoint=endpoint)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
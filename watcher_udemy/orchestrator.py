@@ -0,0 +1,166 @@
+import multiprocessing
+import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from ruamel.yaml import YAML
+
+from watcher_udemy.logging import forward_file_logs, get_logger, write_forwarded_logs
+from watcher_udemy.ratelimit import RateLimiter
+
+logger = get_logger()
+
+DEFAULT_MAX_WORKERS = 2
+
+
+def load_accounts_manifest(manifest_path: str) -> Dict:
+    """
+    Load and validate an accounts manifest
+
+    :param str manifest_path: Path of the yaml manifest
+    :return: dictionary with the max_workers, domains and accounts sections
+    """
+    yaml = YAML(typ="safe")
+    with open(manifest_path) as f:
+        manifest = yaml.load(f) or {}
+
+    accounts = manifest.get("accounts") or []
+    if not accounts:
+        raise ValueError(f"No accounts found in {manifest_path}")
+    names = set()
+    for idx, account in enumerate(accounts):
+        for required in ("email", "password", "domain"):
+            if not account.get(required):
+                raise ValueError(f"Account {idx} of {manifest_path} is missing '{required}'")
+        # the name identifies the cookie file of the account, so it has to be unique
+        account.setdefault("name", f"{account['domain']}-{account['email']}")
+        if account["name"] in names:
+            raise ValueError(f"Account name {account['name']} is used more than once")
+        names.add(account["name"])
+
+    return {
+        "max_workers": manifest.get("max_workers") or DEFAULT_MAX_WORKERS,
+        "domains": manifest.get("domains") or {},
+        "accounts": accounts,
+    }
+
+
+def _run_account(account: Dict, default_browser: str, rate_limiter: Optional[RateLimiter]) -> Tuple[str, Optional[Dict]]:
+    """
+    Run a single account, meant to be executed in its own worker process
+
+    :param dict account: Account section of the manifest
+    :param str default_browser: Browser used when the account doesn't set one
+    :param RateLimiter rate_limiter: Request budget of the account's domain
+    :return: name of the account and its run statistics, None if the run failed
+    """
+    from watcher_udemy import DriverManager, Settings
+    from watcher_udemy.metrics import reset_metrics
+    from watcher_udemy.profiling import install_dump_signal
+    from watcher_udemy.runner import watch_courses_ui
+
+    install_dump_signal()
+    # the pool reuses its processes, the metrics of the account that ran before in this one are dropped
+    reset_metrics()
+
+    name = account["name"]
+    logger.info(f"Starting account {name} on domain {account['domain']}")
+    settings = Settings(cookie_file_name=f".cookie-{name}", account=account)
+    filename = account.get("file")
+    if filename and not os.path.exists(filename):
+        logger.error(f"The file {filename} of account {name} doesn't exist.")
+        return name, None
+
+    # accounts staying on the api never start a browser
+    dm = DriverManager(browser=account.get("browser") or default_browser, lazy=True, rate_limiter=rate_limiter)
+    stats = watch_courses_ui(
+        None,
+        settings,
+        True,
+        bool(account.get("get_random_links", not filename)),
+        bool(filename),
+        filename,
+        rate_limiter,
+        driver_manager=dm,
+    )
+    return name, stats.to_dict() if stats is not None else None
+
+
+def run_accounts(manifest_path: str, default_browser: str, max_workers: Optional[int] = None) -> Dict:
+    """
+    Run every account of the manifest, each one in its own worker process
+
+    :param str manifest_path: Path of the accounts manifest
+    :param str default_browser: Browser used when an account doesn't set one
+    :param int max_workers: Global cap on the accounts running at the same time, overrides the manifest
+    :return: aggregated statistics of all the accounts
+    """
+    from watcher_udemy.udemy_ui import RunStatistics
+
+    manifest = load_accounts_manifest(manifest_path)
+    max_workers = max_workers or manifest["max_workers"]
+    accounts = manifest["accounts"]
+    logger.info(f"Running {len(accounts)} accounts with at most {max_workers} at a time")
+
+    total = RunStatistics()
+    per_account: Dict[str, Optional[Dict]] = {}
+    start = time.time()
+    with multiprocessing.Manager() as manager:
+        rate_limiters = {
+            domain: RateLimiter.shared(budget.get("requests_per_second"), manager)
+            for domain, budget in manifest["domains"].items()
+            if budget and budget.get("requests_per_second")
+        }
+        # the workers hand their records over, only this process writes and rotates app.log
+        log_records = manager.Queue()
+        log_writer = write_forwarded_logs(log_records)
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=max_workers, initializer=forward_file_logs, initargs=(log_records,)
+            ) as executor:
+                futures = [
+                    executor.submit(_run_account, account, default_browser, rate_limiters.get(account["domain"]))
+                    for account in accounts
+                ]
+                for future in as_completed(futures):
+                    try:
+                        name, stats = future.result()
+                    except Exception as e:
+                        logger.error(f"Account worker crashed: {e}", exc_info=True)
+                        continue
+                    per_account[name] = stats
+                    if stats is not None:
+                        total.merge(stats)
+        finally:
+            log_writer.stop()
+
+    _log_report(accounts, per_account, total, time.time() - start)
+    return total.to_dict()
+
+
+def _log_report(accounts: List[Dict], per_account: Dict[str, Optional[Dict]], total, wall_time: float) -> None:
+    """
+    Log the statistics of every account and the aggregated throughput
+
+    :return: None
+    """
+    logger.info("==================Accounts Statistics==================")
+    for account in accounts:
+        stats = per_account.get(account["name"])
+        if stats is None:
+            logger.info(f"{account['name']:<30} FAILED")
+            continue
+        logger.info(
+            f"{account['name']:<30} completed {stats['courses_completed']:>5}  "
+            f"failed {stats['courses_failed']:>5}  enrolled {stats['enrolled']:>5}  "
+            f"run time {stats['run_time_seconds']}s"
+        )
+    hours = wall_time / 3600 or 1
+    logger.info(f"Accounts failed:            {sum(1 for s in per_account.values() if s is None)}")
+    logger.info(f"Courses completed:          {total.courses_completed}")
+    logger.info(f"Courses failed:             {total.courses_failed}")
+    logger.info(f"Enrolled:                   {total.enrolled}")
+    logger.info(f"Courses/hour:               {total.courses_completed / hours:.1f}")
+    logger.info(f"Total run time (seconds):   {int(wall_time)}s")
+    logger.info("==================Accounts Statistics==================")
@@ -0,0 +1,325 @@
+import json
+import math
+import os
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from watcher_udemy.answer_store import AnswerKeyStore
+from watcher_udemy.catalogue import CourseCatalogue, catalogue_file_name
+from watcher_udemy.logging import get_logger
+from watcher_udemy.resolver import canonicalize_course_url
+from watcher_udemy.timeouts import LatencyTracker, endpoint_site
+from watcher_udemy.utils import get_app_dir, iter_urls_from_file
+
+logger = get_logger()
+
+# request kind -> (method, path of a sample url), the path gives the endpoint of the latency samples
+REQUESTS = {
+    "validate_token": ("GET", "/api-2.0/users/me/"),
+    "enrolled_courses": ("GET", "/api-2.0/users/me/subscribed-courses/"),
+    "resolve_slug": ("GET", "/api-2.0/courses/a-slug/"),
+    "course_metadata": ("GET", "/api-2.0/courses/1/"),
+    "subscribed_check": ("GET", "/api-2.0/users/me/subscribed-courses/1/"),
+    "subscribe": ("GET", "/course/subscribe/"),
+    "course_details": ("GET", "/api-2.0/courses/1/"),
+    "curriculum": ("GET", "/api-2.0/courses/1/subscriber-curriculum-items/"),
+    "answer_key": ("GET", "/api-2.0/quizzes/1/assessments/"),
+    "latest_attempt": ("GET", "/api-2.0/users/me/subscribed-courses/1/quizzes/1/user-attempted-quizzes/latest"),
+    "progress": ("GET", "/api-2.0/users/me/subscribed-courses/1/progress/"),
+    "answer": ("POST", "/api-2.0/users/me/subscribed-courses/1/user-attempted-quizzes/1/assessment-answers/"),
+    "complete_lecture": ("POST", "/api-2.0/users/me/subscribed-courses/1/completed-lectures/"),
+}
+
+# Requests of a kind running at the same time, like the thread pools sending them
+CONCURRENCY = {
+    "resolve_slug": 10,
+    "course_metadata": 10,
+    "subscribed_check": 8,
+    "subscribe": 8,
+    "complete_lecture": 10,
+}
+
+# Page sizes the runner asks for
+CURRICULUM_PAGE_SIZE = 1400
+ENROLLED_PAGE_SIZE = 1400
+
+# Used while the catalogue, the answer store or the latency samples don't know better
+DEFAULT_LECTURES = 30
+DEFAULT_QUIZZES = 1
+DEFAULT_QUIZ_SIZE = 10
+DEFAULT_LATENCY = 0.3
+BROWSER_VISIT_SECONDS = 8.0
+
+
+@dataclass
+class CoursePlan:
+    course_id: Optional[int]
+    link: str
+    title: Optional[str] = None
+    known: bool = True
+    num_lectures: int = 0
+    pending_lectures: int = 0
+    pending_quizzes: int = 0
+    requests: Counter = field(default_factory=Counter)
+    browser_visits: int = 0
+
+
+@dataclass
+class RunPlan:
+    courses: List[CoursePlan] = field(default_factory=list)
+    requests: Counter = field(default_factory=Counter)
+    browser_visits: int = 0
+    login_in_browser: bool = False
+    # request kind -> (seconds per request, True if measured by previous runs)
+    latencies: Dict[str, tuple] = field(default_factory=dict)
+    notes: List[str] = field(default_factory=list)
+
+    def add(self, course: CoursePlan) -> None:
+        self.courses.append(course)
+        self.requests.update(course.requests)
+        self.browser_visits += course.browser_visits
+
+    def count(self, method: str) -> int:
+        return sum(count for kind, count in self.requests.items() if REQUESTS[kind][0] == method)
+
+    def browser_sessions(self) -> int:
+        # the runner keeps one browser for the whole run, and doesn't open it when it has no page to load
+        return 1 if self.browser_visits or self.login_in_browser else 0
+
+    def eta_seconds(self) -> float:
+        seconds = sum(
+            count * self.latencies[kind][0] / CONCURRENCY.get(kind, 1) for kind, count in self.requests.items()
+        )
+        return seconds + (self.browser_visits + self.login_in_browser) * BROWSER_VISIT_SECONDS
+
+    def to_dict(self) -> Dict:
+        eta = self.eta_seconds()
+        return {
+            "courses": len(self.courses),
+            "unknown_courses": sum(not course.known for course in self.courses),
+            "pending_lectures": sum(course.pending_lectures for course in self.courses),
+            "pending_quizzes": sum(course.pending_quizzes for course in self.courses),
+            "gets": self.count("GET"),
+            "posts": self.count("POST"),
+            "requests": dict(self.requests),
+            "browser_sessions": self.browser_sessions(),
+            "browser_visits": self.browser_visits,
+            "login_in_browser": self.login_in_browser,
+            "eta_seconds": eta,
+            "requests_per_second": sum(self.requests.values()) / eta if eta else None,
+            "latencies": {kind: {"seconds": seconds, "measured": measured}
+                          for kind, (seconds, measured) in self.latencies.items()},
+            "notes": self.notes,
+        }
+
+    def table(self) -> None:
+        plan = self.to_dict()
+        logger.info("==================Run Plan==================")
+        logger.info(f"Courses:                    {plan['courses']} ({plan['unknown_courses']} not in the catalogue)")
+        logger.info(f"Pending lectures:           {plan['pending_lectures']}")
+        logger.info(f"Pending quizzes:            {plan['pending_quizzes']}")
+        logger.info(f"GET requests:               {plan['gets']}")
+        logger.info(f"POST requests:              {plan['posts']}")
+        for kind, count in sorted(self.requests.items(), key=lambda item: -item[1]):
+            seconds, measured = self.latencies[kind]
+            logger.info(f"    {kind:<24}{count:>8}  {seconds * 1000:.0f}ms{'' if measured else ' (default)'}")
+        logger.info(f"Browser sessions:           {plan['browser_sessions']}")
+        logger.info(f"Browser page visits:        {plan['browser_visits'] + plan['login_in_browser']}")
+        logger.info(f"ETA:                        {time.strftime('%H:%M:%S', time.gmtime(plan['eta_seconds']))}")
+        if plan["requests_per_second"] is not None:
+            logger.info(f"Average requests/sec:       {plan['requests_per_second']:.1f}")
+        for note in self.notes:
+            logger.info(f"Note: {note}")
+        logger.info("==================Run Plan==================")
+
+
+class RunPlanner:
+    """
+    Estimates what a run will cost, requests, browser visits and time, from what the local catalogue,
+    answer store and latency samples know, without going to the network or writing anything.
+    The per course costs follow the requests _complete_course_link sends
+    """
+
+    def __init__(
+            self,
+            domain: str,
+            cookie_file_name: str = ".cookie",
+            api_enroll: bool = False,
+            prefilter: bool = False,
+    ):
+        """
+        :param str domain: business sub-domain of the account
+        :param str cookie_file_name: Name of the cookie file in the app directory
+        :param bool api_enroll: The run enrolls through the api, the browser is only a fallback
+        :param bool prefilter: The run filters the courses on language and category before enrolling
+        """
+        self.domain = domain
+        self.cookie_file_name = cookie_file_name
+        self.api_enroll = api_enroll
+        self.prefilter = prefilter
+        self.catalogue = self._open(CourseCatalogue, catalogue_file_name(cookie_file_name, domain))
+        self.answer_store = self._open(AnswerKeyStore)
+        # never saved, the samples are only read
+        self.tracker = LatencyTracker()
+
+    @staticmethod
+    def _open(store_class, *args):
+        try:
+            return store_class(*args, read_only=True)
+        except sqlite3.Error as e:
+            logger.info(f"No {store_class.__name__} to plan from: {e}")
+            return None
+
+    def _latencies(self) -> Dict[str, tuple]:
+        latencies = {}
+        for kind, (_, path) in REQUESTS.items():
+            p50 = self.tracker.percentile(endpoint_site(f"https://{self.domain}.udemy.com{path}"), 50)
+            latencies[kind] = (p50, True) if p50 is not None else (DEFAULT_LATENCY, False)
+        return latencies
+
+    def _login_in_browser(self) -> bool:
+        from watcher_udemy.udemy_ui import UdemyActionsUI
+
+        try:
+            with open(os.path.join(get_app_dir(), self.cookie_file_name)) as f:
+                cookie_cache = json.load(f)
+        except (OSError, ValueError):
+            return True
+        if isinstance(cookie_cache, list):
+            return not cookie_cache
+        if not cookie_cache.get("cookies"):
+            return True
+        expiry = cookie_cache.get("access_token_expiry")
+        return expiry is not None and expiry - time.time() < UdemyActionsUI.TOKEN_REFRESH_MARGIN
+
+    def _plan_course(self, plan: CoursePlan, row: Optional[Dict], quiz_size: float, metadata_cached: bool) -> None:
+        requests = plan.requests
+        if row is None:
+            # not enrolled as far as the catalogue knows
+            plan.known = False
+            if self.prefilter and not metadata_cached:
+                requests["course_metadata"] += 1
+            if self.api_enroll:
+                requests.update(subscribed_check=2, subscribe=1)
+            else:
+                plan.browser_visits += 1
+            row = {"completion_ratio": None, "num_lectures": None, "num_quizzes": None}
+        elif self.api_enroll:
+            # the api enrolment checks the subscription of every course, known ones are confirmed in one call
+            requests["subscribed_check"] += 1
+        requests["course_details"] += 1
+        num_lectures = row["num_lectures"] if row["num_lectures"] is not None else DEFAULT_LECTURES
+        num_quizzes = row["num_quizzes"] if row["num_quizzes"] is not None else DEFAULT_QUIZZES
+        completion_ratio = row["completion_ratio"] or 0
+        plan.num_lectures = num_lectures
+        if completion_ratio >= 100:
+            if plan.course_id is None or self.catalogue is None \
+                    or self.catalogue.get_curriculum_fingerprint(plan.course_id) is None:
+                requests["curriculum"] += math.ceil((num_lectures + num_quizzes + 1) / CURRICULUM_PAGE_SIZE)
+            return
+        plan.pending_lectures = round(num_lectures * (100 - completion_ratio) / 100)
+        # the progress only says how much is left, the quizzes count as pending until the course is complete
+        plan.pending_quizzes = num_quizzes
+        # the curriculum lists the lectures to complete, and is fingerprinted once the course is complete
+        requests["curriculum"] += math.ceil((num_lectures + num_quizzes + 1) / CURRICULUM_PAGE_SIZE)
+        if num_quizzes:
+            # the first attempt of a quiz is made through the browser, the other answers through the api
+            assessments = round(num_quizzes * quiz_size)
+            requests.update(answer_key=num_quizzes, progress=num_quizzes, latest_attempt=assessments,
+                            answer=max(assessments - num_quizzes, 0))
+            plan.browser_visits += num_quizzes
+        # every lecture is marked, completed ones included
+        requests["complete_lecture"] += num_lectures
+        requests["course_details"] += 1
+
+    def plan(self, links: Optional[Iterable[str]] = None) -> RunPlan:
+        """
+        Plan a run on the course links of a file, or on the incomplete courses like a run without a file
+
+        :param links: course urls, None to plan the courses the catalogue knows are incomplete
+        :return: the plan of the run
+        """
+        run_plan = RunPlan(latencies=self._latencies(), login_in_browser=self._login_in_browser())
+        run_plan.requests["validate_token"] += 1
+        quiz_size = (self.answer_store.average_quiz_size() if self.answer_store is not None else None) \
+            or DEFAULT_QUIZ_SIZE
+
+        if links is None:
+            course_ids = self.catalogue.incomplete_courses() if self.catalogue is not None else []
+            course_links = {course_id: str(course_id) for course_id in course_ids}
+            run_plan.requests["enrolled_courses"] += 2 * max(math.ceil(len(course_ids) / ENROLLED_PAGE_SIZE), 1)
+            run_plan.notes.append("courses found by the scrapers are not included")
+        else:
+            course_links, slugs, unresolved = {}, {}, []
+            for link in links:
+                if (key := canonicalize_course_url(link, self.domain)) is None:
+                    unresolved.append(link)
+                elif key[0] == "id":
+                    course_links.setdefault(int(key[1]), link)
+                else:
+                    slugs.setdefault(key[1], link)
+            slug_ids = self.catalogue.get_slug_ids(slugs) if self.catalogue is not None else {}
+            for slug, link in slugs.items():
+                if slug in slug_ids:
+                    course_links.setdefault(slug_ids[slug], link)
+                else:
+                    run_plan.requests["resolve_slug"] += 1
+                    # resolved during the run, its id isn't known yet
+                    run_plan.add(self._plan_link(None, link, None, quiz_size, False))
+            for link in unresolved:
+                run_plan.add(CoursePlan(None, link, known=False, browser_visits=1))
+            if unresolved:
+                run_plan.notes.append(f"{len(unresolved)} links aren't course urls of {self.domain}, "
+                                      f"only a browser visit is counted for them")
+
+        metadata = self.catalogue.get_course_metadata(course_links) \
+            if self.catalogue is not None and self.prefilter else {}
+        for course_id, link in course_links.items():
+            row = self.catalogue.get(course_id) if self.catalogue is not None else None
+            run_plan.add(self._plan_link(course_id, link, row, quiz_size, course_id in metadata))
+        if any(not course.known for course in run_plan.courses):
+            run_plan.notes.append(
+                f"courses missing from the catalogue are counted with {DEFAULT_LECTURES} lectures "
+                f"and {DEFAULT_QUIZZES} quiz"
+            )
+        return run_plan
+
+    def _plan_link(self, course_id, link, row, quiz_size, metadata_cached) -> CoursePlan:
+        plan = CoursePlan(course_id, link, title=row.get("title") if row else None)
+        self._plan_course(plan, row, quiz_size, metadata_cached)
+        return plan
+
+    def close(self) -> None:
+        for store in (self.catalogue, self.answer_store):
+            if store is not None:
+                store.close()
+
+
+def plan_run(
+        domain: str,
+        file_name: Optional[str] = None,
+        cookie_file_name: str = ".cookie",
+        api_enroll: bool = False,
+        prefilter: bool = False,
+) -> RunPlan:
+    """
+    Plan a run and log its table, nothing is sent nor written
+
+    :param str domain: business sub-domain of the account
+    :param str file_name: file of course urls, None to plan the incomplete courses of the catalogue
+    :param str cookie_file_name: Name of the cookie file in the app directory
+    :param bool api_enroll: The run enrolls through the api
+    :param bool prefilter: The run filters the courses on language and category
+    :return: the plan of the run
+    """
+    planner = RunPlanner(domain, cookie_file_name, api_enroll, prefilter)
+    try:
+        links = iter_urls_from_file(file_name) if file_name else None
+        run_plan = planner.plan(links)
+    finally:
+        planner.close()
+    run_plan.table()
+    return run_plan
@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+from watcher_udemy.catalogue import CourseCatalogue
+from watcher_udemy.codec import response_json
+from watcher_udemy.logging import get_logger
+from watcher_udemy.tracing import propagate
+
+logger = get_logger()
+
+# Reasons a course is rejected for
+UNWANTED_LANGUAGE = "language"
+UNWANTED_CATEGORY = "category"
+
+LOCALE_TITLE_FIELDS = ("title", "english_title", "simple_english_title")
+
+
+def course_languages(course: Dict) -> List[str]:
+    """
+    Names of the language of a course, as the course page shows them and in english
+
+    :param dict course: course payload holding the locale
+    :return: list of language names
+    """
+    locale = course.get("locale") or {}
+    return sorted({locale[field] for field in LOCALE_TITLE_FIELDS if locale.get(field)})
+
+
+def course_categories(course: Dict) -> List[str]:
+    """
+    Category and subcategory of a course, the ones shown in the breadcrumbs of the course page
+
+    :param dict course: course payload holding the primary category and subcategory
+    :return: list of category titles
+    """
+    return [
+        category["title"]
+        for category in (course.get("primary_category"), course.get("primary_subcategory"))
+        if category and category.get("title")
+    ]
+
+
+class CoursePrefilter:
+    """
+    Checks the language and category filters of the settings against the course metadata of the
+    api, in bulk and cached in the catalogue, so unwanted courses never cost a page load
+    """
+
+    def __init__(
+            self,
+            session: requests.Session,
+            course_metadata_url: str,
+            catalogue: CourseCatalogue,
+            languages: List[str],
+            categories: List[str],
+            max_workers: int = 10,
+    ):
+        """
+        :param requests.Session session: Logged in session
+        :param str course_metadata_url: Course details url template taking the course id
+        :param CourseCatalogue catalogue: Catalogue holding the metadata cache
+        :param list languages: Wanted languages, any language if empty
+        :param list categories: Wanted categories, any category if empty
+        :param int max_workers: Max number of requests running at the same time
+        """
+        self.session = session
+        self.course_metadata_url = course_metadata_url
+        self.catalogue = catalogue
+        self.languages = set(languages)
+        self.categories = set(categories)
+        self.max_workers = max_workers
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.languages or self.categories)
+
+    def _fetch(self, course_id: int) -> Optional[Dict]:
+        try:
+            response = self.session.get(self.course_metadata_url.format(course_id), timeout=30)
+        except requests.RequestException as e:
+            logger.warning(f"Couldn't get the metadata of course {course_id}: {e}")
+            return None
+        if response.status_code != 200:
+            logger.info(f"Couldn't get the metadata of course {course_id}, status {response.status_code}")
+            return None
+        try:
+            course = response_json(response)
+            return {"languages": course_languages(course), "categories": course_categories(course)}
+        except (ValueError, AttributeError, TypeError) as e:
+            # an error page or a truncated body leaves this course unfiltered, not the whole batch
+            logger.warning(f"Couldn't get the metadata of course {course_id}, unreadable answer: {e}")
+            return None
+
+    def get_metadata(self, course_ids: Iterable[int]) -> Dict[int, Dict]:
+        """
+        Languages and categories of courses, from the cache first and then through the api
+
+        :param course_ids: ids of the courses
+        :return: course id -> {"languages": [...], "categories": [...]}, courses the api couldn't tell are missing
+        """
+        course_ids = list(dict.fromkeys(course_ids))
+        metadata = self.catalogue.get_course_metadata(course_ids)
+        missing = [course_id for course_id in course_ids if course_id not in metadata]
+        if missing:
+            logger.info(f"Getting the metadata of {len(missing)} courses through the api")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                fetched = {
+                    course_id: course_metadata
+                    for course_id, course_metadata in zip(missing, executor.map(propagate(self._fetch), missing))
+                    if course_metadata is not None
+                }
+            self.catalogue.save_course_metadata(fetched)
+            metadata.update(fetched)
+        return metadata
+
+    def check(self, course_ids: Iterable[int]) -> Dict[int, Optional[str]]:
+        """
+        Evaluate the filters on courses. Courses whose metadata is unknown pass, the browser checks them
+
+        :param course_ids: ids of the courses
+        :return: course id -> UNWANTED_LANGUAGE, UNWANTED_CATEGORY or None if the course is wanted
+        """
+        course_ids = list(course_ids)
+        if not self.enabled:
+            return dict.fromkeys(course_ids)
+        metadata = self.get_metadata(course_ids)
+        verdicts = {}
+        for course_id in course_ids:
+            course_metadata = metadata.get(course_id)
+            if course_metadata is None:
+                verdicts[course_id] = None
+            elif self.languages and not self.languages.intersection(course_metadata["languages"]):
+                verdicts[course_id] = UNWANTED_LANGUAGE
+            elif self.categories and not self.categories.intersection(course_metadata["categories"]):
+                verdicts[course_id] = UNWANTED_CATEGORY
+            else:
+                verdicts[course_id] = None
+        return verdicts
+
+    def is_known(self, course_id: int) -> bool:
+        return course_id in self.catalogue.get_course_metadata([course_id])
@@ -0,0 +1,268 @@
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from watcher_udemy.logging import get_logger
+from watcher_udemy.utils import get_app_dir
+
+logger = get_logger()
+
+# Environment variable turning profiling on, the cli flag sets it
+PROFILE_ENV = "WATCHER_UDEMY_PROFILE"
+PROFILE_MODES = ("cpu", "memory", "all")
+
+# Frames kept per allocation, enough to tell the call sites of the hot helpers apart
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 40
+# From python 3.12 cProfile goes through sys.monitoring: a single profile can be enabled in the
+# process, and it sees the calls of every thread
+SHARED_PROFILER = sys.version_info >= (3, 12)
+
+# name -> callable returning the depth of the queue, shown by the SIGUSR1 dumps
+_queues: Dict[str, Callable[[], int]] = {}
+
+
+def register_queue(name: str, depth: Callable[[], int]) -> None:
+    """
+    Show the depth of a queue in the state dumps, a queue registered again under the same name replaces the old one
+
+    :param str name: name of the queue
+    :param depth: callable returning the number of items waiting
+    """
+    _queues[name] = depth
+
+
+def queue_depths() -> Dict[str, object]:
+    depths = {}
+    for name, depth in list(_queues.items()):
+        try:
+            depths[name] = depth()
+        except Exception as e:
+            depths[name] = f"unavailable: {e}"
+    return depths
+
+
+class PhaseProfiler:
+    """
+    cProfile of every phase, and tracemalloc allocations per phase, written to the app dir at exit.
+    Nested phases pause the profile of their parent, and the thread pool calls of a phase are added to it.
+    Where the profile is shared by the process, a phase entered while another thread profiles is counted
+    in the profile of that thread
+    """
+
+    def __init__(self, mode: str = "all", directory: Optional[str] = None):
+        """
+        :param str mode: cpu, memory or all
+        :param str directory: where the profiles go, a timestamped directory of the app dir by default
+        """
+        self.cpu = mode in ("cpu", "all")
+        self.memory = mode in ("memory", "all")
+        self.directory = directory or os.path.join(
+            get_app_dir(), "profiles", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        )
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats: Dict[str, pstats.Stats] = {}
+        # phase -> [times entered, bytes allocated and kept, peak bytes over the start]
+        self._allocations: Dict[str, List[int]] = {}
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def _stack(self) -> List[Tuple[str, Optional[cProfile.Profile], int]]:
+        return self._local.__dict__.setdefault("stack", [])
+
+    def current_phase(self) -> Optional[str]:
+        stack = self._stack()
+        return stack[-1][0] if stack else None
+
+    def _add(self, name: str, profile: cProfile.Profile) -> None:
+        with self._lock:
+            try:
+                if name in self._stats:
+                    self._stats[name].add(profile)
+                else:
+                    self._stats[name] = pstats.Stats(profile)
+            except TypeError:
+                # pstats refuses profiles that saw no call
+                pass
+
+    @staticmethod
+    def _enable(profile: cProfile.Profile) -> bool:
+        try:
+            profile.enable()
+        except ValueError:
+            # another thread holds the profiler of the process
+            return False
+        return True
+
+    def enter(self, name: str) -> None:
+        stack = self._stack()
+        profile = None
+        if self.cpu:
+            if stack and stack[-1][1] is not None:
+                stack[-1][1].disable()
+            profile = cProfile.Profile()
+            if not self._enable(profile):
+                profile = None
+        stack.append((name, profile, tracemalloc.get_traced_memory()[0] if self.memory else 0))
+
+    def exit(self) -> None:
+        stack = self._stack()
+        name, profile, memory_start = stack.pop()
+        if profile is not None:
+            profile.disable()
+            self._add(name, profile)
+            if stack and stack[-1][1] is not None:
+                self._enable(stack[-1][1])
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            with self._lock:
+                allocations = self._allocations.setdefault(name, [0, 0, 0])
+                allocations[0] += 1
+                allocations[1] += current - memory_start
+                allocations[2] = max(allocations[2], peak - memory_start)
+
+    def wrap(self, function: Callable) -> Callable:
+        """
+        Profile the calls a thread pool makes for the current phase as part of it
+
+        :param function: function given to the executor
+        :return: the wrapped function
+        """
+        name = self.current_phase()
+        if name is None or not self.cpu or SHARED_PROFILER:
+            # the profile of the phase already sees the threads of the pool
+            return function
+
+        def run(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                self._add(name, profile)
+
+        return run
+
+    def dump(self) -> Optional[str]:
+        """
+        Write a .prof file and a text summary per phase, and the top allocations
+
+        :return: directory of the profiles, None if there was nothing to write
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            allocations = {name: list(values) for name, values in self._allocations.items()}
+        if not stats and not allocations:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        if self.memory:
+            with open(os.path.join(self.directory, "memory.txt"), "w") as f:
+                f.write(f"{'phase':<24}{'times':>8}{'kept KiB':>12}{'peak KiB':>12}\n")
+                for name, (count, kept, peak) in sorted(allocations.items()):
+                    f.write(f"{name:<24}{count:>8}{kept / 1024:>12.1f}{peak / 1024:>12.1f}\n")
+                f.write("\n")
+                f.write(format_top_allocations())
+        for name, phase_stats in stats.items():
+            file_name = os.path.join(self.directory, name.replace(":", "-"))
+            phase_stats.dump_stats(f"{file_name}.prof")
+            summary = io.StringIO()
+            pstats.Stats(f"{file_name}.prof", stream=summary).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            with open(f"{file_name}.txt", "w") as f:
+                f.write(summary.getvalue())
+        logger.info(f"Wrote the profiles of {len(stats)} phases to {self.directory}")
+        return self.directory
+
+
+_profiler: Optional[PhaseProfiler] = None
+_profiler_checked = False
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[PhaseProfiler]:
+    """
+    Profiler of the process, None unless the WATCHER_UDEMY_PROFILE environment variable names a mode
+    """
+    global _profiler, _profiler_checked
+    if _profiler_checked:
+        return _profiler
+    with _profiler_lock:
+        if not _profiler_checked:
+            if (mode := os.environ.get(PROFILE_ENV)) in PROFILE_MODES:
+                _profiler = PhaseProfiler(mode)
+                atexit.register(_profiler.dump)
+                logger.info(f"Profiling the phases ({mode}) to {_profiler.directory}")
+            _profiler_checked = True
+    return _profiler
+
+
+def format_top_allocations(limit: int = TOP_ALLOCATIONS) -> str:
+    if not tracemalloc.is_tracing():
+        return "tracemalloc is off, run with --profile=memory to see the allocations\n"
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, pstats.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB", f"Top {limit} allocations:"]
+    for statistic in snapshot.statistics("traceback")[:limit]:
+        lines.append(f"{statistic.size / 1024:.1f} KiB in {statistic.count} blocks")
+        lines.extend(f"    {line}" for line in statistic.traceback.format(limit=4))
+    return "\n".join(lines) + "\n"
+
+
+def format_thread_stacks() -> str:
+    threads = {thread.ident: thread for thread in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        thread = threads.get(ident)
+        lines.append(f"Thread {thread.name if thread else ident} (daemon={thread.daemon if thread else '?'}):")
+        lines.extend(line.rstrip("\n") for line in traceback.format_stack(frame))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def dump_state() -> str:
+    """
+    Write the stacks of every thread, the top allocations and the queue depths to the app dir
+
+    :return: path of the dump
+    """
+    path = os.path.join(get_app_dir(), f"dump-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+    with open(path, "w") as f:
+        f.write("==================Queues==================\n")
+        for name, depth in sorted(queue_depths().items()):
+            f.write(f"{name}: {depth}\n")
+        f.write("\n==================Threads==================\n")
+        f.write(format_thread_stacks())
+        f.write("\n==================Memory==================\n")
+        f.write(format_top_allocations())
+    logger.info(f"Dumped the state of the process to {path}")
+    return path
+
+
+def install_dump_signal() -> bool:
+    """
+    Dump the state of the process on SIGUSR1, from a thread of its own so the run goes on
+
+    :return: False where SIGUSR1 doesn't exist, on windows
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return False
+
+    def handler(signum, frame):
+        threading.Thread(target=dump_state, name="state-dump", daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, handler)
+    return True
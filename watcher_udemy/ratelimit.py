@@ -0,0 +1,101 @@
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ThrottleRetry(Retry):
+    """
+    Retry of the throttled requests. A 429 was rejected before being processed, so it is sent again
+    whatever its method, but a 503 may come after a POST went through, it is only sent again if
+    the server asked for it with a Retry-After header
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 503 and method.upper() not in self.DEFAULT_ALLOWED_METHODS and not has_retry_after:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+# Requests the server throttled or couldn't take are sent again, honouring the Retry-After header
+THROTTLE_RETRY = ThrottleRetry(
+    total=5,
+    connect=0,
+    read=0,
+    status_forcelist=(429, 503),
+    allowed_methods=None,
+    backoff_factor=0.5,
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+
+class RateLimiter:
+    """
+    Spaces requests out so they stay within a requests per second budget.
+
+    The lock and the next free slot can be multiprocessing manager proxies, in which case the
+    budget is shared by every worker process holding the limiter.
+    """
+
+    def __init__(self, requests_per_second: float, lock=None, next_slot=None):
+        """
+        :param float requests_per_second: Budget of requests per second, 0 or None disables the limit
+        :param lock: Lock guarding the next slot, a threading.Lock is used if None
+        :param next_slot: Shared value holding the time of the next free slot, kept locally if None
+        """
+        self.requests_per_second = requests_per_second
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = lock if lock is not None else threading.Lock()
+        self._next_slot = next_slot
+        self._local_next_slot = 0.0
+
+    @classmethod
+    def shared(cls, requests_per_second: float, manager) -> "RateLimiter":
+        """
+        Create a limiter whose budget is shared between processes
+
+        :param float requests_per_second: Budget of requests per second
+        :param manager: A started multiprocessing manager
+        :return: RateLimiter
+        """
+        return cls(requests_per_second, manager.Lock(), manager.Value("d", 0.0))
+
+    def _get_next_slot(self) -> float:
+        return self._next_slot.value if self._next_slot is not None else self._local_next_slot
+
+    def _set_next_slot(self, value: float) -> None:
+        if self._next_slot is not None:
+            self._next_slot.value = value
+        else:
+            self._local_next_slot = value
+
+    def acquire(self) -> None:
+        """
+        Block until the next request is allowed to go out
+
+        :return: None
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._get_next_slot())
+            self._set_next_slot(slot + self.interval)
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Transport adapter waiting on a RateLimiter before every request
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.rate_limiter.acquire()
+        return super().send(request, **kwargs)
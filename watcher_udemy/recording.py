@@ -0,0 +1,310 @@
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from watcher_udemy.logging import get_logger
+
+logger = get_logger()
+
+# Environment variables turning recording and replay on, the cli flags set them
+RECORD_ENV = "WATCHER_UDEMY_RECORD"
+REPLAY_ENV = "WATCHER_UDEMY_REPLAY"
+REPLAY_SCALE_ENV = "WATCHER_UDEMY_REPLAY_SCALE"
+
+RECORDING_VERSION = 1
+REDACTED = "REDACTED"
+# Fields holding credentials or personal data, in json bodies and query strings
+REDACTED_FIELDS = frozenset(
+    ("access_token", "csrftoken", "token", "password", "email", "display_name", "client_id")
+)
+# Fields of the request bodies that change from a run to the other, left out of the replay key
+VOLATILE_FIELDS = frozenset(("duration",))
+# Response headers not worth keeping, or holding credentials
+DROPPED_HEADERS = frozenset(("set-cookie", "content-encoding", "transfer-encoding", "content-length"))
+
+
+def redact_json(value, dropped: frozenset = frozenset()):
+    """
+    Copy of a json value with the REDACTED_FIELDS replaced, at any depth
+
+    :param value: decoded json
+    :param frozenset dropped: fields left out of the copy
+    :return: redacted copy
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key.lower() in REDACTED_FIELDS and item is not None else redact_json(item, dropped)
+            for key, item in value.items() if key.lower() not in dropped
+        }
+    if isinstance(value, list):
+        return [redact_json(item, dropped) for item in value]
+    return value
+
+
+def redact_body(body: Optional[bytes], dropped: frozenset = frozenset()) -> Optional[bytes]:
+    """
+    Redact a json body, other bodies are kept as they are
+
+    :param bytes body: request or response body
+    :param frozenset dropped: fields left out of the body
+    :return: the redacted body
+    """
+    if not body:
+        return body
+    try:
+        return json.dumps(redact_json(json.loads(body), dropped), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        return body
+
+
+def request_key(method: str, url: str, body: Optional[bytes]) -> Tuple[str, str, str]:
+    """
+    Key an exchange is replayed on: the method, the path with the sorted query and a hash of the body.
+    The host is left out, so a recording of a domain replays for any base url
+
+    :return: (method, path and query, body hash)
+    """
+    parsed = urlparse(url)
+    query = urlencode(sorted(
+        (name, REDACTED if name.lower() in REDACTED_FIELDS else value)
+        for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+    ))
+    body_hash = hashlib.sha1(redact_body(body, VOLATILE_FIELDS) or b"").hexdigest()
+    return method.upper(), f"{parsed.path}?{query}", body_hash
+
+
+def _encode_body(body: bytes) -> Dict:
+    try:
+        return {"body": body.decode("utf-8"), "body_encoding": "text"}
+    except UnicodeDecodeError:
+        return {"body": base64.b64encode(body).decode("ascii"), "body_encoding": "base64"}
+
+
+def _decode_body(exchange: Dict) -> bytes:
+    if exchange.get("body_encoding") == "base64":
+        return base64.b64decode(exchange["body"])
+    return (exchange.get("body") or "").encode("utf-8")
+
+
+class Recorder:
+    """
+    Appends the exchanges of every session of the process to a gzipped json lines file
+    """
+
+    def __init__(self, file_name: str, metadata: Optional[Dict] = None):
+        """
+        :param str file_name: recording, suffixed with the pid in the worker processes of the accounts
+        :param dict metadata: fields added to the header of the recording
+        """
+        if multiprocessing.parent_process() is not None:
+            root, extension = os.path.splitext(file_name)
+            file_name = f"{root}.{os.getpid()}{extension}"
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._file = gzip.open(file_name, "wt", encoding="utf-8")
+        self.exchanges = 0
+        self._write({"type": "header", "version": RECORDING_VERSION, "started": time.time(), **(metadata or {})})
+
+    def _write(self, line: Dict) -> None:
+        self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def record(self, request, response: Response, started: float) -> None:
+        """
+        :param request: PreparedRequest sent
+        :param Response response: response received, its content is read
+        :param float started: monotonic time the request was sent at
+        """
+        content = response.content
+        # the session only sets response.elapsed once the adapter returned
+        elapsed = time.monotonic() - started
+        body = request.body.encode("utf-8") if isinstance(request.body, str) else request.body
+        method, path, _ = request_key(request.method, request.url, body)
+        exchange = {
+            "type": "exchange",
+            "method": method,
+            "path": path,
+            "request_body": (redact_body(body) or b"").decode("utf-8", errors="replace"),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                name: value for name, value in response.headers.items() if name.lower() not in DROPPED_HEADERS
+            },
+            "offset": round(started - self._start, 4),
+            "elapsed": round(elapsed, 4),
+            **_encode_body(redact_body(content) or b""),
+        }
+        with self._lock:
+            self._write(exchange)
+            self.exchanges += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                logger.info(f"Recorded {self.exchanges} http exchanges to {self.file_name}")
+
+
+class Replay:
+    """
+    Exchanges of a recording, served in the order they were recorded for every request key.
+    Once the exchanges of a key run out its last one is served again
+    """
+
+    def __init__(self, file_name: str):
+        """
+        :param str file_name: recording, or recordings separated by commas like the ones of the worker
+            processes of a run, their exchanges are served one file after the other
+        """
+        self.file_name = file_name
+        self.metadata: Dict = {}
+        self._exchanges: Dict[Tuple[str, str, str], deque] = {}
+        self._last: Dict[Tuple[str, str, str], Dict] = {}
+        self._lock = threading.Lock()
+        self.served = 0
+        self.missed = 0
+        self.waited = 0.0
+        for recording in file_name.split(","):
+            with gzip.open(recording, "rt", encoding="utf-8") as f:
+                for line in f:
+                    line = json.loads(line)
+                    if line.get("type") == "header":
+                        # the header of the first recording describes the session
+                        self.metadata = self.metadata or line
+                        continue
+                    key = request_key(line["method"], line["path"], line["request_body"].encode("utf-8"))
+                    self._exchanges.setdefault(key, deque()).append(line)
+
+    def __len__(self) -> int:
+        return sum(len(exchanges) for exchanges in self._exchanges.values())
+
+    def next_exchange(self, method: str, url: str, body: Optional[bytes]) -> Optional[Dict]:
+        key = request_key(method, url, body)
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if exchanges:
+                self._last[key] = exchanges.popleft()
+            exchange = self._last.get(key)
+            if exchange is None:
+                self.missed += 1
+            else:
+                self.served += 1
+        return exchange
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"served": self.served, "missed": self.missed, "waited": round(self.waited, 3)}
+
+
+_recorders: Dict[str, Recorder] = {}
+_replays: Dict[str, Replay] = {}
+_lock = threading.Lock()
+
+
+def get_recorder(file_name: str, metadata: Optional[Dict] = None) -> Recorder:
+    """
+    Recorder of a file, shared by the sessions of the process and closed at exit
+    """
+    with _lock:
+        if file_name not in _recorders:
+            _recorders[file_name] = Recorder(file_name, metadata)
+            atexit.register(_recorders[file_name].close)
+        return _recorders[file_name]
+
+
+def get_replay(file_name: str) -> Replay:
+    """
+    Replay of a file, shared by the sessions of the process so every exchange is served once
+    """
+    with _lock:
+        if file_name not in _replays:
+            _replays[file_name] = Replay(file_name)
+            logger.info(f"Replaying {len(_replays[file_name])} http exchanges from {file_name}")
+        return _replays[file_name]
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Transport adapter recording the exchanges of the adapter it wraps, with the credentials redacted.
+    Composes with AdaptiveTimeoutAdapter and RateLimitedAdapter
+    """
+
+    def __init__(self, adapter: BaseAdapter, file_name: str, metadata: Optional[Dict] = None):
+        super().__init__()
+        self.adapter = adapter
+        self.recorder = get_recorder(file_name, metadata)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        started = time.monotonic()
+        response = self.adapter.send(
+            request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+        )
+        try:
+            self.recorder.record(request, response, started)
+        except Exception as e:
+            logger.warning(f"Couldn't record the exchange with {request.url}: {e}")
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter answering the requests from a recording instead of the network.
+    Requests missing from the recording get a 404
+    """
+
+    def __init__(self, file_name: str, timing_scale: float = 1.0):
+        """
+        :param str file_name: recording made through RecordingAdapter, or recordings separated by commas
+        :param float timing_scale: factor applied to the recorded response times, 0 to answer right away
+        """
+        super().__init__()
+        self.replay = get_replay(file_name)
+        self.timing_scale = timing_scale
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        body = request.body.encode("utf-8") if isinstance(request.body, str) else request.body
+        exchange = self.replay.next_exchange(request.method, request.url, body)
+        if exchange is None:
+            logger.warning(f"No recorded exchange for {request.method} {request.url}")
+            exchange = {"status": 404, "reason": "Not Found", "headers": {"Content-Type": "application/json"},
+                        "body": '{"detail": "Not in the recording."}', "elapsed": 0.0}
+        delay = exchange["elapsed"] * self.timing_scale
+        if delay > 0:
+            time.sleep(delay)
+            with self.replay._lock:
+                self.replay.waited += delay
+        return self.build_response(request, exchange, delay)
+
+    @staticmethod
+    def build_response(request, exchange: Dict, elapsed: float) -> Response:
+        response = Response()
+        response.status_code = exchange["status"]
+        response.reason = exchange.get("reason")
+        response.headers = CaseInsensitiveDict(exchange.get("headers") or {})
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = _decode_body(exchange)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=elapsed)
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,224 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from watcher_udemy.catalogue import CourseCatalogue
+from watcher_udemy.codec import response_json
+from watcher_udemy.logging import get_logger
+from watcher_udemy.metrics import get_metrics, phase
+from watcher_udemy.tracing import propagate
+
+logger = get_logger()
+
+COURSE_ID_QUERY_PATTERN = re.compile(r"[?&]course_?id=(?P<course_id>\d+)", re.IGNORECASE)
+COURSE_PATH_PATTERN = re.compile(
+    r"^https?://(?:www\.)?(?P<domain>[\w-]+)\.udemy\.com/course/(?P<slug>[^/?#]+)", re.IGNORECASE
+)
+REDIRECT_PATH_PATTERN = re.compile(
+    r"^https?://(?:www\.)?(?P<domain>[\w-]+)\.udemy\.com/course-dashboard-redirect/?", re.IGNORECASE
+)
+
+
+def canonicalize_course_url(url: str, domain: str) -> Optional[Tuple[str, str]]:
+    """
+    Reduce the many url forms of a course (redirects, /learn/ pages, query strings...) to its key
+
+    :param str url: url of the course
+    :param str domain: business sub-domain the url must belong to
+    :return: ("id", "<course id>") or ("slug", "<course slug>"), None if it isn't a course url of the domain
+    """
+    url = url.strip()
+    if matches := REDIRECT_PATH_PATTERN.match(url):
+        if matches.group("domain").lower() != domain.lower():
+            return None
+        if id_matches := COURSE_ID_QUERY_PATTERN.search(url):
+            return "id", id_matches.group("course_id")
+        return None
+    if matches := COURSE_PATH_PATTERN.match(url):
+        if matches.group("domain").lower() != domain.lower():
+            return None
+        slug = matches.group("slug").lower()
+        return ("id", slug) if slug.isdigit() else ("slug", slug)
+    return None
+
+
+class CourseIdSet:
+    """
+    Set of course ids stored as a bitmap, a few hundred KB hold every course id Udemy has handed out so far
+    """
+
+    def __init__(self):
+        self._bits = bytearray()
+        self._size = 0
+
+    def add(self, course_id: int) -> bool:
+        """
+        :param int course_id: id to add
+        :return: False if the id was already in the set
+        """
+        index, bit = divmod(course_id, 8)
+        if index >= len(self._bits):
+            self._bits.extend(bytes(max(index + 1 - len(self._bits), len(self._bits))))
+        if self._bits[index] & (1 << bit):
+            return False
+        self._bits[index] |= 1 << bit
+        self._size += 1
+        return True
+
+    def __contains__(self, course_id: int) -> bool:
+        index, bit = divmod(course_id, 8)
+        return index < len(self._bits) and bool(self._bits[index] & (1 << bit))
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class CourseResolver:
+    """
+    Resolves course urls to course ids through the api, concurrently and with a permanent
+    slug -> id cache in the catalogue, so the browser never has to load a course page for it
+    """
+
+    def __init__(
+            self,
+            session: requests.Session,
+            domain: str,
+            course_by_slug_url: str,
+            catalogue: CourseCatalogue,
+            max_workers: int = 10,
+    ):
+        """
+        :param requests.Session session: Logged in session
+        :param str domain: Business sub-domain of the account
+        :param str course_by_slug_url: Course details url template taking the slug
+        :param CourseCatalogue catalogue: Catalogue holding the slug cache
+        :param int max_workers: Max number of lookups running at the same time
+        """
+        self.session = session
+        self.domain = domain
+        self.course_by_slug_url = course_by_slug_url
+        self.catalogue = catalogue
+        self.max_workers = max_workers
+
+    def _lookup_slug(self, slug: str) -> Optional[int]:
+        try:
+            response = self.session.get(self.course_by_slug_url.format(slug), timeout=30)
+        except requests.RequestException as e:
+            logger.warning(f"Couldn't resolve course {slug}: {e}")
+            return None
+        if response.status_code != 200:
+            logger.info(f"Couldn't resolve course {slug}, status {response.status_code}")
+            return None
+        try:
+            return response_json(response).get("id")
+        except (ValueError, AttributeError) as e:
+            # an error page or a truncated body leaves this slug unresolved, not the whole batch
+            logger.warning(f"Couldn't resolve course {slug}, unreadable answer: {e}")
+            return None
+
+    @phase("discovery")
+    def resolve_slugs(self, slugs: Iterable[str]) -> Dict[str, int]:
+        """
+        Resolve slugs to course ids, from the cache first and then through the api
+
+        :param slugs: course slugs
+        :return: slug -> course id for the slugs that could be resolved
+        """
+        slugs = list(dict.fromkeys(slugs))
+        resolved = self.catalogue.get_slug_ids(slugs)
+        missing = [slug for slug in slugs if slug not in resolved]
+        get_metrics().cache_access("course_slugs", True, len(resolved))
+        get_metrics().cache_access("course_slugs", False, len(missing))
+        if missing:
+            logger.info(f"Resolving {len(missing)} course slugs through the api")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                looked_up = {
+                    slug: course_id
+                    for slug, course_id in zip(missing, executor.map(propagate(self._lookup_slug), missing))
+                    if course_id is not None
+                }
+            self.catalogue.save_slug_ids(looked_up)
+            resolved.update(looked_up)
+        return resolved
+
+    def resolve(self, urls: Iterable[str]) -> Dict[str, Optional[int]]:
+        """
+        Resolve a batch of course urls
+
+        :param urls: course urls
+        :return: url -> course id, None for the urls that couldn't be resolved
+        """
+        keys = {url: canonicalize_course_url(url, self.domain) for url in urls}
+        slug_ids = self.resolve_slugs(key[1] for key in keys.values() if key and key[0] == "slug")
+        resolved = {}
+        for url, key in keys.items():
+            if key is None:
+                resolved[url] = None
+            elif key[0] == "id":
+                resolved[url] = int(key[1])
+            else:
+                resolved[url] = slug_ids.get(key[1])
+        return resolved
+
+    def resolve_one(self, url: str) -> Optional[int]:
+        return self.resolve([url])[url]
+
+    def resolve_unique(self, urls: Iterable[str]) -> Tuple[List[int], List[str]]:
+        """
+        Resolve urls and dedupe them on the course id, so two url forms of a course are processed once
+
+        :param urls: course urls
+        :return: unique course ids in the order they first appear, and the urls that couldn't be resolved
+        """
+        course_ids = {}
+        unresolved = []
+        for url, course_id in self.resolve(urls).items():
+            if course_id is None:
+                unresolved.append(url)
+            else:
+                course_ids[course_id] = None
+        return list(course_ids), unresolved
+
+    def iter_resolve_unique(self, urls: Iterable[str], batch_size: int = 256) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Lazily resolve a stream of urls, deduped on the course id. Ids found in the urls are yielded
+        right away, slugs are resolved in batches that start small so the first course starts quickly
+
+        :param urls: course urls, consumed lazily
+        :param int batch_size: max number of slugs resolved at once
+        :return: iterator of (course id, url), the course id is None for the urls that couldn't be resolved
+        """
+        seen_ids = CourseIdSet()
+        seen_unresolved = set()
+        pending_slugs = {}
+        current_batch_size = min(16, batch_size)
+
+        def flush():
+            slug_ids = self.resolve_slugs(pending_slugs)
+            for slug, url in pending_slugs.items():
+                course_id = slug_ids.get(slug)
+                if course_id is None:
+                    if url not in seen_unresolved:
+                        seen_unresolved.add(url)
+                        yield None, url
+                elif seen_ids.add(course_id):
+                    yield course_id, url
+            pending_slugs.clear()
+
+        for url in urls:
+            key = canonicalize_course_url(url, self.domain)
+            if key is None:
+                if url not in seen_unresolved:
+                    seen_unresolved.add(url)
+                    yield None, url
+            elif key[0] == "id":
+                if seen_ids.add(int(key[1])):
+                    yield int(key[1]), url
+            elif key[1] not in pending_slugs:
+                pending_slugs[key[1]] = url
+                if len(pending_slugs) >= current_batch_size:
+                    yield from flush()
+                    current_batch_size = min(current_batch_size * 2, batch_size)
+        yield from flush()
@@ -1,5 +1,8 @@
 import asyncio
-from typing import Union
+import itertools
+from typing import Iterable, Iterator, List, Optional, Union
+
+import requests
 from selenium.common.exceptions import (
     NoSuchElementException,
     TimeoutException,
@@ -7,6 +10,7 @@ from selenium.common.exceptions import (
 )
 
 from watcher_udemy import (
+    DriverManager,
     ScraperManager,
     Settings,
     UdemyActionsUI,
@@ -15,166 +19,484 @@ from watcher_udemy import (
 )
 from watcher_udemy.exceptions import CourseNotFoundException
 from watcher_udemy.logging import get_logger
-from watcher_udemy.utils import read_urls_from_file
+from watcher_udemy.metrics import get_metrics, metrics_file_name, phase
+from watcher_udemy.profiling import register_queue
+from watcher_udemy.ratelimit import RateLimiter
+from watcher_udemy.tracing import span
+from watcher_udemy.udemy_ui import RunStatistics
+from watcher_udemy.utils import iter_urls_from_file
+from watcher_udemy.watchdog import BrowserWatchdog
+from watcher_udemy.work_queue import LeaseHeartbeat, RetryQueue, WorkQueue, dead_letter_file_name, get_worker_id
 
 logger = get_logger()
 
 
-def _watch_courses_ui(
+def _report_run(udemy_actions: UdemyActionsUI) -> None:
+    """
+    Log the statistics of the run and export its metrics to the app dir
 
-        driver,
-        settings: Settings,
+    :param UdemyActionsUI udemy_actions: udemy actions of the run
+    :return: None
+    """
+    udemy_actions.stats.table()
+    get_metrics().export(udemy_actions.stats, metrics_file_name(udemy_actions.settings.cookie_file_name))
+
+
+def _process_course_link(udemy_actions: UdemyActionsUI, settings: Settings, course_link: str) -> bool:
+    """
+    Enroll in a course if needed and get it to finish, traced as one span with the calls it made as children
+
+    :param UdemyActionsUI udemy_actions: Logged in udemy actions
+    :param Settings settings: Core settings used for Udemy
+    :param str course_link: Link of the course
+    :return: False if the course is still not complete after trying to finish it
+    """
+    with span("course", "course", link=course_link) as course_span:
+        finished = _complete_course_link(udemy_actions, settings, course_link)
+        course_span.set(finished=finished)
+    return finished
+
+
+def _complete_course_link(udemy_actions: UdemyActionsUI, settings: Settings, course_link: str) -> bool:
+    """
+    Body of _process_course_link
+    """
+    try:
+        cs_link, course_id = udemy_actions._get_course_link_wrapper(course_link, settings.domain)
+        logger.info("In the courses already rolled ")
+        status = UdemyStatus.ALREADY_ENROLLED.value
+    except CourseNotFoundException:
+        logger.info("Not in a rolled in course")
+        status, cs_link, course_id = udemy_actions.enroll(course_link)
+        pass
+    if status == UdemyStatus.ENROLLED.value or status == UdemyStatus.ALREADY_ENROLLED.value:
+
+        logger.info(f"Enrolled/Already enrolled in {cs_link}, trying to get it to finish")
+        course_details = udemy_actions._get_course_details(course_id)
+        course_details_complt = course_details.get('completion_ratio')
+        course_details_has_quizzes = course_details.get('num_quizzes')
+        if course_details_complt != 100:
+            # the curriculum lists the lectures to complete in fewer requests than the pages of lectures, and it
+            # is the fingerprint stored once the course is complete, so a later change only costs the new items
+            delta = udemy_actions._get_curriculum_delta(course_id)
+            if not delta.is_first_sync:
+                logger.info(
+                    f"Curriculum of {course_id} changed since it was completed: "
+                    f"{len(delta.new_lecture_ids)} new lectures, {len(delta.new_quiz_ids)} new quizzes"
+                )
+                if delta.new_quiz_ids:
+                    udemy_actions._solve_single_quiz_test(course_id, delta.new_quiz_ids, delta.items)
+                if delta.new_lecture_ids:
+                    udemy_actions._send_completition_req(cs_link, delta.new_lecture_ids, course_id, settings.domain)
+                course_details_complt = udemy_actions._get_course_details(course_id).get('completion_ratio')
+                if course_details_complt != 100:
+                    logger.info("Completing only the new items wasn't enough, going through the whole course")
+
+            if course_details_complt != 100:
+                if str(course_details_has_quizzes) == '0':
+                    logger.info("It has got NO quizzes in it")
+                else:
+                    logger.info("It has got quizzes in it")
+                    # udemy_actions._solve_quiz(course_id)
+                    udemy_actions._solve_single_quiz_test(course_id, curriculum_items=delta.items)
+                list_of_lectures_id = [item['id'] for item in delta.items if item.get('_class') == 'lecture'] \
+                    or udemy_actions._get_all_lectures_id(cs_link)
+
+                logger.debug(f"Printing list of lectures of {cs_link}: {list_of_lectures_id}")
+                udemy_actions._send_completition_req(cs_link, list_of_lectures_id, course_id, settings.domain)
+                course_details = udemy_actions._get_course_details(course_id)
+                course_details_complt = course_details['completion_ratio']
+            if course_details_complt != 100:
+                udemy_actions.stats.courses_failed += 1
+                return False
+            udemy_actions.stats.courses_completed += 1
+            udemy_actions.catalogue.save_curriculum_fingerprint(course_id, delta.item_hashes, delta.curriculum_hash)
+            udemy_actions.catalogue.mark_completed(course_id)
+
+        else:
+            logger.info("Course was already finished")
+            if udemy_actions.catalogue.get_curriculum_fingerprint(course_id) is None:
+                # fingerprint it once, so later curriculum changes only cost the new items
+                delta = udemy_actions._get_curriculum_delta(course_id)
+                udemy_actions.catalogue.save_curriculum_fingerprint(
+                    course_id, delta.item_hashes, delta.curriculum_hash
+                )
+            udemy_actions.catalogue.mark_completed(course_id)
+    return True
+
+
+def _iter_links_from_file(udemy_actions: UdemyActionsUI, filename: str) -> Iterator[str]:
+    """
+    Stream the course links of a file, deduped on the course id.
+    Links that can't be resolved through the api are left to the browser
+
+    :param UdemyActionsUI udemy_actions: Logged in udemy actions
+    :param str filename: file of urls, gzipped if it ends with .gz, "-" for stdin
+    :return: iterator of course links
+    """
+    resolved = unresolved = 0
+    for course_id, url in udemy_actions.resolver.iter_resolve_unique(iter_urls_from_file(filename)):
+        if course_id is None:
+            unresolved += 1
+            yield url
+        else:
+            resolved += 1
+            yield udemy_actions.URL_TO_COURSE_ID.format(course_id)
+    logger.info(f"Read {resolved} unique courses from {filename}, {unresolved} links left unresolved")
+
+
+def _triage_links(udemy_actions: UdemyActionsUI, course_links: Iterable[str], batch_size: int = 50) -> Iterator[str]:
+    """
+    Drop the courses rejected by the language and category filters, checked in bulk through the api.
+    Courses already in the catalogue are enrolled already and never filtered
+
+    :param UdemyActionsUI udemy_actions: Logged in udemy actions
+    :param course_links: course links, consumed lazily
+    :param int batch_size: number of links checked at once
+    :return: iterator of the links worth opening in the browser
+    """
+    if not udemy_actions.prefilter.enabled:
+        yield from course_links
+        return
+    known_ids = udemy_actions.catalogue.known_ids()
+    course_links = iter(course_links)
+    while batch := list(itertools.islice(course_links, batch_size)):
+        course_ids = {link: udemy_actions.extract_cs_id(link, udemy_actions.settings.domain) for link in batch}
+        verdicts = udemy_actions._prefilter_courses(
+            [course_id for course_id in course_ids.values() if course_id is not None and course_id not in known_ids]
+        )
+        for link in batch:
+            if verdicts.get(course_ids[link]) is None:
+                yield link
+
+
+def _api_enroll_links(udemy_actions: UdemyActionsUI, course_links: Iterable[str], batch_size: int = 50) -> Iterator[str]:
+    """
+    Enroll in the courses through the api in concurrent batches, the browser is only used for the
+    courses the api couldn't enroll in
+
+    :param UdemyActionsUI udemy_actions: Logged in udemy actions
+    :param course_links: course links, consumed lazily
+    :param int batch_size: number of courses enrolled at once
+    :return: iterator of the links of the courses enrolled in, or that couldn't be resolved, to process
+    """
+    # courses of the catalogue are enrolled in already, their subscription is checked but they are never filtered
+    known_ids = udemy_actions.catalogue.known_ids()
+    course_links = iter(course_links)
+    while batch := list(itertools.islice(course_links, batch_size)):
+        # slugs of the scrapers are resolved too, the ids are cached so processing the course won't ask again
+        course_ids = udemy_actions.resolver.resolve(batch)
+        statuses = udemy_actions.api_enroll(
+            list(dict.fromkeys(course_id for course_id in course_ids.values() if course_id is not None)),
+            prefiltered=known_ids,
+        )
+        for link in batch:
+            status = statuses.get(course_ids[link], UdemyStatus.ALREADY_ENROLLED.value)
+            if status == UdemyStatus.NOTUNROLLED.value:
+                logger.info(f"Falling back to the browser to enroll in {link}")
+                status = udemy_actions.enroll(link, prefiltered=True)[0]
+            if status in (UdemyStatus.ENROLLED.value, UdemyStatus.ALREADY_ENROLLED.value):
+                yield link
+
+
+def _collect_course_links(
+        udemy_actions: UdemyActionsUI,
         scrapers: ScraperManager,
         get_random_links: bool,
         scrape_urls_from_file: bool,
         filename: str,
-) -> None:
+) -> Optional[Iterable[str]]:
     """
-    Method to scrape courses from the supported sites and enroll in them on udemy.
+    Gather the links of the courses to complete, from the file or the in progress courses
 
-    :param WebDriver driver: WebDriver to use to complete enrolment
-    :param Settings settings: Core settings used for Udemy
-    :param ScraperManager scrapers:
-    :return:
+    :return: course links, links from a file are read lazily. None if the arguments don't make sense
     """
-    list_of_error_links = []
-    logger.info("Creating the UdemyActionsUI object")
-    udemy_actions = UdemyActionsUI(driver, settings)
-    udemy_actions.login()
-
     loop = asyncio.get_event_loop()
 
     logger.info("launching the scrapers")
 
     if scrape_urls_from_file and filename:
-        udemy_course_links = read_urls_from_file(filename)
-
-        logger.info(f"LINKS FROM FILE {udemy_course_links}")
-        # udemy_course_ids=[]
-        # for x in udemy_course_links:
-        #     crs_id=udemy_actions._get_course_id(x)
-        #     logger.info(f"COURSE ID {crs_id}")
-        #     if crs_id is not None and crs_id not in udemy_course_ids:
-        #         udemy_course_ids.append(crs_id)
-        # logger.info(f"COURSE IDs {udemy_course_ids}")
-        # if len(udemy_course_ids)>0:
-        #     udemy_course_links = []
-        #     for x in udemy_course_ids:
-        #         udemy_course_links.append(udemy_actions.URL_TO_COURSE_ID.format(x))
-        # logger.info(f"Real course links {udemy_course_links}")
-
+        logger.info(f"Streaming links from {filename}")
+        return _triage_links(udemy_actions, _iter_links_from_file(udemy_actions, filename))
 
     elif scrape_urls_from_file and not filename:
         logger.error("this isn't a possible choice.")
-        return
+        return None
     else:
 
-        udemy_course_progress_id = udemy_actions._get_already_rolled_courses()
+        udemy_actions._get_already_rolled_courses()
+        # the catalogue also remembers the courses left incomplete by previous runs
+        udemy_course_progress_id = udemy_actions.catalogue.incomplete_courses()
         udemy_course_links = []
         for x in udemy_course_progress_id:
             udemy_course_links.append(udemy_actions.URL_TO_COURSE_ID.format(x))
 
         logger.debug("OLEE")
         if get_random_links:
-            new_links = loop.run_until_complete(scrapers.run())
+            # the scrapers drive the browser directly, it needs the session cookies
+            scrapers.set_driver(udemy_actions.ensure_driver_session())
+            with phase("discovery"):
+                new_links = loop.run_until_complete(scrapers.run())
             logger.debug("NEW LINKS: {}".format(new_links))
             logger.info(f"LINKS FROM PAGE {udemy_course_links}")
             udemy_course_links.extend(new_links)
+    # remove duplicate links, keeping their order
+    return _triage_links(udemy_actions, dict.fromkeys(udemy_course_links))
 
-    while True:
-        if udemy_course_links:
-            for course_link in set(
-                    udemy_course_links
-            ):  # Cast to set to remove duplicate links
-
-                try:
-                    try:
-                        cs_link, course_id = udemy_actions._get_course_link_wrapper(course_link, settings.domain)
-                        logger.info("In the courses already rolled ")
-                        status = UdemyStatus.ALREADY_ENROLLED.value
-                    except CourseNotFoundException:
-                        logger.info("Not in a rolled in course")
-                        status, cs_link, course_id = udemy_actions.enroll(course_link)
-                        pass
-                    if status == UdemyStatus.ENROLLED.value or status == UdemyStatus.ALREADY_ENROLLED.value:
-
-                        logger.info(f"Enrolled/Already enrolled in {cs_link}, trying to get it to finish")
-                        course_details = udemy_actions._get_course_details(course_id)
-                        course_details_complt = course_details.get('completion_ratio')
-                        course_details_has_quizzes = course_details.get('num_quizzes')
-                        if course_details_complt != 100:
-                            if str(course_details_has_quizzes) == '0':
-                                logger.info("It has got NO quizzes in it")
-                            else:
-                                logger.info("It has got quizzes in it")
-                                # udemy_actions._solve_quiz(course_id)
-                                udemy_actions._solve_single_quiz_test(course_id)
-                            print(f"course link {cs_link}")
-                            list_of_lectures_id = udemy_actions._get_all_lectures_id(cs_link)
-
-                            logger.info(f"Printing list of lectures of {cs_link}: {list_of_lectures_id}")
-                            print(udemy_actions._send_completition_req(cs_link, list_of_lectures_id, course_id,
-                                                                       settings.domain))
-                            course_details = udemy_actions._get_course_details(course_id)
-                            course_details_complt = course_details['completion_ratio']
-                            if course_details_complt != 100:
-                                list_of_error_links.append(course_link)
-
-                        else:
-                            logger.info("Course was already finished")
-
-                    udemy_course_links.remove(course_link)
-
-
-                except NoSuchElementException as e:
-                    logger.error(f"No such element: {e}")
-                except TimeoutException:
-                    logger.error(f"Timeout on link: {course_link}")
-                except WebDriverException:
-                    logger.error(f"Webdriver exception on link: {course_link}")
-                except KeyboardInterrupt:
-                    udemy_actions.stats.table()
-                    logger.warning("Exiting the script")
-                    return
-                except exceptions.RobotException as e:
-                    logger.error(e)
-                    return
-                except Exception as e:
-                    logger.error(f"Unexpected exception: {e}", exc_info=True)
+
+def _watch_courses_from_queue(
+        udemy_actions: UdemyActionsUI,
+        settings: Settings,
+        work_queue: WorkQueue,
+        api_enroll: bool = False,
+        watchdog: Optional[BrowserWatchdog] = None,
+) -> None:
+    """
+    Lease courses from a shared work queue until it runs dry
+
+    :param UdemyActionsUI udemy_actions: Logged in udemy actions
+    :param Settings settings: Core settings used for Udemy
+    :param WorkQueue work_queue: Queue shared with the other workers
+    :param bool api_enroll: Enroll in the leased courses through the api
+    :param BrowserWatchdog watchdog: Restarts the browser when it grows too big or hangs
+    :return: None
+    """
+    worker_id = get_worker_id()
+    register_queue("work_queue", work_queue.stats)
+    logger.info(f"Consuming the work queue as {worker_id}")
+    while leased := work_queue.lease(worker_id, 1):
+        item = leased[0]
+        course_link = udemy_actions.URL_TO_COURSE_ID.format(item) if item.isdigit() else item
+        try:
+            with LeaseHeartbeat(work_queue, worker_id, leased):
+                if api_enroll and not any(_api_enroll_links(udemy_actions, [course_link])):
+                    work_queue.complete(worker_id, item)
+                    continue
+                finished = _process_course_link(udemy_actions, settings, course_link)
+        except (KeyboardInterrupt, exceptions.RobotException, exceptions.LoginException):
+            # a lost session is the worker's problem, the course goes back to the queue for another one
+            work_queue.fail(worker_id, item, "worker stopped")
+            raise
+        except Exception as e:
+            logger.error(f"Exception on queued course {item}: {e}", exc_info=True)
+            work_queue.fail(worker_id, item, repr(e))
+            if watchdog is not None:
+                watchdog.check(udemy_actions, failed=isinstance(e, WebDriverException))
+            continue
+        if watchdog is not None:
+            watchdog.check(udemy_actions)
+        if finished:
+            work_queue.complete(worker_id, item)
         else:
-            udemy_actions.stats.table()
-            if len(list_of_error_links) > 0:
-                logger.warning(f"List of error links: {list_of_error_links}")
-            logger.info("All scrapers complete")
-            return
+            work_queue.fail(worker_id, item, "course not complete")
+    logger.info(f"Work queue is empty: {work_queue.stats()}")
 
 
+def classify_error(error: BaseException) -> bool:
+    """
+    Tell the fatal errors (a course that doesn't exist, a request udemy refuses) from the ones worth
+    retrying, unknown errors are retried until the course runs out of attempts. Login errors are
+    about the session, not the course, and never get here
+
+    :param BaseException error: Exception raised while processing a course
+    :return: True if the course should be retried
+    """
+    if isinstance(error, CourseNotFoundException):
+        return False
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return True
+
+
+def _try_course_link(
+        udemy_actions: UdemyActionsUI,
+        settings: Settings,
+        course_link: str,
+        retry_queue: RetryQueue,
+        list_of_error_links: List[str],
+        watchdog: Optional[BrowserWatchdog] = None,
+) -> None:
+    """
+    Process a course link, failures are retried or dead-lettered through the retry queue
+
+    :param RetryQueue retry_queue: Queue the link comes from
+    :param list list_of_error_links: Links of the courses that couldn't be completed, appended to
+    :param BrowserWatchdog watchdog: Restarts the browser when it grows too big or hangs
+    :return: None
+    """
+    try:
+        if not _process_course_link(udemy_actions, settings, course_link):
+            list_of_error_links.append(course_link)
+        retry_queue.done(course_link)
+        if watchdog is not None:
+            watchdog.check(udemy_actions)
+        return
+    except (KeyboardInterrupt, exceptions.RobotException):
+        raise
+    except exceptions.LoginException as e:
+        # the session is lost, not the course: log in again and give the course another go without
+        # counting an attempt. A login that fails, or a course losing the new session too, stops the run
+        if not retry_queue.requeue(course_link):
+            raise
+        logger.warning(f"Lost the udemy session on {course_link}, logging in again: {e}")
+        udemy_actions.logged_in = False
+        udemy_actions.login()
+        return
+    except NoSuchElementException as e:
+        logger.error(f"No such element: {e}")
+        error = e
+    except TimeoutException as e:
+        logger.error(f"Timeout on link: {course_link}")
+        error = e
+    except WebDriverException as e:
+        logger.error(f"Webdriver exception on link: {course_link}")
+        error = e
+    except Exception as e:
+        logger.error(f"Unexpected exception: {e}", exc_info=True)
+        error = e
+    if watchdog is not None:
+        watchdog.check(udemy_actions, failed=isinstance(error, WebDriverException))
+    if classify_error(error):
+        retry_queue.retry(course_link, repr(error))
+    else:
+        retry_queue.dead_letter(course_link, repr(error))
+
+
+def _watch_courses_ui(
+
+        driver,
+        settings: Settings,
+        scrapers: ScraperManager,
+        get_random_links: bool,
+        scrape_urls_from_file: bool,
+        filename: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        work_queue: Optional[WorkQueue] = None,
+        queue_seed: bool = False,
+        api_enroll: bool = False,
+        watchdog: Optional[BrowserWatchdog] = None,
+        driver_manager: Optional[DriverManager] = None,
+) -> RunStatistics:
+    """
+    Method to scrape courses from the supported sites and enroll in them on udemy.
+
+    :param WebDriver driver: WebDriver to use to complete enrolment
+    :param Settings settings: Core settings used for Udemy
+    :param ScraperManager scrapers:
+    :param RateLimiter rate_limiter: Optional request budget shared with other accounts of the domain
+    :param WorkQueue work_queue: Optional queue shared with other workers, courses are leased from it
+    :param bool queue_seed: Add the courses found by this worker to the work queue before consuming it
+    :param bool api_enroll: Enroll in the courses through the api, the browser is only a fallback
+    :param BrowserWatchdog watchdog: Restarts the browser when it grows too big or hangs
+    :param DriverManager driver_manager: Starts the browser the first time it is needed, when driver is None
+    :return: Statistics of the run
+    """
+    list_of_error_links = []
+    logger.info("Creating the UdemyActionsUI object")
+    udemy_actions = UdemyActionsUI(
+        driver, settings, settings.cookie_file_name, rate_limiter, driver_manager=driver_manager
+    )
+    udemy_actions.login()
+
+    if work_queue is not None:
+        if queue_seed:
+            udemy_course_links = _collect_course_links(
+                udemy_actions, scrapers, get_random_links, scrape_urls_from_file, filename
+            ) or []
+            items = (
+                str(course_id) if (course_id := udemy_actions.extract_cs_id(course_link, settings.domain)) is not None
+                else course_link
+                for course_link in udemy_course_links
+            )
+            logger.info(f"Added {work_queue.enqueue(items)} courses to the work queue")
+        try:
+            _watch_courses_from_queue(udemy_actions, settings, work_queue, api_enroll, watchdog)
+        except KeyboardInterrupt:
+            logger.warning("Exiting the script")
+        except (exceptions.RobotException, exceptions.LoginException) as e:
+            logger.error(e)
+        _report_run(udemy_actions)
+        return udemy_actions.stats
+
+    udemy_course_links = _collect_course_links(
+        udemy_actions, scrapers, get_random_links, scrape_urls_from_file, filename
+    )
+    if udemy_course_links is None:
+        return udemy_actions.stats
+    if api_enroll:
+        udemy_course_links = _api_enroll_links(udemy_actions, udemy_course_links)
+
+    # links are consumed as they come, a file of urls never has to fit in memory
+    retry_queue = RetryQueue(
+        udemy_course_links, dead_letter_file_name=dead_letter_file_name(settings.cookie_file_name, settings.domain)
+    )
+    register_queue("retry_queue", retry_queue.__len__)
+    try:
+        while (course_link := retry_queue.get()) is not None:
+            _try_course_link(udemy_actions, settings, course_link, retry_queue, list_of_error_links, watchdog)
+    except KeyboardInterrupt:
+        _report_run(udemy_actions)
+        logger.warning("Exiting the script")
+        return udemy_actions.stats
+    except (exceptions.RobotException, exceptions.LoginException) as e:
+        # the courses left are kept for the next run, none of them is dead-lettered for it
+        logger.error(e)
+        return udemy_actions.stats
+
+    _report_run(udemy_actions)
+    if len(list_of_error_links) > 0:
+        logger.warning(f"List of error links: {list_of_error_links}")
+    if retry_queue.dead_lettered_this_run:
+        logger.warning(f"Dead-lettered links, skipped by the next runs: {retry_queue.dead_lettered_this_run}")
+    logger.info("All scrapers complete")
+    return udemy_actions.stats
+
+
+@phase("run")
 def watch_courses_ui(
         driver,
         settings: Settings,
         udemy_scraper_enabled: bool,
         get_random_links: bool,
         scrape_urls_from_file: bool,
-        filename: str
-) -> None:
+        filename: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        work_queue: Optional[WorkQueue] = None,
+        queue_seed: bool = False,
+        api_enroll: bool = False,
+        driver_manager: Optional[DriverManager] = None,
+) -> Optional[RunStatistics]:
     """
     Wrapper of _redeem_courses so we always close browser on completion
 
-    :param WebDriver driver: WebDriver to use to complete enrolment
+    :param WebDriver driver: WebDriver to use to complete enrolment, None to start it lazily through driver_manager
     :param Settings settings: Core settings used for Udemy
     :param bool udemy_scraper_enabled: Boolean signifying if udemy scraper scraper should run
+    :param RateLimiter rate_limiter: Optional request budget shared with other accounts of the domain
+    :param WorkQueue work_queue: Optional queue shared with other workers, courses are leased from it
+    :param bool queue_seed: Add the courses found by this worker to the work queue before consuming it
+    :param bool api_enroll: Enroll in the courses through the api, the browser is only a fallback
+    :param DriverManager driver_manager: Manager of the driver, lets a watchdog restart the browser during the run
 
-    :return:
+    :return: Statistics of the run, None if it failed before starting
     """
+    watchdog = BrowserWatchdog(driver_manager) if driver_manager is not None else None
 
     try:
         scrapers = ScraperManager(
             udemy_scraper_enabled,
             driver, settings
         )
-        _watch_courses_ui(driver, settings, scrapers, get_random_links, scrape_urls_from_file, filename)
+        return _watch_courses_ui(
+            driver, settings, scrapers, get_random_links, scrape_urls_from_file, filename, rate_limiter,
+            work_queue, queue_seed, api_enroll, watchdog, driver_manager
+        )
     except Exception as e:
         logger.error(f"Exception in redeem courses: {e}", exc_info=True)
     finally:
         logger.info("Closing browser")
-        driver.quit()
+        # the watchdog may have replaced the browser the run started with, or it may never have started
+        if driver_manager is not None:
+            driver_manager.quit()
+        elif driver is not None:
+            driver.quit()
@@ -3,6 +3,7 @@ from functools import reduce
 from typing import List
 
 from watcher_udemy.scrapers.scraper_base import UdemyScraper
+from watcher_udemy.tracing import span
 
 
 
@@ -21,6 +22,16 @@ class ScraperManager:
             self.udemy_scraper,
         )
 
+    def set_driver(self, driver) -> None:
+        """
+        Hand the scrapers the browser to use, after it was started or replaced
+
+        :param WebDriver driver: WebDriver of the run
+        :return: None
+        """
+        for scraper in self._scrapers:
+            scraper.driver = driver
+
     async def run(self) -> List:
         """
         Runs any enabled scrapers and returns a list of links
@@ -32,10 +43,15 @@ class ScraperManager:
         if enabled_scrapers:
             urls = reduce(
                 list.__add__,
-                await asyncio.gather(*map(lambda sc: sc.run(), enabled_scrapers)),
+                await asyncio.gather(*map(self._run_scraper, enabled_scrapers)),
             )
         return urls
 
+    @staticmethod
+    async def _run_scraper(scraper) -> List:
+        with span(f"scraper:{type(scraper).__name__}", "scraper"):
+            return await scraper.run()
+
     def _enabled_scrapers(self) -> List:
         """
         Returns a list of scrapers that should run
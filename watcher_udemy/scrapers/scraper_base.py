@@ -6,9 +6,9 @@ from typing import List, Any, Coroutine
 from bs4 import BeautifulSoup
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 
 from watcher_udemy.http import get
+from watcher_udemy.timeouts import AdaptiveWait
 from watcher_udemy.scrapers.base_scraper import BaseScraper
 from selenium.webdriver.remote.webdriver import WebDriver, WebElement
 from selenium.webdriver.support import expected_conditions as EC
@@ -52,9 +52,14 @@ class UdemyScraper(BaseScraper):
         soup = BeautifulSoup(course_linkss, "html.parser")
         try:
             # button_of_any_container="//div[@data-purpose='container']"
-            WebDriverWait(self.driver, 10). \
+            AdaptiveWait(self.driver, "scraper:ready-state", 10). \
                 until(lambda driver: driver.execute_script('return document.readyState') == 'complete')
-            time.sleep(10)
+            # the course cards are rendered after the page is loaded, wait for them instead of sleeping
+            try:
+                AdaptiveWait(self.driver, "scraper:course-links", 10). \
+                    until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/course/')]")))
+            except TimeoutException:
+                logger.warning("No course link showed up on the home page")
             # div_containing_rel_links = WebDriverWait(self.driver, 20).until(
             #     EC.presence_of_element_located((By.XPATH, button_of_any_container))
             # )
@@ -1,7 +1,6 @@
 import getpass
 import os.path
-from distutils.util import strtobool
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from ruamel.yaml import YAML, dump
 
@@ -17,8 +16,23 @@ class Settings:
     """
 
     def __init__(
-            self, delete_settings=False, delete_cookie=False, settings_path="settings.yaml"
+            self,
+            delete_settings=False,
+            delete_cookie=False,
+            settings_path="settings.yaml",
+            cookie_file_name=".cookie",
+            account: Optional[Dict] = None,
+            read_only: bool = False,
     ):
+        """
+        :param bool delete_settings: Determines if we should delete old settings file
+        :param bool delete_cookie: Determines if we should delete the cookie file
+        :param str settings_path: Name of the settings file in the app directory
+        :param str cookie_file_name: Name of the cookie file in the app directory
+        :param dict account: Settings of an account from an accounts manifest. When passed the
+            settings file is neither read nor written and the user is never prompted
+        :param bool read_only: Load the settings file if there is one, without ever prompting or writing it
+        """
         self.email = None
         self.password = None
         self.zip_code = None
@@ -26,7 +40,8 @@ class Settings:
         self.categories = []
         self.domain = None
         self._settings_path = os.path.join(get_app_dir(), settings_path)
-        self._cookies_path = os.path.join(get_app_dir(), ".cookie")
+        self.cookie_file_name = cookie_file_name
+        self._cookies_path = os.path.join(get_app_dir(), cookie_file_name)
         self._should_store_email = False
         self._should_store_password = False
         self.should_store_domain=False
@@ -34,7 +49,12 @@ class Settings:
             self.delete_settings()
         if delete_cookie:
             self.delete_cookie()
-        self._init_settings()
+        if account is not None:
+            self._apply_udemy_settings(account)
+        elif read_only:
+            self._load_user_settings()
+        else:
+            self._init_settings()
 
     def _init_settings(self) -> None:
         """
@@ -71,16 +91,24 @@ class Settings:
             logger.info("Loading existing settings")
             with open(self._settings_path) as f:
                 settings = yaml.load(f)
-            udemy_settings = settings["udemy"]
-            self.email = udemy_settings["email"]
-            self.password = udemy_settings["password"]
-            self.domain = udemy_settings["domain"]
-            self.zip_code = udemy_settings.get("zipcode")
-            self.languages = udemy_settings.get("languages")
-            self.categories = udemy_settings.get("categories")
+            self._apply_udemy_settings(settings["udemy"])
 
         return settings
 
+    def _apply_udemy_settings(self, udemy_settings: Dict) -> None:
+        """
+        Set the udemy settings from their dictionary representation
+
+        :param dict udemy_settings: the "udemy" section of a settings file or an account of a manifest
+        :return: None
+        """
+        self.email = udemy_settings.get("email")
+        self.password = udemy_settings.get("password")
+        self.domain = udemy_settings.get("domain")
+        self.zip_code = udemy_settings.get("zipcode")
+        self.languages = udemy_settings.get("languages") or []
+        self.categories = udemy_settings.get("categories") or []
+
     def _generate_settings(self) -> None:
         """
         Generate the settings for the script
@@ -0,0 +1,232 @@
+import atexit
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from watcher_udemy.logging import get_logger
+from watcher_udemy.metrics import get_metrics
+from watcher_udemy.tracing import span
+from watcher_udemy.utils import get_app_dir
+
+logger = get_logger()
+
+# Samples needed before the observed latency replaces the default timeout of a site
+MIN_SAMPLES = 20
+# Samples kept per site, old ones fall off so the timeouts follow the current state of the site
+WINDOW = 200
+TIMEOUT_MARGIN = 2.0
+MIN_TIMEOUT = 2.0
+MAX_TIMEOUT = 60.0
+DEFAULT_API_TIMEOUT = 30.0
+# a requests timeout bounds every socket read, big pages need some slack over the usual latency
+MIN_API_TIMEOUT = 5.0
+
+ID_IN_PATH_PATTERN = re.compile(r"(?<=/)\d+(?=/|$)")
+SLUG_IN_PATH_PATTERN = re.compile(r"(?<=/courses/)[^/{]+(?=/|$)")
+
+
+class LatencyTracker:
+    """
+    Latency observed per wait site and per api endpoint, persisted across runs in the app dir.
+    Timeouts derive from the p99 of the samples, so fast sites stop paying for slow defaults
+    and slow days stop raising spurious timeouts.
+    """
+
+    def __init__(self, file_name: Optional[str] = "latency.json", window: int = WINDOW):
+        self._file = os.path.join(get_app_dir(), file_name) if file_name else None
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._unsaved = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self._file or not os.path.isfile(self._file):
+            return
+        try:
+            with open(self._file) as f:
+                samples = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't read the latency samples: {e}")
+            return
+        self._samples = {site: deque(values, maxlen=self.window) for site, values in samples.items()}
+
+    def save(self) -> None:
+        if not self._file:
+            return
+        with self._lock:
+            samples = {site: list(values) for site, values in self._samples.items()}
+            self._unsaved = 0
+        tmp_file = f"{self._file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(samples, f)
+        os.replace(tmp_file, self._file)
+
+    def record(self, site: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(site, deque(maxlen=self.window)).append(round(seconds, 3))
+            self._unsaved += 1
+            should_save = self._unsaved >= 50
+        if should_save:
+            self.save()
+
+    def record_timeout(self, site: str, timeout: float) -> None:
+        """
+        Record a wait or a request that timed out. It took at least its timeout, kept as a sample so a
+        timeout learned on a fast day grows back on a slow one instead of failing every time
+
+        :param str site: wait site or endpoint
+        :param float timeout: timeout that ran out
+        """
+        self.record(site, timeout)
+
+    def percentile(self, site: str, q: float) -> Optional[float]:
+        """
+        :param str site: wait site or endpoint
+        :param float q: percentile, between 0 and 100
+        :return: the percentile of the samples, None if there are not enough of them
+        """
+        with self._lock:
+            values = sorted(self._samples.get(site, ()))
+        if len(values) < MIN_SAMPLES:
+            return None
+        return values[min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1)]
+
+    def timeout(self, site: str, default: float, minimum: float = MIN_TIMEOUT) -> float:
+        """
+        Timeout of a site, p99 times the margin clamped to sane bounds, the default until enough samples came in
+
+        :param str site: wait site or endpoint
+        :param float default: timeout used while the site has too few samples
+        :param float minimum: lower bound of the timeout
+        :return: timeout in seconds
+        """
+        p99 = self.percentile(site, 99)
+        if p99 is None:
+            return default
+        return min(max(p99 * TIMEOUT_MARGIN, minimum), MAX_TIMEOUT)
+
+
+_tracker: Optional[LatencyTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = LatencyTracker()
+            atexit.register(_tracker.save)
+        return _tracker
+
+
+class AdaptiveWait(WebDriverWait):
+    """
+    WebDriverWait whose timeout is learned from the previous waits of the same site
+    """
+
+    def __init__(self, driver, site: str, timeout: float, tracker: Optional[LatencyTracker] = None, **kwargs):
+        """
+        :param WebDriver driver: WebDriver to wait on
+        :param str site: name of the wait site, the samples of a site are shared across runs
+        :param float timeout: timeout used until the site has enough samples
+        :param LatencyTracker tracker: tracker to use, the one of the process by default
+        """
+        self.site = site
+        self.tracker = tracker or get_latency_tracker()
+        super().__init__(driver, self.tracker.timeout(site, timeout), **kwargs)
+
+    def until(self, method, message=""):
+        start = time.monotonic()
+        try:
+            with span(f"wait:{self.site}", "browser", timeout=self._timeout):
+                value = super().until(method, message)
+        except TimeoutException:
+            get_metrics().inc("browser_wait_timeouts_total", site=self.site)
+            self.tracker.record_timeout(self.site, max(time.monotonic() - start, self._timeout))
+            raise
+        elapsed = time.monotonic() - start
+        self.tracker.record(self.site, elapsed)
+        get_metrics().observe("browser_wait_seconds", elapsed, site=self.site)
+        return value
+
+
+def first_of(*conditions: Callable) -> Callable:
+    """
+    Race expected conditions in a single wait instead of trying them one after the other
+
+    :param conditions: expected conditions
+    :return: condition returning (index of the condition met, its value)
+    """
+
+    def condition(driver) -> Optional[Tuple[int, object]]:
+        for index, expected_condition in enumerate(conditions):
+            try:
+                value = expected_condition(driver)
+            except (NoSuchElementException, StaleElementReferenceException):
+                continue
+            if value:
+                return index, value
+        return None
+
+    return condition
+
+
+def endpoint_site(url: str) -> str:
+    """
+    Site of an api url, ids and course slugs are replaced so every course shares the samples of the endpoint
+
+    :param str url: requested url
+    :return: name of the site
+    """
+    return "api:" + SLUG_IN_PATH_PATTERN.sub("{slug}", ID_IN_PATH_PATTERN.sub("{id}", urlparse(url).path))
+
+
+class AdaptiveTimeoutAdapter(BaseAdapter):
+    """
+    Transport adapter recording the latency of every endpoint and giving requests sent without
+    a timeout one learned from it. Wraps another adapter, so it composes with RateLimitedAdapter
+    """
+
+    def __init__(
+            self,
+            adapter: Optional[BaseAdapter] = None,
+            tracker: Optional[LatencyTracker] = None,
+            default_timeout: float = DEFAULT_API_TIMEOUT,
+    ):
+        super().__init__()
+        self.adapter = adapter or HTTPAdapter()
+        self.tracker = tracker or get_latency_tracker()
+        self.default_timeout = default_timeout
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        site = endpoint_site(request.url)
+        if timeout is None:
+            timeout = self.tracker.timeout(site, self.default_timeout, MIN_API_TIMEOUT)
+        start = time.monotonic()
+        try:
+            response = self.adapter.send(
+                request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+            )
+        except requests.Timeout:
+            # a (connect, read) tuple bounds every read, the read timeout is the one learned
+            read_timeout = timeout[-1] if isinstance(timeout, tuple) else timeout
+            self.tracker.record_timeout(site, max(time.monotonic() - start, read_timeout or 0))
+            raise
+        # slow server errors count too, a gateway timeout says as much about the endpoint as a slow answer
+        self.tracker.record(site, response.elapsed.total_seconds())
+        return response
+
+    def close(self):
+        self.adapter.close()
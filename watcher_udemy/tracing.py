@@ -0,0 +1,248 @@
+import atexit
+import contextvars
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from requests.adapters import BaseAdapter
+
+from watcher_udemy.logging import get_logger
+from watcher_udemy.profiling import get_profiler
+
+logger = get_logger()
+
+# Environment variables turning tracing on, the cli flags set them
+TRACE_ENV = "WATCHER_UDEMY_TRACE"
+TRACE_SAMPLE_ENV = "WATCHER_UDEMY_TRACE_SAMPLE"
+
+# Events buffered before they are appended to the trace file
+FLUSH_EVENTS = 1000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("watcher_udemy_span", default=None)
+
+
+def _now_us() -> int:
+    # wall clock, so the traces of the account processes line up when opened together
+    return time.time_ns() // 1000
+
+
+class Tracer:
+    """
+    Writes spans as Chrome trace events, a json array Perfetto and chrome://tracing open.
+    Events are appended to the file as they come, so a long run never holds its trace in memory.
+    Every root span (a course, a login...) is kept with the sample rate probability, with all its children
+    """
+
+    def __init__(self, file_name: str, sample_rate: float = 1.0):
+        """
+        :param str file_name: trace file, suffixed with the pid in the worker processes of the accounts
+        :param float sample_rate: share of the root spans traced, between 0 and 1
+        """
+        if multiprocessing.parent_process() is not None:
+            root, extension = os.path.splitext(file_name)
+            file_name = f"{root}.{os.getpid()}{extension}"
+        self.file_name = file_name
+        self.sample_rate = sample_rate
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._named_threads = set()
+        self._trace_ids = itertools.count(1)
+        self._file = open(file_name, "w")
+        self._file.write("[")
+        self._written = 0
+        self.events = 0
+        self._buffer.append({
+            "name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+            "args": {"name": f"watcher_udemy {self.pid}"},
+        })
+
+    def sample(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def next_trace_id(self) -> int:
+        return next(self._trace_ids)
+
+    def emit(self, name: str, category: str, start_us: int, duration_us: int, args: Dict) -> None:
+        thread = threading.current_thread()
+        tid = thread.native_id
+        with self._lock:
+            if tid not in self._named_threads:
+                self._named_threads.add(tid)
+                self._buffer.append({
+                    "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": thread.name},
+                })
+            self._buffer.append({
+                "name": name, "cat": category, "ph": "X", "ts": start_us, "dur": duration_us,
+                "pid": self.pid, "tid": tid, "args": args,
+            })
+            self.events += 1
+            if len(self._buffer) >= FLUSH_EVENTS:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._file.closed:
+            return
+        for event in self._buffer:
+            self._file.write(("\n" if not self._written else ",\n") + json.dumps(event, default=str))
+            self._written += 1
+        self._buffer.clear()
+        self._file.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._flush()
+            self._file.write("\n]\n")
+            self._file.close()
+        logger.info(f"Wrote {self.events} trace events to {self.file_name}")
+
+
+class Span:
+    """
+    Timed section of the run, child of the span current when it was entered
+    """
+
+    __slots__ = ("tracer", "name", "category", "args", "trace_id", "sampled", "start_us", "_token")
+
+    def __init__(self, tracer: Tracer, name: str, category: str, args: Dict, trace_id: int, sampled: bool):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.start_us = 0
+        self._token = None
+
+    def set(self, **args) -> None:
+        """
+        Add arguments to the span, shown with it in the trace viewer
+        """
+        self.args.update(args)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self.start_us = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        _current_span.reset(self._token)
+        if self.sampled:
+            if exc_type is not None:
+                self.args["error"] = exc_type.__name__
+            self.args["trace"] = self.trace_id
+            self.tracer.emit(self.name, self.category, self.start_us, _now_us() - self.start_us, self.args)
+        return False
+
+
+class _NoSpan:
+    """
+    Span used when tracing is off, entering it costs nothing
+    """
+
+    def set(self, **args) -> None:
+        pass
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+_tracer: Optional[Tracer] = None
+_tracer_checked = False
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Optional[Tracer]:
+    """
+    Tracer of the process, None unless the WATCHER_UDEMY_TRACE environment variable names a trace file
+    """
+    global _tracer, _tracer_checked
+    if _tracer_checked:
+        return _tracer
+    with _tracer_lock:
+        if not _tracer_checked:
+            if file_name := os.environ.get(TRACE_ENV):
+                _tracer = Tracer(file_name, float(os.environ.get(TRACE_SAMPLE_ENV) or 1.0))
+                atexit.register(_tracer.close)
+                logger.info(f"Tracing {_tracer.sample_rate:.0%} of the courses to {_tracer.file_name}")
+            _tracer_checked = True
+    return _tracer
+
+
+def span(name: str, category: str = "run", **args):
+    """
+    Open a span, a root span when no span is current, whose sampling decides for all its children
+
+    :param str name: name shown in the trace viewer
+    :param str category: category of the span: course, phase, http, browser, scraper...
+    :param args: arguments shown with the span
+    :return: context manager of the span
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        return NO_SPAN
+    parent = _current_span.get()
+    if parent is None:
+        return Span(tracer, name, category, args, tracer.next_trace_id(), tracer.sample())
+    # children of a dropped trace still nest, so their own children know they are dropped
+    return Span(tracer, name, category, args, parent.trace_id, parent.sampled)
+
+
+def propagate(function: Callable) -> Callable:
+    """
+    Run a function submitted to a thread pool under the span current at submission, and in the
+    profile of the current phase, thread pools don't carry the context of the caller over
+
+    :param function: function given to the executor
+    :return: the wrapped function
+    """
+    if (profiler := get_profiler()) is not None:
+        function = profiler.wrap(function)
+    if get_tracer() is None:
+        return function
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # a context can't be entered by two threads at once, every call gets its own copy
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+class TracingAdapter(BaseAdapter):
+    """
+    Transport adapter opening a span for every request, under the span of the course or phase sending it
+    """
+
+    def __init__(self, adapter: BaseAdapter):
+        super().__init__()
+        self.adapter = adapter
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        from watcher_udemy.timeouts import endpoint_site
+
+        with span(endpoint_site(request.url)[len("api:"):], "http", method=request.method, url=request.url) as s:
+            response = self.adapter.send(
+                request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+            )
+            s.set(status=response.status_code)
+        return response
+
+    def close(self):
+        self.adapter.close()
@@ -4,26 +4,40 @@ import random
 import re
 
 import time
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
-from typing import List, Dict, Optional
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
 
 import requests
-from price_parser import Price
+from requests.adapters import HTTPAdapter
 from regex import regex
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, StaleElementReferenceException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.remote.webdriver import WebDriver, WebElement
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 
-from watcher_udemy.exceptions import LoginException, RobotException, CourseNotFoundException
+from watcher_udemy.answer_store import ANSWER_FIELDS, AnswerKeyStore
+from watcher_udemy.assessments import AssessmentRecord
+from watcher_udemy.catalogue import COURSE_FIELDS, CourseCatalogue, catalogue_file_name
+from watcher_udemy.codec import decode_page, response_json
+from watcher_udemy.curriculum import CURRICULUM_FIELDS, CurriculumDelta, compute_delta
+from watcher_udemy.driver_manager import DriverManager
+from watcher_udemy.exceptions import AnswerKeyException, LoginException, RobotException, CourseNotFoundException
 from watcher_udemy.logging import get_logger
+from watcher_udemy.metrics import MetricsAdapter, get_metrics, phase
+from watcher_udemy.prefilter import UNWANTED_CATEGORY, UNWANTED_LANGUAGE, CoursePrefilter
+from watcher_udemy.profiling import register_queue
+from watcher_udemy.ratelimit import THROTTLE_RETRY, RateLimitedAdapter, RateLimiter
+from watcher_udemy.recording import RECORD_ENV, REPLAY_ENV, REPLAY_SCALE_ENV, RecordingAdapter, ReplayAdapter
+from watcher_udemy.resolver import CourseResolver
 from watcher_udemy.settings import Settings
+from watcher_udemy.timeouts import AdaptiveTimeoutAdapter, AdaptiveWait, first_of
+from watcher_udemy.tracing import TracingAdapter, get_tracer, propagate
 from watcher_udemy.utils import get_app_dir, validateJSON
 
 logger = get_logger()
@@ -39,6 +53,10 @@ class RunStatistics:
     unwanted_language: int = 0
     unwanted_category: int = 0
 
+    courses_completed: int = 0
+    courses_failed: int = 0
+    browser_restarts: int = 0
+
     start_time = None
 
     currency_symbol = None
@@ -46,26 +64,78 @@ class RunStatistics:
     def savings(self):
         return sum(self.prices) or 0
 
+    def run_time_seconds(self) -> int:
+        if self.start_time is None:
+            return 0
+        return int((datetime.utcnow() - self.start_time).total_seconds())
+
+    def to_dict(self) -> Dict:
+        """
+        Plain representation of the statistics, used to send them across processes
+
+        :return: dictionary of the counters and the run time
+        """
+        return {
+            "expired": self.expired,
+            "enrolled": self.enrolled,
+            "already_enrolled": self.already_enrolled,
+            "unwanted_language": self.unwanted_language,
+            "unwanted_category": self.unwanted_category,
+            "courses_completed": self.courses_completed,
+            "courses_failed": self.courses_failed,
+            "browser_restarts": self.browser_restarts,
+            "run_time_seconds": self.run_time_seconds(),
+        }
+
+    def merge(self, other: Dict) -> None:
+        """
+        Add the counters of another run, as returned by to_dict
+
+        :param dict other: statistics of the other run
+        :return: None
+        """
+        for counter in (
+                "expired",
+                "enrolled",
+                "already_enrolled",
+                "unwanted_language",
+                "unwanted_category",
+                "courses_completed",
+                "courses_failed",
+                "browser_restarts",
+        ):
+            setattr(self, counter, getattr(self, counter) + other.get(counter, 0))
+
+    def courses_per_hour(self) -> float:
+        if self.start_time is None:
+            return 0.0
+        run_time_seconds = (datetime.utcnow() - self.start_time).total_seconds()
+        return self.courses_completed / run_time_seconds * 3600 if run_time_seconds else 0.0
+
     def table(self):
-        # Only show the table if we have something to show
+        if self.currency_symbol is None:
+            self.currency_symbol = "¤"
+
+        logger.info("==================Run Statistics==================")
+        logger.info(f"Enrolled:                   {self.enrolled}")
+        logger.info(f"Unwanted Category:          {self.unwanted_category}")
+        logger.info(f"Unwanted Language:          {self.unwanted_language}")
+        logger.info(f"Already Claimed:            {self.already_enrolled}")
+        logger.info(f"Expired:                    {self.expired}")
+        logger.info(f"Courses completed:          {self.courses_completed}")
+        logger.info(f"Courses failed:             {self.courses_failed}")
+        logger.info(f"Browser restarts:           {self.browser_restarts}")
         if self.prices:
-            if self.currency_symbol is None:
-                self.currency_symbol = "¤"
-            run_time_seconds = int(
-                (datetime.utcnow() - self.start_time).total_seconds()
-            )
-
-            logger.info("==================Run Statistics==================")
-            logger.info(f"Enrolled:                   {self.enrolled}")
-            logger.info(f"Unwanted Category:          {self.unwanted_category}")
-            logger.info(f"Unwanted Language:          {self.unwanted_language}")
-            logger.info(f"Already Claimed:            {self.already_enrolled}")
-            logger.info(f"Expired:                    {self.expired}")
             logger.info(
                 f"Savings:                    {self.currency_symbol}{self.savings():.2f}"
             )
-            logger.info(f"Total run time (seconds):   {run_time_seconds}s")
-            logger.info("==================Run Statistics==================")
+        logger.info(f"Courses/hour:               {self.courses_per_hour():.1f}")
+        for phase_name, (count, seconds) in sorted(get_metrics().phase_summary().items()):
+            logger.info(f"{phase_name + ' (seconds):':<28}{seconds:.1f}s over {count}")
+        for cache, rate in sorted(get_metrics().cache_hit_rates().items()):
+            logger.info(f"{cache + ' hit rate:':<28}{rate:.0%}")
+        logger.info(f"Total run time (seconds):   {self.run_time_seconds()}s")
+        logger.info("==================Run Statistics==================")
 
 
 class UdemyStatus(Enum):
@@ -86,23 +156,71 @@ class UdemyActionsUI:
     Contains any logic related to interacting with udemy website
     """
 
-    def __init__(self, driver: WebDriver, settings: Settings, cookie_file_name: str = ".cookie"):
+    # Log in again with the credentials when the cached access token expires within this many seconds
+    TOKEN_REFRESH_MARGIN = 24 * 60 * 60
+    AUTH_COOKIE_NAMES = ("csrftoken", "client_id", "access_token")
+
+    def __init__(
+            self,
+            driver: WebDriver,
+            settings: Settings,
+            cookie_file_name: str = ".cookie",
+            rate_limiter: Optional[RateLimiter] = None,
+            api_base_url: Optional[str] = None,
+            driver_manager: Optional[DriverManager] = None,
+    ):
+        """
+        :param WebDriver driver: WebDriver used by the flows that need the browser, None to take it from driver_manager
+        :param Settings settings: Core settings used for Udemy
+        :param str cookie_file_name: Name of the cookie file in the app directory
+        :param RateLimiter rate_limiter: Optional request budget shared with other accounts of the domain
+        :param str api_base_url: Send the api requests there instead of the udemy domain, e.g. to a local
+            mock server. Defaults to the WATCHER_UDEMY_API_BASE_URL environment variable
+        :param DriverManager driver_manager: Starts the browser the first time a flow needs it, when driver is None
+        """
 
+        self._driver_needs_cookies = False
+        self._driver_manager = driver_manager
         self.driver = driver
         self.settings = settings
         self.DOMAIN = settings.domain
         self.logged_in = False
         self.stats = RunStatistics()
         self.session = requests.Session()
+        # requests sent without a timeout get one learned from the latency of their endpoint
+        if replay_file := os.environ.get(REPLAY_ENV):
+            # offline run answered from a recording, see --replay
+            transport = ReplayAdapter(replay_file, float(os.environ.get(REPLAY_SCALE_ENV) or 1.0))
+        else:
+            transport = (
+                RateLimitedAdapter(rate_limiter, max_retries=THROTTLE_RETRY) if rate_limiter is not None
+                else HTTPAdapter(max_retries=THROTTLE_RETRY)
+            )
+            if record_file := os.environ.get(RECORD_ENV):
+                transport = RecordingAdapter(transport, record_file, {"domain": self.DOMAIN})
+        transport = MetricsAdapter(transport)
+        if get_tracer() is not None:
+            transport = TracingAdapter(transport)
+        adapter = AdaptiveTimeoutAdapter(transport)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.stats.start_time = datetime.utcnow()
         self._cookie_file = os.path.join(get_app_dir(), cookie_file_name)
-        self.already_rolled_courses = []
+        # dict used as an ordered set, so membership checks don't scan the list
+        self.already_rolled_courses: Dict[int, None] = {}
+        self.answer_store = AnswerKeyStore()
+        self.catalogue = CourseCatalogue(catalogue_file_name(cookie_file_name, self.DOMAIN))
+
+        self.API_BASE_URL = (
+                api_base_url or os.environ.get("WATCHER_UDEMY_API_BASE_URL") or f"https://{self.DOMAIN}.udemy.com"
+        ).rstrip("/")
 
         self.URL_TO_COURSE_ID = f"https://{self.DOMAIN}.udemy.com/course/{{}}/"
+        self.VALIDATE_TOKEN_URL = f"{self.API_BASE_URL}/api-2.0/users/me/?fields[user]=id"
         self.URL_COURSE_NO_API = f"https://{self.DOMAIN}.udemy.com/course/{{course_id}}/"
         self.URL_QUIZ_NOAPI = f"https://{self.DOMAIN}.udemy.com/course/{{url_no_id}}/learn/quiz/{{assessment_id}}#overview"
         self.URL_QUIZ_MULTIPLE_NOAPI = f"https://{self.DOMAIN}.udemy.com/course/{{url_no_id}}/learn/quiz/{{assessment_id}}/test#overview"
-        self.URL_GET_ALREADY_DONE_ASSESSMENTS = f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/{{course_id}}/user-attempted-quizzes/"
+        self.URL_GET_ALREADY_DONE_ASSESSMENTS = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{course_id}}/user-attempted-quizzes/"
 
         self.HEADERS = {
             "origin": f"https://{self.DOMAIN}.udemy.com/",
@@ -115,27 +233,42 @@ class UdemyActionsUI:
             "authority": f"{self.DOMAIN}.udemy.com"
         }
         self.COURSE_DETAILS = (
-            f"https://{self.DOMAIN}.udemy.com/api-2.0/courses/{{}}/?fields[course]=title,url,context_info,primary_category,primary_subcategory,avg_rating_recent,visible_instructors,locale,estimated_content_length,num_subscribers,num_quizzes,num_lectures,completion_ratio"
+            f"{self.API_BASE_URL}/api-2.0/courses/{{}}/?fields[course]=title,url,context_info,primary_category,primary_subcategory,avg_rating_recent,visible_instructors,locale,estimated_content_length,num_subscribers,num_quizzes,num_lectures,completion_ratio"
         )
         self.ENROLLED_COURSES_URL = (
-            f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/?&progress_filter=in-progress&page_size=1400")
-
-        self.REQUEST_URL_NUM_LECTURES = f"https://{self.DOMAIN}.udemy.com/api-2.0/courses/{{}}/?fields[course]=title,num_lectures,completion_ratio"
-        self.REQUEST_URL_NUM_QUIZZES = f"https://{self.DOMAIN}.udemy.com/api-2.0/courses/{{}}/?fields[course]=num_quizzes"
-        self.REQUEST_URL_URL = f"https://{self.DOMAIN}.udemy.com/api-2.0/courses/{{}}/?fields[course]=url"
-        self.REQUEST_LECTURES = f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/{{}}/lectures"
-        self.QUIZ_URL = f"https://{self.DOMAIN}.udemy.com/api-2.0/courses/{{}}/subscriber-curriculum-items/?page_size=1400&fields[lecture]=title,object_index,is_published,sort_order,created,asset,supplementary_assets,is_free&fields[quiz]=title,object_index,is_published,sort_order,type&fields[practice]=title,object_index,is_published,sort_order&fields[chapter]=title,object_index,is_published,sort_order&fields[asset]=title,filename,asset_type,status,time_estimation,is_external&caching_intent=Truefields[course]=title,url,context_info,primary_category,primary_subcategory,avg_rating_recent,visible_instructors,locale,estimated_content_length,num_subscribers,num_quizzes,num_lectures,completion_ratio"
-        self.RESPONSES_URL = f"https://{self.DOMAIN}.udemy.com/api-2.0/quizzes/{{}}/assessments/?version=1&page_size=1400&fields[assessment]=id,assessment_type,prompt,correct_response,section,question_plain,related_lectures"
-        self.COMPLETED_QUIZ_IDS = f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/359550/progress/?page_size=1400&fields[course]=completed_lecture_ids,completed_quiz_ids,last_seen_page,completed_assignment_ids,first_completion_time"
-        # self.BOH = f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/359550/quizzes/95416/?draft=false&fields[quiz]=id,type,title,description,object_index,num_assessments,version,duration,is_draft,pass_percent,changelog"
+            f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/?&progress_filter=in-progress&page_size=1400&fields[course]=id,url,title,completion_ratio,num_lectures,num_quizzes")
+        self.NEWEST_ENROLLED_COURSES_URL = (
+            f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/?ordering=-enroll_time&page_size=50&fields[course]=id,url,completion_ratio")
+        self.RECENTLY_ACCESSED_COURSES_URL = (
+            f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/?ordering=-last_accessed&page_size=50&fields[course]=id,url,completion_ratio,last_accessed_time")
+
+        self.REQUEST_URL_NUM_LECTURES = f"{self.API_BASE_URL}/api-2.0/courses/{{}}/?fields[course]=title,num_lectures,completion_ratio"
+        self.REQUEST_URL_NUM_QUIZZES = f"{self.API_BASE_URL}/api-2.0/courses/{{}}/?fields[course]=num_quizzes"
+        self.REQUEST_URL_URL = f"{self.API_BASE_URL}/api-2.0/courses/{{}}/?fields[course]=url"
+        # the courses endpoint takes either the id or the slug of a course
+        self.COURSE_ID_FROM_SLUG = f"{self.API_BASE_URL}/api-2.0/courses/{{}}/?fields[course]=id"
+        self.SUBSCRIBED_COURSE_URL = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{}}/?fields[course]=id"
+        self.SUBSCRIBE_URL = f"{self.API_BASE_URL}/course/subscribe/?courseId={{}}"
+        self.COURSE_METADATA_URL = f"{self.API_BASE_URL}/api-2.0/courses/{{}}/?fields[course]=id,locale,primary_category,primary_subcategory"
+        self.REQUEST_LECTURES = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{}}/lectures"
+        self.QUIZ_URL = f"{self.API_BASE_URL}/api-2.0/courses/{{}}/subscriber-curriculum-items/?page_size=1400&fields[lecture]=title,object_index,is_published,sort_order,created,asset,supplementary_assets,is_free&fields[quiz]=title,object_index,is_published,sort_order,type,version&fields[practice]=title,object_index,is_published,sort_order&fields[chapter]=title,object_index,is_published,sort_order&fields[asset]=title,filename,asset_type,status,time_estimation,is_external&caching_intent=Truefields[course]=title,url,context_info,primary_category,primary_subcategory,avg_rating_recent,visible_instructors,locale,estimated_content_length,num_subscribers,num_quizzes,num_lectures,completion_ratio"
+        self.RESPONSES_URL = f"{self.API_BASE_URL}/api-2.0/quizzes/{{quiz_id}}/assessments/?version={{version}}&page_size=1400&fields[assessment]=id,assessment_type,prompt,correct_response,section,question_plain,related_lectures"
+        self.COMPLETED_QUIZ_IDS = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{course_id}}/progress/?page_size=1400&fields[course]=completed_lecture_ids,completed_quiz_ids,last_seen_page,completed_assignment_ids,first_completion_time"
+        # self.BOH = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/359550/quizzes/95416/?draft=false&fields[quiz]=id,type,title,description,object_index,num_assessments,version,duration,is_draft,pass_percent,changelog"
         self.URL_SEND_RESPONSE = (
-            f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/{{course_id}}/user-attempted-quizzes/{{quiz_id}}/assessment-answers/")
+            f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{course_id}}/user-attempted-quizzes/{{quiz_id}}/assessment-answers/")
         self.URL_SEND_RESPONSE_MULTIPLE = (
-            f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/{{course_id}}/quizzes/{{quiz_id}}/user-attempted-quizzes/{{assessment_initial_id}}/")
+            f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{course_id}}/quizzes/{{quiz_id}}/user-attempted-quizzes/{{assessment_initial_id}}/")
 
-        self.LAST_ID_QUIZ = f"https://{self.DOMAIN}.udemy.com/api-2.0/users/me/subscribed-courses/{{course_id}}/quizzes/{{quiz_id}}/user-attempted-quizzes/latest"
+        self.LAST_ID_QUIZ = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{course_id}}/quizzes/{{quiz_id}}/user-attempted-quizzes/latest"
         # https://business-learning.udemy.com/api-2.0/users/me/subscribed-courses/629302/quizzes
 
+        self.resolver = CourseResolver(self.session, self.DOMAIN, self.COURSE_ID_FROM_SLUG, self.catalogue)
+        self.prefilter = CoursePrefilter(
+            self.session, self.COURSE_METADATA_URL, self.catalogue, settings.languages, settings.categories
+        )
+
+    @phase("login")
     def login(self, is_retry=False) -> None:
         """
         Login to your udemy account
@@ -145,6 +278,8 @@ class UdemyActionsUI:
         :return: None
         """
         if not self.logged_in:
+            if not is_retry and self._fast_login():
+                return
             cookie_details = self._load_cookies()
 
             if cookie_details is None:
@@ -159,7 +294,7 @@ class UdemyActionsUI:
                 try:
                     xpath_email = '//*[@id="credsDiv"]'
                     try:
-                        button = WebDriverWait(self.driver, 10).until(
+                        button = AdaptiveWait(self.driver, "login:creds", 10).until(
                             EC.presence_of_element_located((By.XPATH, xpath_email))
                         )
                     except TimeoutException:
@@ -168,20 +303,20 @@ class UdemyActionsUI:
                     button.click()
                     try:
                         input_email = "user-name-input"
-                        button = WebDriverWait(self.driver, 10).until(
+                        button = AdaptiveWait(self.driver, "login:user-name-input", 10).until(
                             EC.presence_of_element_located((By.ID, input_email))
                         )
                         button.click()
                         email_element = self.driver.find_element(By.ID, input_email)
                         email_element.send_keys(self.settings.email)
-                        WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((By.NAME, "checkbox1_lbl"))
+                        AdaptiveWait(self.driver, "login:remember-me", 10).until(EC.element_to_be_clickable((By.NAME, "checkbox1_lbl"))
                                                              )
                         password_element = self.driver.find_element(By.NAME,"password")
                         password_element.send_keys(self.settings.password)
                         remind_button = self.driver.find_element(By.NAME,"checkbox1_lbl")
                         remind_button.click()
 
-                        login_button = WebDriverWait(self.driver, 10).until(
+                        login_button = AdaptiveWait(self.driver, "login:login-button", 10).until(
                             EC.element_to_be_clickable((By.ID, "login-button"))
                         )
 
@@ -189,7 +324,7 @@ class UdemyActionsUI:
                         # if
                         # else
                         try:
-                            one_timepasscodeinput = WebDriverWait(self.driver, 10).until(
+                            one_timepasscodeinput = AdaptiveWait(self.driver, "login:otp-input", 10).until(
                                 EC.presence_of_element_located((By.ID, "otp-input"))
                             )
                             if one_timepasscodeinput:
@@ -204,15 +339,7 @@ class UdemyActionsUI:
                         except TimeoutException:
                             logger.info("No otp found")
                             pass
-                        cookie_details = self.driver.get_cookies()
-                        refactored_cookies = []
-                        for cookie in cookie_details:
-                            if cookie.get('name') == 'csrftoken' \
-                                    or cookie.get('name') == 'client_id' \
-                                    or cookie.get('name') == 'access_token':
-                                refactored_cookies.append(cookie)
-                        print(refactored_cookies)
-                        self._cache_cookies(refactored_cookies)
+                        self._cache_cookies(self._filter_auth_cookies(self.driver.get_cookies()))
 
                         # check if file is empty
                         if os.stat(self._cookie_file).st_size == 0:
@@ -235,7 +362,7 @@ class UdemyActionsUI:
                 else:
                     user_dropdown_xpath = "//a[@data-purpose='user-dropdown']"
                     try:
-                        WebDriverWait(self.driver, 10).until(
+                        AdaptiveWait(self.driver, "login:user-dropdown", 10).until(
                             EC.presence_of_element_located((By.XPATH, user_dropdown_xpath))
                         )
                     except TimeoutException:
@@ -252,15 +379,11 @@ class UdemyActionsUI:
 
 
             else:
-                # hitting a fake url of doamin to load the cookies
-                dummy_url = '404error'
-                self.driver.get(f"https://{self.DOMAIN}.udemy.com//{dummy_url}")
-                for cookie in cookie_details:
-                    self.driver.add_cookie(cookie)
+                self._add_cookies_to_driver(cookie_details)
                 self.driver.get(f"https://{self.DOMAIN}.udemy.com")
 
             try:
-                WebDriverWait(self.driver, 30).until(
+                AdaptiveWait(self.driver, "login:home", 30).until(
                     EC.presence_of_element_located((By.ID, self.DOMAIN))
                 )
                 logger.info("Logged in to udemy, trying to retrieve button")
@@ -271,26 +394,117 @@ class UdemyActionsUI:
             except StaleElementReferenceException as e:
                 pass
 
-            # for cookie in self._load_cookies():
-            #     self.session.cookies.set(cookie['name'], cookie['value'])
-            for cookie in self.driver.get_cookies():
-                self.session.cookies.set(cookie['name'], cookie['value'])
-            bearer_token = None
-
-            for x in self._load_cookies():
-                bearer_token = x if x.get('name') == 'access_token' else bearer_token
-            logger.info(f"printing bearer token {bearer_token}")
-
-            self.session.headers = self.HEADERS
-            if bearer_token is not None:
-                bearer_string = f"Bearer {bearer_token['value']}"
-                self.session.headers.update(
-                    {
-                        "authorization": bearer_string,
-                        "x-udemy-authorization": bearer_string,
-                        "x-csrftoken": bearer_token['value'],
-                    }
-                )
+            if cookie_details is not None:
+                # the browser may have rotated the token, cache it again with its new expiry
+                self._cache_cookies(self._filter_auth_cookies(self.driver.get_cookies()))
+            self._build_session(self.driver.get_cookies())
+
+    def _fast_login(self) -> bool:
+        """
+        Login without the browser by validating the cached access token with a single api call
+
+        :return: True if the cached token is valid and the session is ready to use
+        """
+        cookie_cache = self._load_cookie_cache()
+        if not cookie_cache or not cookie_cache.get("cookies"):
+            return False
+        expiry = cookie_cache.get("access_token_expiry")
+        if expiry is not None and expiry - time.time() < self.TOKEN_REFRESH_MARGIN:
+            logger.info("Cached access token is about to expire, logging in again with the credentials")
+            # the browser would only be handed the cached cookies back, the token and its expiry wouldn't change
+            self._delete_cookies()
+            return False
+
+        self._build_session(cookie_cache["cookies"])
+        try:
+            response = self.session.get(self.VALIDATE_TOKEN_URL, timeout=10)
+        except requests.RequestException as e:
+            logger.warning(f"Couldn't validate the cached access token: {e}")
+            return False
+        if response.status_code in (401, 403):
+            logger.info("Cached access token has been rejected, logging in again")
+            self._delete_cookies()
+            return False
+        try:
+            user_id = response_json(response).get("id") if response.status_code == 200 else None
+        except (ValueError, AttributeError):
+            user_id = None
+        if not user_id:
+            logger.info(f"Cached access token validation failed with status {response.status_code}")
+            return False
+
+        cookie_cache["validated_at"] = time.time()
+        self._write_cookie_cache(cookie_cache)
+        logger.info("Logged in to udemy with the cached access token")
+        self.logged_in = True
+        # the browser only gets the cookies once a flow actually needs it
+        self._driver_needs_cookies = True
+        return True
+
+    def _build_session(self, cookies: List[Dict]) -> None:
+        """
+        Set up the requests session with the cookies and the bearer token of the logged in user
+
+        :param list cookies: cookies to add to the session
+        :return: None
+        """
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'])
+        bearer_token = None
+
+        # cookies passed in win over the cached ones as the browser may have rotated the token
+        for x in (self._load_cookies() or []) + list(cookies):
+            bearer_token = x if x.get('name') == 'access_token' else bearer_token
+
+        self.session.headers = dict(self.HEADERS)
+        if bearer_token is not None:
+            bearer_string = f"Bearer {bearer_token['value']}"
+            self.session.headers.update(
+                {
+                    "authorization": bearer_string,
+                    "x-udemy-authorization": bearer_string,
+                    "x-csrftoken": bearer_token['value'],
+                }
+            )
+
+    @property
+    def driver(self) -> WebDriver:
+        if self._driver is None and self._driver_manager is not None:
+            # runs that stay on the api never start the browser
+            self._driver = self._driver_manager.driver
+        if self._driver_needs_cookies and self._driver is not None:
+            self._driver_needs_cookies = False
+            self._add_cookies_to_driver(self._load_cookies())
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver: WebDriver) -> None:
+        self._driver = driver
+
+    def ensure_driver_session(self) -> WebDriver:
+        """
+        Make sure the browser carries the session cookies, needed after a login that skipped the browser
+
+        :return: the logged in driver
+        """
+        return self.driver
+
+    def _add_cookies_to_driver(self, cookies: List[Dict]) -> None:
+        """
+        Load the cookies into the browser
+
+        :param list cookies: cookies to load
+        :return: None
+        """
+        driver = self._driver if self._driver is not None else self.driver
+        # hitting a fake url of doamin to load the cookies
+        dummy_url = '404error'
+        driver.get(f"https://{self.DOMAIN}.udemy.com//{dummy_url}")
+        for cookie in cookies:
+            driver.add_cookie(cookie)
+
+    def _filter_auth_cookies(self, cookies: List[Dict]) -> List[Dict]:
+        return [cookie for cookie in cookies if cookie.get('name') in self.AUTH_COOKIE_NAMES]
 
     def _get_course_quizzes_number(self, course_id):
         """
@@ -306,32 +520,61 @@ class UdemyActionsUI:
         else:
             return -1
 
-    def enroll(self, url: str) -> tuple:
+    @phase("triage")
+    def _prefilter_courses(self, course_ids: List[int]) -> Dict[int, Optional[str]]:
+        """
+        Check the language and category filters of courses against their api metadata, counting the rejected ones
+
+        :param list course_ids: ids of the courses
+        :return: course id -> UNWANTED_LANGUAGE, UNWANTED_CATEGORY or None if the course is wanted or unknown
+        """
+        verdicts = self.prefilter.check(course_ids)
+        for course_id, verdict in verdicts.items():
+            if verdict == UNWANTED_LANGUAGE:
+                logger.info(f"Course {course_id} language not wanted")
+                self.stats.unwanted_language += 1
+            elif verdict == UNWANTED_CATEGORY:
+                logger.info(f"Skipping course {course_id} as it does not have a wanted category")
+                self.stats.unwanted_category += 1
+        return verdicts
+
+    @phase("enroll")
+    def enroll(self, url: str, prefiltered: bool = False) -> tuple:
         """
         Redeems the course url passed in
 
         :param str url: URL of the course to redeem
+        :param bool prefiltered: The course already passed the language and category filters
         :return: A string detailing course status
         """
         logger.info("Enrolling in course url {}".format(url))
+        if not prefiltered and self.prefilter.enabled and (course_id := self.resolver.resolve_one(url)):
+            # the api answers the filters without loading the course page
+            verdict = self._prefilter_courses([course_id])[course_id]
+            if verdict == UNWANTED_LANGUAGE:
+                return UdemyStatus.UNWANTED_LANGUAGE.value, None, None
+            if verdict == UNWANTED_CATEGORY:
+                return UdemyStatus.UNWANTED_CATEGORY.value, None, None
+            prefiltered = self.prefilter.is_known(course_id)
         self.driver.get(url)
         logger.info("Setting up course")
         course_name = self.driver.title
-        logger.info("Starting language check")
-        if not self._check_languages(course_name):
-            return UdemyStatus.UNWANTED_LANGUAGE.value, None, None
+        if not prefiltered:
+            logger.info("Starting language check")
+            if not self._check_languages(course_name):
+                return UdemyStatus.UNWANTED_LANGUAGE.value, None, None
 
-        logger.info("Check languages done")
-        logger.info("Starting categories check")
-        if not self._check_categories(course_name):
-            return UdemyStatus.UNWANTED_CATEGORY.value, None, None
-        logger.info("Check Categories done")
+            logger.info("Check languages done")
+            logger.info("Starting categories check")
+            if not self._check_categories(course_name):
+                return UdemyStatus.UNWANTED_CATEGORY.value, None, None
+            logger.info("Check Categories done")
 
         try:
             # check if element is present before clicking
             buy_course_button_xpath = "//button[@data-purpose='buy-this-course-button']"
             # We need to wait for this element to be clickable before checking if already purchased
-            WebDriverWait(self.driver, 10).until(
+            AdaptiveWait(self.driver, "enroll:buy-button", 10).until(
                 EC.element_to_be_clickable((By.XPATH, buy_course_button_xpath))
             )
 
@@ -344,7 +587,7 @@ class UdemyActionsUI:
             element_present = EC.presence_of_element_located(
                 (By.XPATH, buy_course_button_xpath)
             )
-            WebDriverWait(self.driver, 10).until(element_present).click()
+            AdaptiveWait(self.driver, "enroll:buy-button-present", 10).until(element_present).click()
 
             logger.info(f"Successfully enrolled in: '{course_name}'")
             self.stats.enrolled += 1
@@ -352,6 +595,63 @@ class UdemyActionsUI:
         logger.info(f"Course id: {course_id} and link: {cs_link}")
         return UdemyStatus.ALREADY_ENROLLED.value, cs_link, course_id
 
+    def _is_subscribed(self, course_id: int) -> bool:
+        return self.session.get(self.SUBSCRIBED_COURSE_URL.format(course_id), timeout=30).status_code == 200
+
+    def _api_enroll_course(self, course_id: int) -> str:
+        """
+        Enroll in a course through the subscribe endpoint, the entitlement call the buy button ends up doing
+
+        :param int course_id: Id of the course
+        :return: UdemyStatus value, NOTUNROLLED if the subscription couldn't be confirmed
+        """
+        try:
+            if self._is_subscribed(course_id):
+                return UdemyStatus.ALREADY_ENROLLED.value
+            self.session.get(self.SUBSCRIBE_URL.format(course_id), timeout=30)
+            if self._is_subscribed(course_id):
+                return UdemyStatus.ENROLLED.value
+        except requests.RequestException as e:
+            logger.warning(f"Api enrolment of course {course_id} failed: {e}")
+        return UdemyStatus.NOTUNROLLED.value
+
+    @phase("enroll")
+    def api_enroll(
+            self, course_ids: List[int], max_workers: int = 8, prefiltered: Collection[int] = ()
+    ) -> Dict[int, str]:
+        """
+        Enroll in courses concurrently through the api, after checking the language and category filters
+
+        :param list course_ids: Ids of the courses
+        :param int max_workers: Max number of enrolments running at the same time
+        :param prefiltered: Ids of the courses that don't go through the filters again
+        :return: course id -> UdemyStatus value
+        """
+        statuses = {}
+        to_enroll = []
+        verdicts = self._prefilter_courses([course_id for course_id in course_ids if course_id not in prefiltered])
+        for course_id in course_ids:
+            verdict = verdicts.get(course_id)
+            if verdict == UNWANTED_LANGUAGE:
+                statuses[course_id] = UdemyStatus.UNWANTED_LANGUAGE.value
+            elif verdict == UNWANTED_CATEGORY:
+                statuses[course_id] = UdemyStatus.UNWANTED_CATEGORY.value
+            else:
+                to_enroll.append(course_id)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            statuses.update(zip(to_enroll, executor.map(propagate(self._api_enroll_course), to_enroll)))
+        enrolled = [course_id for course_id in to_enroll if statuses[course_id] == UdemyStatus.ENROLLED.value]
+        self.stats.enrolled += len(enrolled)
+        # subscribed courses belong in the catalogue, their progress is fetched when they are processed
+        self.catalogue.upsert_courses(
+            {"id": course_id} for course_id in to_enroll if statuses[course_id] != UdemyStatus.NOTUNROLLED.value
+        )
+        logger.info(
+            f"Api enrolment of {len(course_ids)} courses: {len(enrolled)} enrolled, "
+            f"{sum(status == UdemyStatus.NOTUNROLLED.value for status in statuses.values())} left to the browser"
+        )
+        return statuses
+
     def _find_all_lectures(self, first_link_to) -> List[str]:
         logger.info(f"Finding all lectures in: '{first_link_to}'")
         resp_json_json = self._resp_from_url_with_session(first_link_to)
@@ -384,7 +684,7 @@ class UdemyActionsUI:
         )
         try:
             dummy_element = (
-                WebDriverWait(self.driver, 10)
+                AdaptiveWait(self.driver, "course:app-loader", 10)
                 .until(EC.presence_of_element_located((By.XPATH, dummy_elm_xpath))))
         except TimeoutException:
             return None
@@ -412,13 +712,14 @@ class UdemyActionsUI:
         list_of_links = self._find_all_lectures(course_link)
         next_lectures_lst = []
         for link in list_of_links:
-            resp_json_json = self._resp_from_url_with_session(link)
+            resp_json_json = self._resp_from_url_with_session(link, ("id",))
             for lecture in resp_json_json['results']:
                 next_lectures_lst.append(lecture['id'])
         return next_lectures_lst
 
-    def _resp_from_url_with_session(self, url: str):
-        return self.session.get(url).json()
+    def _resp_from_url_with_session(self, url: str, fields: Tuple[str, ...] = ()):
+        # only the next link is read unless fields of the results are asked for
+        return decode_page(self.session.get(url).content, fields)
 
     def _get_course_links_lectures(self, number_course_id: int) -> json:
         """
@@ -441,32 +742,51 @@ class UdemyActionsUI:
         links = [link.get_attribute('href') for link in links]
         return links
 
-    def _load_cookies(self) -> Dict:
+    def _load_cookies(self) -> Optional[List[Dict]]:
         """
         Loads existing cookie file
 
-        :return:
+        :return: list of cached cookies or None if there is no cache
+        """
+        cookie_cache = self._load_cookie_cache()
+        return cookie_cache["cookies"] if cookie_cache is not None else None
+
+    def _load_cookie_cache(self) -> Optional[Dict]:
+        """
+        Loads the cookie cache with its metadata
+
+        :return: dict with the cookies and the access token expiry, None if there is no cache
         """
-        cookies = None
+        cookie_cache = None
 
         if os.path.isfile(self._cookie_file):
             logger.info("Loading cookie from file")
             with open(self._cookie_file) as f:
-                cookies = json.loads(f.read())
+                cookie_cache = json.loads(f.read())
+            # older caches only contain the list of cookies
+            if isinstance(cookie_cache, list):
+                cookie_cache = {"cookies": cookie_cache, "access_token_expiry": None}
         else:
             logger.info("No cookie available")
-        return cookies
+        return cookie_cache
 
     def _cache_cookies(self, cookies: List) -> None:
         """
-        Caches cookies for future logins
+        Caches cookies for future logins, together with the access token expiry
 
         :param cookies:
         :return:
         """
         logger.info("Caching cookie for future use")
+        expiry = None
+        for cookie in cookies:
+            if cookie.get('name') == 'access_token' and cookie.get('expiry') is not None:
+                expiry = cookie['expiry']
+        self._write_cookie_cache({"cookies": cookies, "access_token_expiry": expiry, "validated_at": time.time()})
+
+    def _write_cookie_cache(self, cookie_cache: Dict) -> None:
         with open(self._cookie_file, "w") as f:
-            json.dump(cookies, f)
+            json.dump(cookie_cache, f)
 
     def _delete_cookies(self) -> None:
         """
@@ -483,7 +803,7 @@ class UdemyActionsUI:
             locale_xpath = "//div[@data-purpose='lead-course-locale']"
             try:
                 element_text = (
-                    WebDriverWait(self.driver, 10)
+                    AdaptiveWait(self.driver, "enroll:locale", 10)
                     .until(EC.presence_of_element_located((By.XPATH, locale_xpath)))
                     .text
                 )
@@ -526,6 +846,8 @@ class UdemyActionsUI:
         return is_valid_category
 
     def _check_price(self, course_name):
+        from price_parser import Price
+
         course_is_free = True
         price_xpath = "//div[contains(@data-purpose, 'total-amount-summary')]//span[2]"
         price_element = self.driver.find_element(By.XPATH,price_xpath)
@@ -578,6 +900,8 @@ class UdemyActionsUI:
         if (return_st := self._get_course_link_from_redirect(course_link, domain))[1]:
 
             return return_st[0], return_st[1]
+        elif (return_st := self.resolver.resolve_one(course_link)):
+            return self.REQUEST_LECTURES.format(return_st), return_st
         elif (return_st := self._get_course_id(course_link)):
             return self.REQUEST_LECTURES.format(return_st), return_st
 
@@ -601,87 +925,219 @@ class UdemyActionsUI:
 
     def _get_course_details(self, course_id: int):
         """
-        Retrieves details relating to the course passed in
+        Retrieves details relating to the course passed in, and records them in the catalogue
 
         :param int course_id: Id of the course to get the details of
         :return: dictionary containing the course details
         """
-        return self.session.get(self.COURSE_DETAILS.format(course_id)).json()
+        response = self.session.get(self.COURSE_DETAILS.format(course_id))
+        course_details = response_json(response)
+        if response.status_code == 200 and course_details.get('id') is not None:
+            self.catalogue.upsert_course(course_details)
+        return course_details
 
+    @phase("discovery")
     def _get_already_rolled_courses(self) -> List[int]:
         """
-        Retrieves the already enrolled courses
+        Retrieves the already enrolled courses and syncs them into the catalogue
         """
         logger.info("Getting already enrolled courses")
         list_of_links = self._find_all_lectures(self.ENROLLED_COURSES_URL)
         logger.info("Found {} enrolled courses pages".format(len(list_of_links)))
         for x in list_of_links:
             response = self.session.get(x)
-            resp_json = response.json()
+            resp_json = decode_page(response.content, COURSE_FIELDS)
 
             if response.status_code == 200:
                 if re_res := resp_json['results']:
+                    self.catalogue.upsert_courses(re_res)
                     for x in re_res:
-                        if x['id'] not in self.already_rolled_courses:
-                            self.already_rolled_courses.append(x['id'])
+                        self.already_rolled_courses[x['id']] = None
+
+        return list(self.already_rolled_courses)
 
-        return self.already_rolled_courses
+    def _iter_new_subscribed_courses(self, known_course_ids) -> Iterator[Dict]:
+        """
+        Walks the subscribed courses from the most recent enrolment and stops at the first page
+        holding an already known course, so an idle sync costs a single request
+
+        :param known_course_ids: Container of the ids of the courses seen by previous syncs
+        :return: generator of the subscribed courses not in known_course_ids
+        """
+        url = self.NEWEST_ENROLLED_COURSES_URL
+        while url:
+            response = self.session.get(url)
+            if response.status_code != 200:
+                logger.warning(f"Couldn't sync the subscribed courses, status {response.status_code}")
+                return
+            resp_json = decode_page(response.content, COURSE_FIELDS)
+            results = resp_json.get('results') or []
+            new_courses = [course for course in results if course['id'] not in known_course_ids]
+            yield from new_courses
+            if len(new_courses) < len(results):
+                return
+            url = resp_json.get('next')
+
+    def _iter_recently_accessed_courses(self, since: float) -> Iterator[Dict]:
+        """
+        Walks the subscribed courses from the most recently accessed one and stops at the first one
+        not accessed since the given time, so the progress made outside of the script is picked up
+
+        :param float since: Timestamp of the last sync
+        :return: generator of the courses accessed after since
+        """
+        url = self.RECENTLY_ACCESSED_COURSES_URL
+        while url:
+            response = self.session.get(url)
+            if response.status_code != 200:
+                logger.warning(f"Couldn't sync the recently accessed courses, status {response.status_code}")
+                return
+            resp_json = decode_page(response.content, COURSE_FIELDS + ("last_accessed_time",))
+            for course in resp_json.get('results') or []:
+                accessed = course.get('last_accessed_time')
+                if not accessed or datetime.fromisoformat(accessed.replace("Z", "+00:00")).timestamp() <= since:
+                    return
+                yield course
+            url = resp_json.get('next')
+
+    def refresh_login_if_needed(self) -> None:
+        """
+        Log in again when the cached access token is about to expire, meant for long running processes
+
+        :return: None
+        """
+        cookie_cache = self._load_cookie_cache()
+        expiry = cookie_cache.get("access_token_expiry") if cookie_cache else None
+        if cookie_cache is None or (expiry is not None and expiry - time.time() < self.TOKEN_REFRESH_MARGIN):
+            logger.info("Refreshing the udemy session")
+            self.logged_in = False
+            self.login()
+
+    def _get_curriculum_items(self, course_id: int) -> List[Dict]:
+        """
+        Retrieves every item (chapters, lectures, quizzes...) of the curriculum of a course
+
+        :param int course_id: Id of the course
+        :return: list of curriculum items
+        """
+        items = []
+        url = self.QUIZ_URL.format(course_id)
+        while url:
+            logger.info(f"Getting curriculum items with url {url}")
+            resp_json = decode_page(self.session.get(url).content, CURRICULUM_FIELDS)
+            items.extend(resp_json['results'])
+            url = resp_json.get('next')
+        return items
+
+    def _get_curriculum_delta(self, course_id: int) -> CurriculumDelta:
+        """
+        Compare the curriculum of a course with the one stored when it was last completed
+
+        :param int course_id: Id of the course
+        :return: CurriculumDelta with the lectures and quizzes added since
+        """
+        delta = compute_delta(
+            self._get_curriculum_items(course_id), self.catalogue.get_curriculum_fingerprint(course_id)
+        )
+        get_metrics().cache_access("curriculum", not delta.is_first_sync)
+        self.catalogue.set_curriculum_hash(course_id, delta.curriculum_hash)
+        return delta
 
-    def _get_assessment_ids(self, course_id: int):
+    def _get_assessment_ids(self, course_id: int, curriculum_items: Optional[List[Dict]] = None):
         """
         Retrieves the assessment ids for the course passed in
         :param int course_id: Id of the course to get the assessment ids of
-        :return: list of assessment ids
+        :param list curriculum_items: Curriculum of the course when already fetched
+        :return: list of (quiz id, quiz type, quiz version) tuples
         """
-        logger.info(f"CALLING FUNCTION GET_ASSESSMENT_IDS with url {self.QUIZ_URL.format(course_id)}")
-        assessment_json = self.session.get(self.QUIZ_URL.format(course_id)).json()
+        if curriculum_items is None:
+            curriculum_items = self._get_curriculum_items(course_id)
 
-        results = assessment_json['results']
         assessment_lst_id = []
-        for x in results:
+        for x in curriculum_items:
             if x['_class'] != 'lecture':
 
                 if x['_class'] == 'quiz':
-                    assessment_lst_id.append(tuple((x['id'], x['type'])))
-        # logger.info("Printing all quizs_ids")
-        # for x in assessment_lst_id:
-        #     logger.info(f"Found quiz id {x}")
+                    assessment_lst_id.append(tuple((x['id'], x['type'], x.get('version') or 1)))
         return assessment_lst_id
 
-    def _get_assessments(self, course_id: int):
-        assessment_lst_ids = self._get_assessment_ids(course_id)
-        if assessment_lst_ids:
-            assessment_lst = []
-            for x in assessment_lst_ids:
-                logger.info(f"CALLING FUNCTION _get_assessments with url {self.RESPONSES_URL.format(x[0])}")
-                assessment_json = self.session.get(self.RESPONSES_URL.format(x[0])).json()
-                results = assessment_json.get('results')
-
-                for y in results:
-                    y.update({'assessment_initial_type': x[1]})
-                    y.update({'assessment_initial_id': x[0]})
-                    if y.get('_class') == 'assessment':
-                        assessment_lst.append(y)
+    def _get_quiz_answer_key(self, quiz_id: int, quiz_version: int) -> Tuple[List[Dict], bool]:
+        """
+        Get the assessments of a quiz, from the local answer key store when possible
+
+        :param int quiz_id: Id of the quiz
+        :param int quiz_version: Version of the quiz
+        :return: list of assessments of the quiz, and whether the answer key is in the store
+        """
+        assessments = self.answer_store.get_quiz(quiz_id, quiz_version)
+        get_metrics().cache_access("answer_keys", assessments is not None)
+        if assessments is not None:
+            logger.info(f"Loaded answer key of quiz {quiz_id} v{quiz_version} from the local store")
+            return assessments, True
+        responses_url = self.RESPONSES_URL.format(quiz_id=quiz_id, version=quiz_version)
+        logger.info(f"CALLING FUNCTION _get_assessments with url {responses_url}")
+        response = self.session.get(responses_url)
+        results = decode_page(response.content, ANSWER_FIELDS).get('results') or []
+        assessments = [y for y in results if y.get('_class') == 'assessment']
+        if response.status_code != 200:
+            logger.warning(f"Couldn't store the answer key of quiz {quiz_id}, status {response.status_code}")
+            return assessments, False
+        self.answer_store.put_quiz(quiz_id, quiz_version, assessments)
+        return assessments, True
+
+    def _iter_quiz_assessments(
+            self,
+            course_id: int,
+            quiz_ids: Optional[List[int]] = None,
+            curriculum_items: Optional[List[Dict]] = None,
+    ) -> Iterator[Tuple[int, str, List[AssessmentRecord]]]:
+        """
+        Streams the assessments of a course one quiz at a time, so only one quiz is held in memory
+
+        :param int course_id: Id of the course to get the assessments of
+        :param list quiz_ids: Only stream these quizzes, all of them if None
+        :param list curriculum_items: Curriculum of the course when already fetched
+        :return: generator of (quiz id, quiz type, list of assessment records)
+        """
+        for quiz_id, quiz_type, quiz_version in self._get_assessment_ids(course_id, curriculum_items):
+            if quiz_ids is not None and quiz_id not in quiz_ids:
+                continue
+            assessments, stored = self._get_quiz_answer_key(quiz_id, quiz_version)
+            # the prompts of an answer key that couldn't be stored stay in memory
+            answer_store = self.answer_store if stored else None
+            assessment_lst = [
+                AssessmentRecord.from_json(y, quiz_id, quiz_type, quiz_version, answer_store)
+                for y in assessments
+            ]
             for y in assessment_lst:
-                logger.info(f"Found assessment id {y['id']}, quiz id {y['assessment_initial_id']}")
-            return assessment_lst
+                logger.debug(f"Found assessment id {y.id}, quiz id {y.quiz_id}", extra={"hot": True})
+            yield quiz_id, quiz_type, assessment_lst
 
-    def _send_completition_req(self, course_link: str, list_of_lectures_ids: List, course_id: int, domain) -> json:
-        url_pattern = fr"https://{domain}.udemy.com/api-2.0/users/me/subscribed-courses/{{}}/completed-lectures/"
+    @phase("lectures")
+    def _send_completition_req(self, course_link: str, list_of_lectures_ids: List, course_id: int, domain) -> None:
+        url_pattern = f"{self.API_BASE_URL}/api-2.0/users/me/subscribed-courses/{{}}/completed-lectures/"
         new_url_xpath = r"api-2.0/users/me/subscribed-courses/{}/completed-lectures/"
         course_details = self._get_course_details(course_id)
         course_url = course_details['url']
-        logger.info(f"\n\nLogging course details {course_details}\n\n{course_url}")
+        logger.debug(f"Logging course details {course_details}\n{course_url}")
         processes = []
 
         start = time.time()
+        send_completition_req = propagate(self._send_completition_req_helper)
+        # the requests not answered yet, queued or on the wire
+        register_queue("completion_requests", lambda: sum(not task.done() for task in processes))
         with ThreadPoolExecutor(max_workers=10) as executor:
             for lect in list_of_lectures_ids:
-                logger.info(f"Sending request to mark lecture {lect} as completed of course {course_id}")
-                processes.append(executor.submit(self._send_completition_req_helper, lect, course_id, url_pattern))
+                processes.append(executor.submit(send_completition_req, lect, course_id, url_pattern))
+        statuses = Counter()
         for task in as_completed(processes):
-            logger.info(task.result())
-        logger.info(f'Time taken to complete {len(list_of_lectures_ids)} lectures: {time.time() - start}')
+            status_code, text = task.result()
+            statuses[status_code] += 1
+            if status_code >= 400:
+                logger.warning(f"Couldn't mark a lecture of course {course_id} as completed: {status_code} {text[:200]}",
+                               extra={"hot": True})
+        logger.info(f'Time taken to complete {len(list_of_lectures_ids)} lectures: {time.time() - start}, '
+                    f'status codes {dict(statuses)}')
 
     def _send_completition_req_helper(self, lect, course_id, url_pattern):
         # logger.info(self._build_json_complete_course(lect))
@@ -689,15 +1145,15 @@ class UdemyActionsUI:
         return response.status_code, response.text
 
     @staticmethod
-    def _build_json_complete_part_quiz(x: json):
+    def _build_json_complete_part_quiz(x: AssessmentRecord):
         # mapping number to character
         # corresponding_char = chr(ord('a') + idx)
-        correct_response = x.get('correct_response')
+        correct_response = x.correct_response
         rand_duration = random.randint(1, 150)
 
-        json_to_ret = {"assessment_id": x.get('id'), "response": correct_response,
+        json_to_ret = {"assessment_id": x.id, "response": correct_response,
                        "duration": rand_duration}
-        logger.info(json_to_ret)
+        logger.debug(json_to_ret, extra={"hot": True})
         return json_to_ret
 
     def _get_real_course_link_from_id(self, course_id: int):
@@ -707,7 +1163,7 @@ class UdemyActionsUI:
         )
         try:
             dummy_element = (
-                WebDriverWait(self.driver, 10)
+                AdaptiveWait(self.driver, "course:app-loader", 10)
                 .until(EC.presence_of_element_located((By.XPATH, dummy_elm_xpath))))
         except TimeoutException:
             logger.warning("Couldn't find dummy element to solve quiz")
@@ -732,7 +1188,7 @@ class UdemyActionsUI:
         matches = regex.search(url_pattern_basic_url, url, flags=(regex.M))
         if matches:
             assessment_id_n = matches.group('assessment_id_n')
-            logger.info(f"RETURNING THIS {assessment_id_n}")
+            logger.debug(f"RETURNING THIS {assessment_id_n}")
             return assessment_id_n
         return None
 
@@ -779,94 +1235,84 @@ class UdemyActionsUI:
 
         response = self.session.get(self.COMPLETED_QUIZ_IDS.format(course_id=course_id))
         if response.status_code == 200 or response.status_code == 201:
-            json_resp = response.json()
+            json_resp = response_json(response)
             return json_resp.get('completed_assignment_ids')
 
     def _get_already_done_assessments(self, course_id, assessment_id_fake) -> list[str]:
-        print(self.LAST_ID_QUIZ.format(course_id=course_id, quiz_id=assessment_id_fake))
         response = self.session.get(self.LAST_ID_QUIZ.format(course_id=course_id, quiz_id=assessment_id_fake))
 
         if response.status_code == 200 or response.status_code == 201:
-            logger.info("resp status code is 200/201 for the assessment")
-            resp_json = response.json()
+            logger.debug("resp status code is 200/201 for the assessment", extra={"hot": True})
+            resp_json = response_json(response)
             if resp_json.get('_class') == 'user_attempted_quiz':
-                logger.info(f"returning assessment id {resp_json.get('id')}")
+                logger.debug(f"returning assessment id {resp_json.get('id')}", extra={"hot": True})
                 return resp_json.get('id')
 
-    def _solve_single_quiz_test(self, course_id):
-        assessment_lst = self._get_assessments(course_id)
-        # build a dict with key as assessment_initial_id and value the number of quizzes with the same id
-        initial_id_counts = {}
-        if assessment_lst is not None:
-            for entry in assessment_lst:
-                if entry["assessment_initial_type"] == "practice-test":
-                    initial_id = entry["assessment_initial_id"]
-                    initial_id_counts[initial_id] = initial_id_counts.get(initial_id, 0) + 1
-            logger.info(f"printo il dizionario {initial_id_counts}")
-            lst_of_dicts = {}
-
-            for idx, x in enumerate(assessment_lst):
-                if x.get('assessment_initial_type') == 'practice-test':
-                    assessment_lst_already_done = self._get_already_done_assessments(course_id,
-                                                                                     x.get('assessment_initial_id'))
-                    if assessment_lst_already_done is None:
-                        print(f"Quiz idx: {idx}\n{x} \n\n")
-                        if not x.get('assessment_initial_id') in self._get_completed_assessments(course_id):
-                            logger.info(f"Found the first assessment real id for {x.get('assessment_initial_id')}")
-                            self._solve_first_quiz_with_driver_test(course_id, x)
-                            lst_of_dicts[x.get('assessment_initial_id')] = lst_of_dicts.get(x.get('assessment_initial_id'),
-                                                                                            0) + 1
-                    else:
-                        logger.info(f"Else, sending xhr req")
-                        self._solve_quiz_req_helper(course_id, assessment_lst_already_done, x)
-                        lst_of_dicts[x.get('assessment_initial_id')] = lst_of_dicts.get(
-                            x.get('assessment_initial_id'), 0) + 1
-                        for a, b in lst_of_dicts.items():
-                            print(f"\na {a}, b {b}\n\n")
-                            for c, d in initial_id_counts.items():
-                                # logger.info(f"\nc {c}, d {d}\n\n")
-                                if c == a and b == d - 1:
-                                    if self.solve_last_part_multiple_test(course_id, x):
-                                        logger.info(
-                                            f"Congratulations, successfully completed quiz {x.get('assessment_initial_id')}")
-                                    # logger.info(f"Response {self.send_completition_req_quiz_multiple( course_id, assessment_lst_already_done, x)}")
-                elif x.get('assessment_initial_type') == 'multiple-choice' or x.get(
-                        'assessment_initial_type') == 'simple-quiz':
-                    assessment_lst_already_done = self._get_already_done_assessments \
-                        (course_id, x.get('assessment_initial_id'))
-                    if assessment_lst_already_done is None:
-                        print(f"Quiz idx: {idx}\n{x} \n\n")
-                        if not x.get('assessment_initial_id') in self._get_completed_assessments(course_id):
-                            logger.info(f"Found the first assessment real id for {x.get('assessment_initial_id')}")
-                            self._solve_first_quiz_with_driver_test(course_id, x)
-                    else:
-                        logger.info(f"Else, sending xhr req")
-                        logger.info(self._solve_quiz_req_helper(course_id, assessment_lst_already_done, x))
+    @phase("quiz")
+    def _solve_single_quiz_test(self, course_id, quiz_ids=None, curriculum_items=None):
+        for quiz_id, quiz_type, assessment_lst in self._iter_quiz_assessments(course_id, quiz_ids, curriculum_items):
+            self._solve_quiz_assessments(course_id, quiz_id, quiz_type, assessment_lst)
+
+    def _solve_quiz_assessments(self, course_id, quiz_id, quiz_type, assessment_lst: List[AssessmentRecord]):
+        """
+        Solve the assessments of a single quiz
+
+        :param int course_id: Id of the course the quiz belongs to
+        :param int quiz_id: Id of the quiz
+        :param str quiz_type: Type of the quiz
+        :param list assessment_lst: Assessments of the quiz
+        :return: None
+        """
+        solved_practice_parts = 0
+        for idx, x in enumerate(assessment_lst):
+            if quiz_type == 'practice-test':
+                assessment_lst_already_done = self._get_already_done_assessments(course_id, quiz_id)
+                if assessment_lst_already_done is None:
+                    logger.debug(f"Quiz idx: {idx}\n{x}")
+                    if not quiz_id in self._get_completed_assessments(course_id):
+                        logger.info(f"Found the first assessment real id for {quiz_id}")
+                        self._solve_first_quiz_with_driver_test(course_id, x)
+                        solved_practice_parts += 1
+                else:
+                    logger.debug(f"Else, sending xhr req", extra={"hot": True})
+                    self._solve_quiz_req_helper(course_id, assessment_lst_already_done, x)
+                    solved_practice_parts += 1
+                    # the last part of a practice test has to be submitted through the ui
+                    if solved_practice_parts == len(assessment_lst) - 1:
+                        if self.solve_last_part_multiple_test(course_id, x):
+                            logger.info(
+                                f"Congratulations, successfully completed quiz {quiz_id}")
+            elif quiz_type == 'multiple-choice' or quiz_type == 'simple-quiz':
+                assessment_lst_already_done = self._get_already_done_assessments(course_id, quiz_id)
+                if assessment_lst_already_done is None:
+                    logger.debug(f"Quiz idx: {idx}\n{x}")
+                    if not quiz_id in self._get_completed_assessments(course_id):
+                        logger.info(f"Found the first assessment real id for {quiz_id}")
+                        self._solve_first_quiz_with_driver_test(course_id, x)
+                else:
+                    logger.debug(f"Else, sending xhr req", extra={"hot": True})
+                    self._solve_quiz_req_helper(course_id, assessment_lst_already_done, x)
 
-                elif x.get('assessment_type') == 'coding-problem' or x.get('assessment_initial_type') == 'coding-exercise':
-                    #
-                    #
-                    # assessment_lst_already_done = self._get_already_done_assessments \
-                    #     (course_id, x.get('assessment_initial_id'))
-                    # if assessment_lst_already_done is None:
-                    print(f"Quiz idx: {idx}\n{x} \n\n")
-                    self._solve_coding_problem(course_id, x)
+            elif x.assessment_type == 'coding-problem' or quiz_type == 'coding-exercise':
+                logger.debug(f"Quiz idx: {idx}\n{x}")
+                self._solve_coding_problem(course_id, x)
 
-    def _solve_coding_problem(self, course_id, x: json):
+    @phase("coding")
+    def _solve_coding_problem(self, course_id, x: AssessmentRecord):
 
         if url_to_use := self._get_real_course_link_from_id(course_id):
-            url_of_quiz = self.URL_QUIZ_NOAPI.format(url_no_id=url_to_use, assessment_id=x['assessment_initial_id'])
+            url_of_quiz = self.URL_QUIZ_NOAPI.format(url_no_id=url_to_use, assessment_id=x.quiz_id)
             self.driver.get(url_of_quiz)
             try:
-                solution_files = x.get('prompt').get('solution_files')
+                solution_files = x.prompt.get('solution_files') or []
                 for x in solution_files:
                     filename = x.get('file_name')
                     content = x.get('content')
-                    logger.info("Printing content {} for filename {}".format(repr(content), filename))
+                    logger.debug(f"Printing content {content!r} for filename {filename}")
                     try:
                         try:
 
-                            WebDriverWait(self.driver, 15). \
+                            AdaptiveWait(self.driver, "coding:file-tab", 15). \
                                 until(EC.visibility_of_element_located(
                                 (By.XPATH, f"//button//div[contains(text(), '{filename}')]"))) \
                                 .click()
@@ -876,9 +1322,9 @@ class UdemyActionsUI:
 
 
                         editor_id='editor'
-                        WebDriverWait(self.driver, 10). \
+                        AdaptiveWait(self.driver, "coding:editor", 10). \
                             until(EC.presence_of_element_located((By.ID, editor_id)))
-                        WebDriverWait(self.driver, 10).\
+                        AdaptiveWait(self.driver, "coding:ready-state", 10).\
                             until(lambda driver: driver.execute_script('return document.readyState') == 'complete')
                         # logger.info('ace.edit("{}").setValue("{}")'.format(editor_id, content))
                         self.driver.execute_script('ace.edit({}).setValue({})'.format(json.dumps(editor_id), json.dumps(content)))
@@ -890,17 +1336,19 @@ class UdemyActionsUI:
                         logger.info(f"Exception for {filename}, exception {e}", exc_info=True)
                         continue
                 check_button = "//button[@data-purpose='check-button']"
-                WebDriverWait(self.driver, 10). \
+                AdaptiveWait(self.driver, "coding:check-button", 10). \
                     until(EC.element_to_be_clickable((By.XPATH, check_button))) \
                     .click()
                 feedback_div= "//div[@data-purpose='feedback-title']"
-                WebDriverWait(self.driver, 10). \
+                AdaptiveWait(self.driver, "coding:feedback", 10). \
                     until(EC.presence_of_element_located((By.XPATH, feedback_div)))
                 next_question_btn = "//div[@data-purpose='go-to-next']"
-                WebDriverWait(self.driver, 10). \
+                AdaptiveWait(self.driver, "coding:next", 10). \
                     until(EC.element_to_be_clickable((By.XPATH, next_question_btn))) \
                     .click()
 
+            except AnswerKeyException as e:
+                logger.error(f"Skipping coding exercise {x.quiz_id}: {e}")
             except Exception as e:
                 logger.warning(f"Exception while solving coding exercise {e}", exc_info=True)
 
@@ -909,27 +1357,27 @@ class UdemyActionsUI:
     def solve_last_part_multiple_test(self, course_id, x):
         if url_to_use := self._get_real_course_link_from_id(course_id):
             url_of_quiz = self.URL_QUIZ_MULTIPLE_NOAPI.format(url_no_id=url_to_use,
-                                                              assessment_id=x.get('assessment_initial_id'))
+                                                              assessment_id=x.quiz_id)
             self.driver.get(url_of_quiz)
-            logger.info(f"Found quiz url {url_of_quiz}")
+            logger.debug(f"Found quiz url {url_of_quiz}")
             resume_play_quiz_btn = "//button[@data-purpose='unpause-test']"
             try:
                 dummy_element = (
-                    WebDriverWait(self.driver, 10)
+                    AdaptiveWait(self.driver, "practice:unpause", 10)
                     .until(EC.presence_of_element_located((By.XPATH, resume_play_quiz_btn)))).click()
             except TimeoutException:
                 logger.warning("No need to un-pause-quiz.")
             finally:
                 stop_quiz = "//button[@data-purpose='stop']"
                 try:
-                    WebDriverWait(self.driver, 10) \
+                    AdaptiveWait(self.driver, "practice:stop", 10) \
                         .until(EC.presence_of_element_located((By.XPATH, stop_quiz))).click()
                 except TimeoutException:
                     logger.warning("Quiz has already finished, no need to finish.")
                 else:
                     confirm_stop = "//button[@data-purpose='submit-confirm-modal']"
                     try:
-                        WebDriverWait(self.driver, 10) \
+                        AdaptiveWait(self.driver, "practice:confirm-stop", 10) \
                             .until(EC.presence_of_element_located((By.XPATH, confirm_stop))).click()
                     except TimeoutException:
                         logger.warning("Something went wrong while finishing the quiz.")
@@ -949,52 +1397,49 @@ class UdemyActionsUI:
 
     def send_completition_req_quiz_multiple(self, course_id, assessment_initial_id, x):
         json_to_send = {"marked_completed": True}
-        logger.info(f"arrivato momento assessment id {assessment_initial_id} poi {course_id} ed infine x:  {x}, ")
-        logger.info(
-            f"FULL URL: {self.URL_SEND_RESPONSE_MULTIPLE.format(course_id=course_id, quiz_id=x.get('id'), assessment_initial_id=assessment_initial_id)} e il json invece: {json_to_send}")
+        logger.debug(f"arrivato momento assessment id {assessment_initial_id} poi {course_id} ed infine x:  {x}, ")
+        logger.debug(
+            f"FULL URL: {self.URL_SEND_RESPONSE_MULTIPLE.format(course_id=course_id, quiz_id=x.id, assessment_initial_id=assessment_initial_id)} e il json invece: {json_to_send}")
         response = self.session.patch(
-            self.URL_SEND_RESPONSE_MULTIPLE.format(course_id=course_id, quiz_id=x.get('id'),
+            self.URL_SEND_RESPONSE_MULTIPLE.format(course_id=course_id, quiz_id=x.id,
                                                    assessment_initial_id=assessment_initial_id),
             json=json_to_send)
         return response.status_code, response.text
 
-    def _solve_first_quiz_with_driver_test(self, course_id, x):
+    def _solve_first_quiz_with_driver_test(self, course_id, x: AssessmentRecord):
         url_to_use = self._get_real_course_link_from_id(course_id)
         if url_to_use:
             url_of_quiz = self.URL_QUIZ_NOAPI.format(url_no_id=url_to_use,
-                                                     assessment_id=x['assessment_initial_id'])
+                                                     assessment_id=x.quiz_id)
             self.driver.get(url_of_quiz)
-            logger.info(f"Found quiz url {url_of_quiz}")
+            logger.debug(f"Found quiz url {url_of_quiz}")
             try:
                 resume_play_quiz_btn = "//button[@data-purpose='start-or-resume-quiz']"
                 resume_play_quiz_btn_2 = "//button[@data-purpose='start-quiz']"
 
-                try:
-
-                    WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable((By.XPATH, resume_play_quiz_btn))
-                    ).click()
-
-                except TimeoutException:
+                # the quiz shows either button, race them instead of waiting the first one out
+                matched, start_button = AdaptiveWait(self.driver, "quiz:start", 10).until(
+                    first_of(
+                        EC.element_to_be_clickable((By.XPATH, resume_play_quiz_btn)),
+                        EC.element_to_be_clickable((By.XPATH, resume_play_quiz_btn_2)),
+                    )
+                )
+                if matched == 1:
                     logger.warning("couldn't find resume button, already completed quiz")
-                    WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable((By.XPATH, resume_play_quiz_btn_2))
-                    ).click()
+                start_button.click()
                 try:
                     locale_xpath_ul_resp = "//ul[@aria-labelledby='question-prompt']"
-                    menu_items = WebDriverWait(self.driver, 10).until(
+                    menu_items = AdaptiveWait(self.driver, "quiz:answers", 10).until(
                         EC.presence_of_element_located((By.XPATH, locale_xpath_ul_resp))
                     )
                     items = self.driver.find_element(By.XPATH,locale_xpath_ul_resp)
                 except TimeoutException:
                     logger.error("TimeoutException, couldn't find quiz menu/answers")
                     return None
-                print(x.get('assessment_initial_type'))
-                if x.get('assessment_initial_type') == 'simple-quiz' or x.get('assessment_initial_type') == 'multiple-choice'\
-                        or x.get('assessment_initial_type') == 'practice-test':
+                if x.quiz_type == 'simple-quiz' or x.quiz_type == 'multiple-choice'\
+                        or x.quiz_type == 'practice-test':
                     ul_elements = items.find_elements(By.TAG_NAME,'li')
-                    correct_response = x.get('correct_response')
-                    print(correct_response)
+                    correct_response = x.correct_response
                     lst_of_correct_responses = []
                     for y in correct_response:
                         ord_of_char = ord(y)
@@ -1012,28 +1457,29 @@ class UdemyActionsUI:
 
                 last_entry = self.driver.get_log('performance')[-1]
                 last_timestamp = last_entry['timestamp']
+                next_question_btn = "//button[@data-purpose='next-question-button']"
+                next_question_btn_2 = "//button[@data-purpose='go-to-next-question']"
                 try:
-                    next_question_btn = "//button[@data-purpose='next-question-button']"
-                    WebDriverWait(self.driver, 10).until(
-                        EC.element_to_be_clickable((By.XPATH, next_question_btn))
-                    ).click()
+                    AdaptiveWait(self.driver, "quiz:next", 10).until(
+                        first_of(
+                            EC.element_to_be_clickable((By.XPATH, next_question_btn)),
+                            EC.element_to_be_clickable((By.XPATH, next_question_btn_2)),
+                        )
+                    )[1].click()
                 except TimeoutException:
                     logger.error(f"TimeoutException - couldn't find next button")
-                    try:
-                        next_question_btn_2 = "//button[@data-purpose='go-to-next-question']"
-                        WebDriverWait(self.driver, 10).until(
-                            EC.element_to_be_clickable((By.XPATH, next_question_btn_2))
-                        ).click()
-                    except TimeoutException:
-                        logger.error(f"TimeoutException - couldn't find next button2")
-                        return None
+                    return None
 
-                filtered_logs = [x for x in self.driver.get_log('performance') if
-                                 x['timestamp'] > last_timestamp]
-                lst_of_logs = []
-                for x in filtered_logs:
-                    for k, v in x.items():
-                        if (json_dict := validateJSON(v))[0]:
+                with phase("quiz:performance-log"):
+                    filtered_logs = [x for x in self.driver.get_log('performance') if
+                                     x['timestamp'] > last_timestamp]
+                    lst_of_logs = []
+                    for x in filtered_logs:
+                        message = x.get('message')
+                        # only the request events are decoded, most of the log is other network events
+                        if not isinstance(message, str) or 'Network.requestWillBeSent' not in message:
+                            continue
+                        if (json_dict := validateJSON(message))[0]:
                             for x, y in json_dict[1].items():
                                 if type(y) is dict:
                                     if y['method'] == 'Network.requestWillBeSent':
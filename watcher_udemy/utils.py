@@ -1,8 +1,16 @@
-import json
+import gzip
 import os
+import pathlib
 import random
+import re
+import sqlite3
+import sys
+from typing import Iterator
 
-import validators
+from watcher_udemy.codec import loads
+
+# Cheap check run on every line of the url files, the real classification is done by the resolver
+URL_LINE_PATTERN = re.compile(rb"^\s*(https?://\S+?)\s*$", re.IGNORECASE)
 
 def get_app_dir() -> str:
     """
@@ -12,31 +20,58 @@ def get_app_dir() -> str:
     """
 
     app_dir = os.path.join(os.path.expanduser("~"), ".watcher_udemy")
-    print(app_dir)
     if not os.path.isdir(app_dir):
         # If the app data dir does not exist create it
         os.mkdir(app_dir)
     return app_dir
 
-def read_urls_from_file(file_name):
-    with open(file_name, "r") as f:
-        lines= f.read().splitlines()
-    list_of_urls = []
-    for line in lines:
-        if validators.url(line):
-            list_of_urls.append(line)
-    return list_of_urls
+def connect_read_only(db_path: str) -> sqlite3.Connection:
+    """
+    Open an existing SQLite database without writing anything, not even the WAL index files
+
+    :param str db_path: path of the database
+    :return: the connection
+    """
+    uri = f"{pathlib.Path(db_path).as_uri()}?mode=ro"
+    if not os.path.exists(f"{db_path}-wal"):
+        # nothing waits in the write-ahead log, the file alone holds the data
+        uri += "&immutable=1"
+    return sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+
+def iter_urls_from_file(file_name: str, buffer_size: int = 1 << 20) -> Iterator[str]:
+    """
+    Stream the urls of a file, one per line, without loading the whole file in memory
+
+    :param str file_name: path of the file, gzipped if it ends with .gz, "-" to read from stdin
+    :param int buffer_size: size of the chunks read from the file
+    :return: iterator over the lines that look like urls
+    """
+    if file_name == "-":
+        f = sys.stdin.buffer
+    elif file_name.endswith(".gz"):
+        f = gzip.open(file_name, "rb")
+    else:
+        f = open(file_name, "rb", buffering=buffer_size)
+    try:
+        for line in f:
+            if matches := URL_LINE_PATTERN.match(line):
+                yield matches.group(1).decode("utf-8", errors="ignore")
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
 
 def generate_9_digit_random_number()->int:
     n = 9
     return int(''.join(["{}".format(random.randint(0, 9)) for _ in range(0, n)]))
 
 def validateJSON(jsonData: str)->tuple:
+    # anything but a document is rejected up front, raising and catching is the costly part
+    if not isinstance(jsonData, (str, bytes, bytearray)) or not jsonData:
+        return False, None
     try:
-        loaded_json=json.loads(jsonData)
+        loaded_json=loads(jsonData)
     except ValueError:
         return False, None
-    except BaseException:
-        return False, None
     return True, loaded_json
 
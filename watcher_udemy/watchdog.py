@@ -0,0 +1,192 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+from watcher_udemy.driver_manager import DriverManager
+from watcher_udemy.logging import get_logger
+
+try:
+    import psutil
+except ImportError:
+    # the memory is read from /proc without psutil, other systems skip the memory checks
+    psutil = None
+
+logger = get_logger()
+
+DEFAULT_MAX_TASKS = 50
+DEFAULT_MAX_MEMORY_MB = 2048
+DEFAULT_PING_TIMEOUT = 15
+
+
+def _proc_tree_rss(pid: int) -> Optional[int]:
+    """
+    Resident memory of a process and its descendants read from /proc, for linux without psutil
+
+    :param int pid: pid of the root process
+    :return: memory in bytes, None if /proc can't tell
+    """
+    children: Dict[int, List[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name is in parentheses and may hold spaces, the parent pid follows the state
+                ppid = int(f.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+class BrowserWatchdog:
+    """
+    Keeps an eye on the browser of a DriverManager during long runs, and restarts it after a number
+    of tasks, above a memory threshold or when it stops answering. The cookies are carried over,
+    so the new browser is logged in like the old one.
+    """
+
+    def __init__(
+            self,
+            driver_manager: DriverManager,
+            max_tasks: int = DEFAULT_MAX_TASKS,
+            max_memory_mb: float = DEFAULT_MAX_MEMORY_MB,
+            ping_timeout: float = DEFAULT_PING_TIMEOUT,
+    ):
+        """
+        :param DriverManager driver_manager: Manager of the browser to watch
+        :param int max_tasks: Tasks after which the browser is recycled, 0 to never recycle on count
+        :param float max_memory_mb: Memory of the browser processes above which it is recycled
+        :param float ping_timeout: Seconds the browser has to answer a ping
+        """
+        self.driver_manager = driver_manager
+        self.max_tasks = max_tasks
+        self.max_memory_mb = max_memory_mb
+        self.ping_timeout = ping_timeout
+        self.tasks = 0
+        self._memory_unknown_logged = False
+
+    def is_responsive(self) -> bool:
+        """
+        Ping the browser from another thread, a hung browser never answers webdriver commands
+
+        :return: False if the browser didn't answer in time or errored
+        """
+        answered = threading.Event()
+
+        def ping():
+            try:
+                self.driver_manager.driver.execute_script("return 1")
+            except Exception as e:
+                logger.warning(f"Browser ping failed: {e}")
+            else:
+                answered.set()
+
+        threading.Thread(target=ping, name="browser-ping", daemon=True).start()
+        return answered.wait(self.ping_timeout)
+
+    def memory_mb(self) -> Optional[float]:
+        """
+        Resident memory of the driver process and the browser processes it started
+
+        :return: memory in MB, None if it can't be measured
+        """
+        service = getattr(self.driver_manager.driver, "service", None)
+        process = getattr(service, "process", None)
+        if process is None:
+            return None
+        if psutil is None:
+            rss = _proc_tree_rss(process.pid)
+            return rss / (1024 * 1024) if rss is not None else None
+        try:
+            driver_process = psutil.Process(process.pid)
+            processes = [driver_process, *driver_process.children(recursive=True)]
+            return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+        except psutil.Error:
+            return None
+
+    def check(self, udemy_actions, failed: bool = False) -> bool:
+        """
+        Called after every task, restarts the browser when it needs to
+
+        :param UdemyActionsUI udemy_actions: Actions using the browser, they get the new one
+        :param bool failed: The task failed with a browser error, the browser may be hung
+        :return: True if the browser was restarted
+        """
+        if not self.driver_manager.started:
+            # the tasks stayed on the api, there is no browser to look after yet
+            return False
+        self.tasks += 1
+        if failed and not self.is_responsive():
+            self.restart(udemy_actions, "not responding", responsive=False)
+            return True
+        reason = None
+        memory = self.memory_mb() if self.max_memory_mb else None
+        if self.max_memory_mb and memory is None and not self._memory_unknown_logged:
+            self._memory_unknown_logged = True
+            logger.warning(
+                f"The memory of the browser can't be measured (install psutil), "
+                f"it won't be restarted above {self.max_memory_mb}MB"
+            )
+        if self.max_tasks and self.tasks >= self.max_tasks:
+            reason = f"{self.tasks} tasks done"
+        elif memory is not None and memory > self.max_memory_mb:
+            reason = f"using {memory:.0f}MB"
+        if reason is None:
+            return False
+        self.restart(udemy_actions, reason)
+        return True
+
+    def restart(self, udemy_actions, reason: str, responsive: bool = True) -> None:
+        """
+        Replace the browser with a new one, carrying the cookies over
+
+        :param UdemyActionsUI udemy_actions: Actions using the browser, they get the new one
+        :param str reason: Why the browser is restarted, logged
+        :param bool responsive: The old browser still answers, its cookies are taken over
+        :return: None
+        """
+        logger.warning(f"Restarting the browser: {reason}")
+        old_driver = self.driver_manager.driver
+        cookies = None
+        # a hung browser can't give its cookies back, the cached ones are used instead
+        if responsive:
+            try:
+                cookies = old_driver.get_cookies()
+            except Exception as e:
+                logger.warning(f"Couldn't get the cookies of the old browser: {e}")
+        if cookies:
+            udemy_actions._cache_cookies(udemy_actions._filter_auth_cookies(cookies))
+        # quitting a hung browser can hang too, don't wait on it
+        threading.Thread(target=self._quit, args=(old_driver,), name="browser-quit", daemon=True).start()
+        self.driver_manager._init_driver()
+        udemy_actions.driver = self.driver_manager.driver
+        # the cookies are added lazily, the next time the browser is needed
+        udemy_actions._driver_needs_cookies = True
+        udemy_actions.stats.browser_restarts += 1
+        self.tasks = 0
+
+    @staticmethod
+    def _quit(driver) -> None:
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Couldn't quit the old browser: {e}")
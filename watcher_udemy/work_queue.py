@@ -0,0 +1,559 @@
+import heapq
+import hmac
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+
+from watcher_udemy.logging import get_logger
+from watcher_udemy.utils import get_app_dir
+
+logger = get_logger()
+
+DEFAULT_VISIBILITY_TIMEOUT = 15 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 30
+DEFAULT_MAX_RETRY_DELAY = 60 * 60
+# dead letters are given another chance after a week, the course may have been fixed since
+DEFAULT_DEAD_LETTER_TTL = 7 * 24 * 60 * 60
+
+# Shared secret of a served queue, sent by the workers as a bearer token
+QUEUE_TOKEN_ENV = "WATCHER_UDEMY_QUEUE_TOKEN"
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def get_worker_id() -> str:
+    """
+    Identifier of this worker, unique across the machines sharing a queue
+
+    :return: hostname and pid of the current process
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue(ABC):
+    """
+    Queue of course ids shared by several workers.
+
+    A leased item is invisible to the other workers until it is completed, failed or its
+    visibility timeout expires without a heartbeat, in which case it is handed out again.
+    """
+
+    @abstractmethod
+    def enqueue(self, items: Iterable[str]) -> int:
+        """
+        Add items to the queue, items already known to the queue are ignored
+
+        :return: Number of items added
+        """
+
+    @abstractmethod
+    def lease(self, worker_id: str, count: int = 1, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> List[str]:
+        """
+        Lease up to count pending items
+
+        :return: The leased items, empty when there is nothing left to do
+        """
+
+    @abstractmethod
+    def heartbeat(self, worker_id: str, items: Iterable[str], visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> List[str]:
+        """
+        Extend the leases the worker still holds on the items
+
+        :return: The items whose lease was extended
+        """
+
+    @abstractmethod
+    def complete(self, worker_id: str, item: str) -> bool:
+        """
+        Mark a leased item as done
+
+        :return: False if the worker no longer held the lease
+        """
+
+    @abstractmethod
+    def fail(self, worker_id: str, item: str, error: str = "") -> bool:
+        """
+        Give a leased item back to the queue, it is marked failed once it ran out of attempts
+
+        :return: False if the worker no longer held the lease
+        """
+
+    @abstractmethod
+    def requeue_expired(self) -> int:
+        """
+        Make the items whose lease expired available again
+
+        :return: Number of items re-queued
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: Number of items per status
+        """
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    Work queue stored in a SQLite file. SQLite file locking makes it safe to share between
+    processes, and between machines through a shared filesystem with working locks.
+    """
+
+    def __init__(self, db_path: str = "work_queue.db", max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self._db_path = os.path.join(get_app_dir(), db_path)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # transactions are handled by hand, so a lease is a single BEGIN IMMEDIATE write transaction
+        self._conn = sqlite3.connect(self._db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                item TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_items_status ON items (status, lease_expires);
+            """
+        )
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._conn, self._lock)
+
+    def enqueue(self, items: Iterable[str]) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (item, updated_at) VALUES (?, ?)",
+                ((str(item), now) for item in items),
+            )
+            return conn.total_changes - before
+
+    def _requeue_expired(self, conn, now: float) -> int:
+        # the lease counted the attempt, a course crashing or hanging its workers runs out of them like a failing one
+        return conn.execute(
+            "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker_id = NULL, lease_expires = NULL, last_error = 'lease expired', updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        ).rowcount
+
+    def lease(self, worker_id: str, count: int = 1, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> List[str]:
+        now = time.time()
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+            items = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT item FROM items WHERE status = 'pending' ORDER BY attempts, rowid LIMIT ?",
+                    (count,),
+                )
+            ]
+            conn.executemany(
+                "UPDATE items SET status = 'leased', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE item = ?",
+                ((worker_id, now + visibility_timeout, now, item) for item in items),
+            )
+        return items
+
+    def heartbeat(self, worker_id: str, items: Iterable[str], visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> List[str]:
+        now = time.time()
+        extended = []
+        with self._transaction() as conn:
+            for item in items:
+                updated = conn.execute(
+                    "UPDATE items SET lease_expires = ?, updated_at = ? "
+                    "WHERE item = ? AND status = 'leased' AND worker_id = ?",
+                    (now + visibility_timeout, now, str(item), worker_id),
+                ).rowcount
+                if updated:
+                    extended.append(item)
+        return extended
+
+    def complete(self, worker_id: str, item: str) -> bool:
+        with self._transaction() as conn:
+            return bool(
+                conn.execute(
+                    "UPDATE items SET status = 'done', lease_expires = NULL, updated_at = ? "
+                    "WHERE item = ? AND status = 'leased' AND worker_id = ?",
+                    (time.time(), str(item), worker_id),
+                ).rowcount
+            )
+
+    def fail(self, worker_id: str, item: str, error: str = "") -> bool:
+        with self._transaction() as conn:
+            return bool(
+                conn.execute(
+                    "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "worker_id = NULL, lease_expires = NULL, last_error = ?, updated_at = ? "
+                    "WHERE item = ? AND status = 'leased' AND worker_id = ?",
+                    (self.max_attempts, error, time.time(), str(item), worker_id),
+                ).rowcount
+            )
+
+    def requeue_expired(self) -> int:
+        with self._transaction() as conn:
+            return self._requeue_expired(conn, time.time())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class _ImmediateTransaction:
+    """
+    Context manager running a BEGIN IMMEDIATE transaction, rolled back on errors
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._lock.acquire()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self._lock.release()
+            raise
+        return self._conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+
+
+class HTTPWorkQueue(WorkQueue):
+    """
+    Client of a work queue served over http, see serve_work_queue
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30, token: Optional[str] = None):
+        """
+        :param str base_url: http(s)://host:port of the server
+        :param float timeout: Seconds a call to the server can take
+        :param str token: Token of the server, WATCHER_UDEMY_QUEUE_TOKEN if None
+        """
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+        if token := token or os.environ.get(QUEUE_TOKEN_ENV):
+            self._session.headers["Authorization"] = f"Bearer {token}"
+
+    def _call(self, method: str, **payload):
+        response = self._session.post(f"{self.base_url}/{method}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["result"]
+
+    def enqueue(self, items: Iterable[str]) -> int:
+        return self._call("enqueue", items=[str(item) for item in items])
+
+    def lease(self, worker_id: str, count: int = 1, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> List[str]:
+        return self._call("lease", worker_id=worker_id, count=count, visibility_timeout=visibility_timeout)
+
+    def heartbeat(self, worker_id: str, items: Iterable[str], visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> List[str]:
+        return self._call("heartbeat", worker_id=worker_id, items=list(items), visibility_timeout=visibility_timeout)
+
+    def complete(self, worker_id: str, item: str) -> bool:
+        return self._call("complete", worker_id=worker_id, item=item)
+
+    def fail(self, worker_id: str, item: str, error: str = "") -> bool:
+        return self._call("fail", worker_id=worker_id, item=item, error=error)
+
+    def requeue_expired(self) -> int:
+        return self._call("requeue_expired")
+
+    def stats(self) -> Dict[str, int]:
+        return self._call("stats")
+
+
+QUEUE_METHODS = ("enqueue", "lease", "heartbeat", "complete", "fail", "requeue_expired", "stats")
+
+
+def serve_work_queue(
+        queue: WorkQueue, host: str = "127.0.0.1", port: int = 8765, token: Optional[str] = None
+) -> ThreadingHTTPServer:
+    """
+    Expose a work queue over http so workers on other machines can use it through HTTPWorkQueue
+
+    :param WorkQueue queue: Queue to expose, usually a SQLiteWorkQueue
+    :param str host: Interface to listen on
+    :param int port: Port to listen on, 0 picks a free one
+    :param str token: Token the workers have to send, WATCHER_UDEMY_QUEUE_TOKEN if None
+    :return: the server, call serve_forever on it
+    :raises ValueError: if the queue would be reachable from other machines without a token
+    """
+    token = token or os.environ.get(QUEUE_TOKEN_ENV)
+    if not token and host not in LOCAL_HOSTS:
+        raise ValueError(f"Serving the work queue on {host} needs a token, set {QUEUE_TOKEN_ENV}")
+
+    class WorkQueueHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, content: Dict) -> None:
+            body = json.dumps(content).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if token and not hmac.compare_digest(self.headers.get("Authorization") or "", f"Bearer {token}"):
+                self._send_json(401, {"error": "Missing or wrong token"})
+                return
+            method = self.path.strip("/")
+            if method not in QUEUE_METHODS:
+                self._send_json(404, {"error": f"Unknown queue method {method}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(payload, dict):
+                    raise TypeError("The payload has to be a json object")
+            except (TypeError, ValueError) as e:
+                self._send_json(400, {"error": f"Bad request: {e}"})
+                return
+            try:
+                result = getattr(queue, method)(**payload)
+            except TypeError as e:
+                self._send_json(400, {"error": f"Bad arguments: {e}"})
+                return
+            except Exception as e:
+                logger.error(f"Work queue call {method} failed: {e}", exc_info=True)
+                self._send_json(500, {"error": repr(e)})
+                return
+            self._send_json(200, {"result": result})
+
+        def log_message(self, format, *args):
+            logger.debug(f"work queue server: {format % args}")
+
+    return ThreadingHTTPServer((host, port), WorkQueueHandler)
+
+
+def open_work_queue(url: str) -> WorkQueue:
+    """
+    Open the work queue backend matching the url
+
+    :param str url: http(s)://host:port for a served queue, or a SQLite queue as in SQLAlchemy urls:
+        sqlite:///name.db relative to the app dir, sqlite:////absolute/path.db, or a plain path
+    :return: WorkQueue
+    """
+    if url.startswith("http://") or url.startswith("https://"):
+        return HTTPWorkQueue(url)
+    if url.startswith("sqlite:///"):
+        # the path starts after the third slash, so a fourth one makes it absolute
+        url = url[len("sqlite:///"):]
+    return SQLiteWorkQueue(url)
+
+
+class LeaseHeartbeat:
+    """
+    Keeps the leases on items alive from a background thread while they are being processed
+    """
+
+    def __init__(self, queue: WorkQueue, worker_id: str, items: List[str],
+                 visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.items = items
+        self.visibility_timeout = visibility_timeout
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name="lease-heartbeat", daemon=True)
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.visibility_timeout / 3):
+            try:
+                extended = self.queue.heartbeat(self.worker_id, self.items, self.visibility_timeout)
+            except Exception as e:
+                logger.warning(f"Lease heartbeat failed: {e}")
+                continue
+            lost = set(self.items) - set(extended)
+            if lost:
+                logger.warning(f"Lost the lease on {sorted(lost)}, another worker may process them")
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def dead_letter_file_name(cookie_file_name: str, domain: Optional[str]) -> str:
+    """
+    Name of the dead letters of an account, a course broken for one user may work for another one
+
+    :param str cookie_file_name: Name of the cookie file of the account, .cookie-<account name> or .cookie
+    :param str domain: business sub-domain of the account
+    :return: dead_letters-<account name>.json for the accounts of a manifest, dead_letters-<domain>.json otherwise
+    """
+    if cookie_file_name.startswith(".cookie-"):
+        return f"dead_letters{cookie_file_name[len('.cookie'):]}.json"
+    return f"dead_letters-{domain}.json"
+
+
+class RetryQueue:
+    """
+    In-process queue of the courses of a run. Items are pulled lazily from their source, failed
+    items come back after an exponential backoff and the ones out of attempts go to a dead-letter
+    list kept across runs, so a broken course can't pin the runner.
+    """
+
+    def __init__(
+            self,
+            items: Iterable[str] = (),
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            retry_delay: float = DEFAULT_RETRY_DELAY,
+            max_retry_delay: float = DEFAULT_MAX_RETRY_DELAY,
+            dead_letter_file_name: Optional[str] = "dead_letters.json",
+            dead_letter_ttl: float = DEFAULT_DEAD_LETTER_TTL,
+    ):
+        """
+        :param items: Items to process, consumed lazily
+        :param int max_attempts: Attempts of an item before it is dead-lettered
+        :param float retry_delay: Delay before the first retry, doubled on every attempt
+        :param float max_retry_delay: Upper bound of the delay between two attempts
+        :param str dead_letter_file_name: File of the dead letters in the app dir, None to not persist them
+        :param float dead_letter_ttl: Seconds a dead letter is skipped before it is tried again
+        """
+        self._source = iter(items)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.dead_letter_ttl = dead_letter_ttl
+        self._dead_letter_file = (
+            os.path.join(get_app_dir(), dead_letter_file_name) if dead_letter_file_name else None
+        )
+        # ready items in arrival order, removal from anywhere is O(1)
+        self._ready = OrderedDict()
+        # (ready at, sequence, item) of the items waiting for their backoff
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._attempts = {}
+        self._requeued = set()
+        self.dead_letters = self._load_dead_letters()
+        self.dead_lettered_this_run = []
+
+    def _load_dead_letters(self) -> Dict[str, Dict]:
+        if not self._dead_letter_file or not os.path.isfile(self._dead_letter_file):
+            return {}
+        try:
+            with open(self._dead_letter_file) as f:
+                dead_letters = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't read the dead letters: {e}")
+            return {}
+        now = time.time()
+        return {
+            item: entry for item, entry in dead_letters.items()
+            if now - entry.get("failed_at", 0) < self.dead_letter_ttl
+        }
+
+    def _save_dead_letters(self) -> None:
+        if not self._dead_letter_file:
+            return
+        tmp_file = f"{self._dead_letter_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.dead_letters, f, indent=1)
+        os.replace(tmp_file, self._dead_letter_file)
+
+    def add(self, item: str) -> bool:
+        """
+        Queue an item, the source is expected to be free of duplicates already
+
+        :return: False if the item is already waiting or is a dead letter
+        """
+        if item in self._ready or item in self._attempts:
+            return False
+        if item in self.dead_letters:
+            logger.info(f"Skipping {item}, dead-lettered: {self.dead_letters[item].get('error')}")
+            return False
+        self._ready[item] = None
+        return True
+
+    def get(self) -> Optional[str]:
+        """
+        Next item to process, waits for the backoff of a failed item when nothing else is left
+
+        :return: the item, None when the queue is exhausted
+        """
+        while True:
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._ready[heapq.heappop(self._delayed)[2]] = None
+            if self._ready:
+                return self._ready.popitem(last=False)[0]
+            for item in self._source:
+                if self.add(item):
+                    return self._ready.popitem(last=False)[0]
+            if not self._delayed:
+                return None
+            wait = self._delayed[0][0] - now
+            logger.info(f"Waiting {wait:.0f}s before retrying {self._delayed[0][2]}")
+            time.sleep(wait)
+
+    def done(self, item: str) -> None:
+        self._attempts.pop(item, None)
+
+    def requeue(self, item: str) -> bool:
+        """
+        Queue an item again right away without counting an attempt, for a failure that isn't the item's
+        fault. An item is requeued this way once
+
+        :return: False if the item was requeued already
+        """
+        if item in self._requeued:
+            return False
+        self._requeued.add(item)
+        self._ready[item] = None
+        return True
+
+    def retry(self, item: str, error: str = "") -> bool:
+        """
+        Schedule a failed item again after a backoff, or dead-letter it once it ran out of attempts
+
+        :return: False if the item was dead-lettered
+        """
+        attempts = self._attempts.get(item, 0) + 1
+        if attempts >= self.max_attempts:
+            self.dead_letter(item, error, attempts)
+            return False
+        self._attempts[item] = attempts
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        logger.info(f"Retrying {item} in {delay:.0f}s, attempt {attempts + 1}/{self.max_attempts}")
+        heapq.heappush(self._delayed, (time.time() + delay, next(self._sequence), item))
+        return True
+
+    def dead_letter(self, item: str, error: str = "", attempts: Optional[int] = None) -> None:
+        """
+        Give up on an item, it is skipped by the next runs until its dead letter expires
+        """
+        attempts = attempts if attempts is not None else self._attempts.get(item, 0) + 1
+        self._attempts.pop(item, None)
+        logger.warning(f"Giving up on {item} after {attempts} attempts: {error}")
+        self.dead_letters[item] = {"error": error, "attempts": attempts, "failed_at": time.time()}
+        self.dead_lettered_this_run.append(item)
+        self._save_dead_letters()
+
+    def __len__(self) -> int:
+        """
+        :return: Number of items known to be left, the source isn't counted
+        """
+        return len(self._ready) + len(self._delayed)